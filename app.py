@@ -1,7 +1,18 @@
 import chainlit as cl
-import random
-from main import get_app, get_recommendation_app
+from main import get_app, get_recommendation_app, session_config, end_session
 from langchain_core.messages import HumanMessage, AIMessage
+import startup
+import telemetry
+import llm_scheduler
+from tools import aadd_to_cart, aget_cart, acheckout, asearch_food_page
+from streaming import stream_events, is_food_list
+
+# گرم کردن مدل امبدینگ، LanceDB، ایندکس جستجو و گراف‌ها همزمان با بالا آمدن سرور شروع می‌شود، نه در اولین پیام.
+startup.start_warmup()
+# با CHATFOOD_METRICS_PORT متریک‌های Prometheus روی /metrics همان پورت منتشر می‌شوند.
+telemetry.start_metrics_server()
+STARTUP_WAIT_SECONDS = 60
+BUSY_MESSAGE = "⏳ هنوز در حال پاسخ به پیام قبلی شما هستم؛ لطفا بعد از پایان آن پیام بعدی را بفرستید."
 
 # ==================== Action Callbacks ====================
 
@@ -9,14 +20,36 @@ from langchain_core.messages import HumanMessage, AIMessage
 async def on_add_to_cart(action: cl.Action):
     """زمانی اجرا می‌شود که کاربر روی دکمه 'افزودن به سبد خرید' کلیک می‌کند."""
     food_name = action.payload.get("food_name")
-    cart = cl.user_session.get("cart", [])
-    cart.append(food_name)
-    cl.user_session.set("cart", cart)
+    user = cl.user_session.get("user")
+    try:
+        count = await aadd_to_cart(get_cart_id(), food_name, 1, user.identifier if user else None)
+    except ValueError as e:
+        print(f"!!! افزودن به سبد رد شد: {e}")
+        await cl.Message(content="متاسفم، این غذا در منو پیدا نشد.").send()
+        return
 
     await cl.Message(
-        content=f"✅ **{food_name}** با موفقیت به سبد خرید اضافه شد!\nشما در حال حاضر **{len(cart)}** آیتم در سبد دارید."
+        content=f"✅ **{food_name}** با موفقیت به سبد خرید اضافه شد!\nشما در حال حاضر **{count}** آیتم در سبد دارید."
     ).send()
 
+@cl.action_callback("checkout")
+async def on_checkout(action: cl.Action):
+    """زمانی اجرا می‌شود که کاربر روی دکمه 'ثبت سفارش' کلیک می‌کند."""
+    user = cl.user_session.get("user")
+    result = await acheckout(get_cart_id(), user.identifier if user else None)
+    await cl.Message(content=f"🧾 {result}").send()
+
+@cl.action_callback("more_foods")
+async def on_more_foods(action: cl.Action):
+    """صفحه‌ی بعد نتایج جستجو (یا همان جستجو به ترتیب قیمت) را در یک پیام جدید نمایش می‌دهد."""
+    await action.remove()
+    search = {key: action.payload.get(key) for key in ("query", "max_price", "sort")}
+    page = await asearch_food_page(search["query"], search["max_price"], action.payload.get("cursor"), search["sort"] or "relevance")
+    if page.get("error"):
+        await cl.Message(content=page["error"]).send()
+        return
+    await send_food_grid({**page, **search}, set(), start=action.payload.get("start", 0))
+
 @cl.action_callback("offer_response")
 async def on_offer_response(action: cl.Action):
     """زمانی اجرا می‌شود که کاربر به پیشنهاد ویژه پاسخ می‌دهد."""
@@ -32,118 +65,183 @@ async def on_offer_response(action: cl.Action):
 
 # ==================== توابع کمکی ====================
 
+def get_cart_id() -> str:
+    """سبد کاربر وارد شده به شناسه‌ی خودش بسته است تا در اتصال‌های بعدی و روی همه‌ی workerها همان سبد دیده شود."""
+    user = cl.user_session.get("user")
+    return user.identifier if user else cl.user_session.get("id")
+
+async def send_cart():
+    """سبد خرید را از پایگاه داده (با قیمت‌ها و تعدادها) نمایش می‌دهد."""
+    cart = await aget_cart(get_cart_id())
+    if cart.get("error"):
+        await cl.Message(content=cart["error"]).send()
+    elif not cart["items"]:
+        await cl.Message(content="🛒 سبد خرید شما خالی است.").send()
+    else:
+        cart_content = "\n".join(
+            f"- **{item['name']}** ({item['restaurant']}) × {item['quantity']}: {item['subtotal']:,.0f} تومان" for item in cart["items"]
+        )
+        await cl.Message(
+            content=f"🛒 اقلام موجود در سبد خرید شما:\n{cart_content}\n\n**مجموع: {cart['total']:,.0f} تومان**",
+            actions=[cl.Action(name="checkout", label="✅ ثبت سفارش", payload={})],
+        ).send()
+
 def is_food_list_response(tool_output: list | None) -> bool:
     """تشخیص می‌دهد آیا خروجی ابزار، لیستی از غذاهاست."""
-    return isinstance(tool_output, list) and len(tool_output) > 0 and isinstance(tool_output[0], dict) and "name" in tool_output[0]
+    return is_food_list(tool_output)
+
+async def send_food_grid(page: dict, shown: set, start: int = 0):
+    """
+    یک صفحه از نتایج جستجو را در یک پیام (جدول) با دکمه‌ی افزودن به سبد برای هر غذا نمایش می‌دهد؛ غذاهایی که
+    قبلاً نمایش داده شده‌اند تکرار نمی‌شوند. اگر نتایج بیشتری باشد دکمه‌ی «بیشتر» صفحه‌ی بعد را می‌خواند.
+    """
+    items = [item for item in page["items"] if item["name"] not in shown]
+    if not items:
+        return
+    shown.update(item["name"] for item in items)
+    total = page.get("total") or len(items)
+    by_price = page.get("sort") == "price"
+    rows = "\n".join(
+        f"| {start + i} | **{item['name']}** | {item['restaurant']} | {float(item['price']):,.0f} |" for i, item in enumerate(items, 1)
+    )
+    actions = [cl.Action(name="add_to_cart", label=f"🛒 {item['name']}", payload={"food_name": item["name"]}) for item in items]
+    search = {"query": page.get("query"), "max_price": page.get("max_price"), "sort": page.get("sort", "relevance")}
+    if page.get("next_cursor") and search["query"]:
+        actions.append(cl.Action(name="more_foods", label=f"⬇️ نمایش بیشتر ({start + len(items)} از {total})",
+                                 payload={**search, "cursor": page["next_cursor"], "start": start + len(items)}))
+    if start == 0 and not by_price and total > len(items) and search["query"]:
+        actions.append(cl.Action(name="more_foods", label="💰 ارزان‌ترین‌ها اول", payload={**search, "sort": "price", "cursor": None}))
+    await cl.Message(
+        content=f"🍽 {total:,} غذا پیدا شد" + (" (ارزان‌ترین‌ها اول)" if by_price else "") + ":\n\n"
+                "| # | غذا | رستوران | قیمت (تومان) |\n|---|---|---|---|\n" + rows,
+        actions=actions,
+    ).send()
 
 # ==================== شروع چت ====================
 
 @cl.on_chat_start
 async def on_chat_start():
-    app = get_app()
-    cl.user_session.set("app", app)
-    cl.user_session.set("message_history", [])
-    cl.user_session.set("cart", [])
-
-    message_history = cl.user_session.get("message_history")
-
-    # ایجاد پیام پیشنهاد ویژه
-    if random.choice([True, True]):
-        processing_msg = cl.Message(content="لحظه‌ای لطفاً، در حال آماده کردن یک پیشنهاد ویژه برای شما هستم...")
-        await processing_msg.send()
-
-        recommendation_app = get_recommendation_app()
-        inputs = {"messages": [HumanMessage(content="یک پیشنهاد برای user123 بساز")]}
-        proactive_message_content = ""
-
-        async for event in recommendation_app.astream(inputs):
-            for key, value in event.items():
-                if "messages" in value:
-                    proactive_message_content = value["messages"][-1].content
-
-        await processing_msg.remove()
-
+    if not startup.is_ready():
+        loading_msg = cl.Message(content="⏳ در حال آماده‌سازی دستیار، چند لحظه صبر کنید...")
+        await loading_msg.send()
+        await startup.await_ready(timeout=STARTUP_WAIT_SECONDS)
+        await loading_msg.remove()
+
+    # گراف‌ها بین همه جلسه‌ها مشترک‌اند؛ تاریخچه هر جلسه در checkpointer با thread_id همین جلسه ذخیره می‌شود.
+    # سبد خرید در پایگاه داده است (cart_store)، نه در user_session.
+
+    # پیام پیشنهاد ویژه از cache پیشنهادهای از پیش محاسبه شده‌ی همین کاربر خوانده می‌شود (بدون LLM).
+    user = cl.user_session.get("user")
+    config = {"configurable": {"user_id": user.identifier if user else None}}
+    inputs = {"messages": [HumanMessage(content="یک پیشنهاد برای این کاربر بساز")]}
+    proactive_message_content = ""
+    try:
+        # پیشنهاد فعال در زمان‌بند LLM اولویت پس‌زمینه دارد و جلوی نوبت‌های کاربران را نمی‌گیرد.
+        with llm_scheduler.session(cl.user_session.get("id"), llm_scheduler.BACKGROUND):
+            async for kind, payload in stream_events(get_recommendation_app(), inputs, config):
+                if kind == "done":
+                    proactive_message_content = payload["content"]
+    except Exception as e:
+        print(f"!!! خطا در دریافت پیشنهاد ویژه: {e}")
+
+    if proactive_message_content:
         actions = [
             cl.Action(name="offer_response", label="😍 بله، عالیه!", payload={"value": "accept"}),
             cl.Action(name="offer_response", label="🤔 نه، ممنون", payload={"value": "reject"}),
         ]
-
         await cl.Message(content=proactive_message_content, actions=actions).send()
-        message_history.append(AIMessage(content=proactive_message_content))
-        cl.user_session.set("message_history", message_history)
+        # پیام آغازین همراه اولین پیام کاربر وارد تاریخچه‌ی checkpointer می‌شود.
+        cl.user_session.set("greeting", proactive_message_content)
     else:
         welcome_message = "سلام! من ربات ChatFood هستم. چطور می‌توانم امروز به شما کمک کنم؟"
         await cl.Message(content=welcome_message).send()
-        message_history.append(AIMessage(content=welcome_message))
-        cl.user_session.set("message_history", message_history)
+        cl.user_session.set("greeting", welcome_message)
+
+@cl.on_chat_end
+async def on_chat_end():
+    await end_session(cl.user_session.get("id"))
 
 # ==================== دریافت پیام از کاربر ====================
 
 @cl.on_message
 async def on_message(message: cl.Message):
-    app = cl.user_session.get("app")
-    message_history = cl.user_session.get("message_history")
-    message_history.append(HumanMessage(content=message.content))
-    inputs = {"messages": message_history, "tool_output": None}
+    # تا وقتی نوبت قبلی همین جلسه در حال اجراست هر پیام تازه‌ای رد می‌شود (دو بار زدن Enter یا پیام دوم)؛
+    # دو نوبت همزمان روی یک thread_id تاریخچه‌ی checkpointer را به هم می‌ریزند.
+    if cl.user_session.get("pending_message") is not None:
+        await cl.Message(content=BUSY_MESSAGE).send()
+        return
+    cl.user_session.set("pending_message", message.content)
+    try:
+        # فراخوانی‌های LLM این نوبت در زمان‌بند به همین جلسه نسبت داده می‌شوند (نوبت‌دهی منصفانه بین جلسه‌ها).
+        with llm_scheduler.session(cl.user_session.get("id")):
+            await handle_message(message)
+    finally:
+        cl.user_session.set("pending_message", None)
+
+async def handle_message(message: cl.Message):
+    app = get_app()
+    config = session_config(cl.user_session.get("id"), get_cart_id())
+    new_messages = [HumanMessage(content=message.content)]
+    greeting = cl.user_session.get("greeting")
+    if greeting:
+        new_messages.insert(0, AIMessage(content=greeting))
+        cl.user_session.set("greeting", None)
+    inputs = {"messages": new_messages, "tool_output": None}
 
     final_response_content = ""
-    food_items = None
-
-    async with cl.Step(type="tool") as step:
-        step.name = "Processing Agent"
-        step.input = message.content
-        await step.send()
-
-        try:
-            current_node = ""
-            async for event in app.astream(inputs):
-                for key, value in event.items():
-                    current_node = key
-                    step.output = f"🔄 در حال پردازش: {current_node.replace('_', ' ').title()}..."
-                    await step.update()
-
-                    if "messages" in value:
-                        last_message = value["messages"][-1]
-                        if last_message.type == "ai" and not last_message.tool_calls and getattr(last_message, 'content', ''):
-                            final_response_content = last_message.content
-
-                    if value.get("tool_output"):
-                        food_items = value.get("tool_output")
-
-            if final_response_content:
-                message_history.append(AIMessage(content=final_response_content))
-            cl.user_session.set("message_history", message_history)
-            step.output = "✅ انجام شد!"
-            await step.update()
-
-        except Exception as e:
-            print(f"!!! خطای اجرای گراف: {e}")
+    current_node = ""
+    shown_foods = set()
+    # پاسخ ایجنت توکن به توکن در این پیام استریم می‌شود؛ Step فقط وضعیت پردازش را نشان می‌دهد.
+    answer_msg = cl.Message(content="")
+
+    step = cl.Step(name="Processing Agent", type="tool")
+    step.input = message.content
+    await step.send()
+
+    try:
+        async for kind, payload in stream_events(app, inputs, config):
+            if kind == "node":
+                current_node = payload
+                step.output = f"🔄 در حال پردازش: {current_node.replace('_', ' ').title()}..."
+                await step.update()
+
+            elif kind == "foods":
+                # جدول غذاها به محض رسیدن نتیجه‌ی ابزار نمایش داده می‌شود.
+                await send_food_grid(payload, shown_foods)
+
+            elif kind == "token":
+                agent, text = payload
+                # پاسخ متنی ایجنت سبد خرید و متن بعد از کارت‌های غذا مثل قبل نمایش داده نمی‌شود.
+                if agent != "cart_agent" and not shown_foods:
+                    await answer_msg.stream_token(text)
+
+            elif kind == "done":
+                current_node = payload["agent"] or current_node
+                final_response_content = payload["content"]
+                if is_food_list_response(payload["tool_output"]):
+                    await send_food_grid({"items": payload["tool_output"], **(payload["food_page"] or {})}, shown_foods)
+
+        step.output = "✅ انجام شد!"
+        await step.update()
+
+    except Exception as e:
+        print(f"!!! خطای اجرای گراف: {e}")
+        if llm_scheduler.is_overloaded(e):
+            final_response_content = llm_scheduler.OVERLOADED_MESSAGE
+        else:
             final_response_content = "متاسفم، یک خطای پیش‌بینی نشده رخ داد."
-            step.output = f"❌ Error: {e}"
-            await step.update()
+        if answer_msg.content:
+            answer_msg.content += f"\n\n{final_response_content}"
+        step.output = f"❌ Error: {e}"
+        await step.update()
 
     # ==================== نمایش پاسخ ====================
     if current_node == "cart_agent":
-        cart = cl.user_session.get("cart", [])
-        if not cart:
-            await cl.Message(content="🛒 سبد خرید شما خالی است.").send()
-        else:
-            cart_content = "\n".join([f"- **{item}**" for item in cart])
-            await cl.Message(content=f"🛒 اقلام موجود در سبد خرید شما:\n{cart_content}").send()
-
-    elif is_food_list_response(food_items):
-        # نمایش هر آیتم با دکمه افزودن به سبد خرید
-        for item in food_items:
-            await cl.Message(
-                content=f"🍽 **{item['name']}**\nرستوران: {item['restaurant']}\nقیمت: {float(item['price']):,} تومان",
-                actions=[
-                    cl.Action(
-                        name="add_to_cart",
-                        label="🛒 افزودن به سبد خرید",
-                        payload={"food_name": item["name"]}
-                    )
-                ]
-            ).send()
-
-    elif final_response_content:
-        await cl.Message(content=final_response_content).send()
\ No newline at end of file
+        await send_cart()
+
+    elif answer_msg.content:
+        # پایان استریم
+        await answer_msg.send()
+
+    elif final_response_content and not shown_foods:
+        await cl.Message(content=final_response_content).send()
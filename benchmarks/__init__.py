@@ -0,0 +1,3 @@
+"""
+اسکریپت‌های بنچمارک ChatFood. هر ماژول را از ریشه پروژه با `python -m benchmarks.<name>` اجرا کنید.
+"""
@@ -0,0 +1,72 @@
+import os
+import random
+import sqlite3
+
+CATEGORIES = ['فست فود', 'ایرانی', 'ایتالیایی', 'پیش غذا', 'دریایی', 'گیاهی', 'صبحانه', 'دسر']
+DISHES = ['پیتزا', 'برگر', 'کباب', 'پاستا', 'سالاد', 'خورش', 'ساندویچ', 'استیک', 'سوپ', 'چلو', 'میگو', 'کیک']
+ADJECTIVES = ['ویژه', 'ذغالی', 'مخصوص', 'خانگی', 'تند', 'سنتی', 'دودی', 'کلاسیک', 'پنیری', 'سبزیجات']
+STATUSES = ['تحویل داده شده', 'تحویل داده شده', 'تحویل داده شده', 'لغو شده', 'در حال آماده‌سازی']
+
+
+def build_menu_db(db_path: str, n_foods: int, n_orders: int = 0, n_users: int = 1000, seed: int = 42) -> str:
+    """یک پایگاه داده مصنوعی با همان ساختار setup_database.py می‌سازد (اگر از قبل با همین اندازه وجود نداشته باشد)."""
+    marker = f"{db_path}.{n_foods}.{n_orders}.ok"
+    if os.path.exists(db_path) and os.path.exists(marker):
+        return db_path
+    if os.path.exists(db_path):
+        os.remove(db_path)
+    os.makedirs(os.path.dirname(db_path) or ".", exist_ok=True)
+    rng = random.Random(seed)
+    conn = sqlite3.connect(db_path)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("CREATE TABLE foods (id INTEGER PRIMARY KEY AUTOINCREMENT, name TEXT NOT NULL UNIQUE, category TEXT NOT NULL, restaurant_name TEXT NOT NULL, price REAL NOT NULL)")
+    conn.execute("CREATE TABLE orders (id INTEGER PRIMARY KEY AUTOINCREMENT, user_id TEXT NOT NULL, food_name TEXT NOT NULL, status TEXT NOT NULL, review TEXT)")
+    foods = [
+        (f"{rng.choice(DISHES)} {rng.choice(ADJECTIVES)} {i}", rng.choice(CATEGORIES), f"رستوران {rng.randint(1, 500)}", rng.randint(50, 900) * 1000)
+        for i in range(n_foods)
+    ]
+    conn.executemany("INSERT INTO foods (name, category, restaurant_name, price) VALUES (?, ?, ?, ?)", foods)
+    batch = []
+    for _ in range(n_orders):
+        batch.append((f"user{rng.randint(1, n_users)}", foods[rng.randrange(n_foods)][0], rng.choice(STATUSES), None))
+        if len(batch) >= 50000:
+            conn.executemany("INSERT INTO orders (user_id, food_name, status, review) VALUES (?, ?, ?, ?)", batch)
+            batch.clear()
+    if batch:
+        conn.executemany("INSERT INTO orders (user_id, food_name, status, review) VALUES (?, ?, ?, ?)", batch)
+    conn.commit()
+    conn.close()
+    open(marker, "w").close()
+    return db_path
+
+
+def build_rag_corpus(db_dir: str, n_docs: int, embed, batch_size: int = 2000, seed: int = 42) -> str:
+    """
+    جدول food_rag مصنوعی با همان ساختار setup_rag.py (متن، metadata با source/category/restaurant) در LanceDB
+    می‌سازد و اگر بزرگ‌تر از INDEX_MIN_ROWS باشد ایندکس ANN آن را هم می‌سازد. embed یک تابع لیست متن -> بردارها است.
+    """
+    import lancedb
+    from retrieval import TABLE_NAME, build_vector_index
+
+    marker = os.path.join(db_dir, f"{TABLE_NAME}.{n_docs}.ok")
+    if os.path.exists(marker):
+        return db_dir
+    rng = random.Random(seed)
+    connection = lancedb.connect(db_dir)
+    table = None
+    for start in range(0, n_docs, batch_size):
+        chunks = []
+        for i in range(start, min(start + batch_size, n_docs)):
+            dish, adjective, category = rng.choice(DISHES), rng.choice(ADJECTIVES), rng.choice(CATEGORIES)
+            text = (f"{dish} {adjective} یکی از غذاهای {category} است. برای تهیه‌ی {dish} {adjective} "
+                    f"مواد تازه و ادویه‌ی {rng.choice(ADJECTIVES)} استفاده می‌شود. نکته‌ی شماره {i}.")
+            chunks.append({"id": f"doc-{i}", "text": text, "metadata": {
+                "source": f"synthetic/{category}.md", "category": category, "restaurant": f"رستوران {rng.randint(1, 500)}"}})
+        rows = [{"vector": list(map(float, vector)), **chunk} for vector, chunk in zip(embed([c["text"] for c in chunks]), chunks)]
+        if table is None:
+            table = connection.create_table(TABLE_NAME, data=rows, mode="overwrite")
+        else:
+            table.add(rows)
+    build_vector_index(table)
+    open(marker, "w").close()
+    return db_dir
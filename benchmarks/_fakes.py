@@ -0,0 +1,120 @@
+"""
+جایگزین‌های محلی و قطعی برای اجرای گراف‌ها بدون شبکه: مدل چت با تاخیر قابل تنظیم و امبدینگ hash کلمات.
+"""
+import asyncio
+import json
+import re
+import time
+import zlib
+from typing import Any, List
+
+import numpy as np
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+from langchain_core.runnables import RunnableLambda
+
+from search_index import normalize_text
+
+DIM = 384
+_DIGITS = re.compile(r"\d+")
+# مقصد مسیریاب برای پیام‌هایی که به لایه‌ی LLM می‌رسند (اولین کلیدواژه‌ی پیدا شده)
+_ROUTE_KEYWORDS = [("سفارش", "OrderManager"), ("سبد", "CartAgent"), ("قیمت", "FilterAgent"), ("ارزان", "FilterAgent"),
+                   ("چی", "InformationAgent"), ("چطور", "InformationAgent")]
+
+
+def hash_encoder(texts: list) -> np.ndarray:
+    """امبدینگ کیسه‌ی کلمات با hash ثابت (crc32)؛ متن‌های با کلمات مشترک شبیه‌اند و نتیجه در هر اجرا یکی است."""
+    vectors = np.zeros((len(texts), DIM), dtype=np.float32)
+    for row, text in enumerate(texts):
+        for word in normalize_text(text).split():
+            vectors[row, zlib.crc32(word.encode("utf-8")) % DIM] += 1.0
+        vectors[row, zlib.crc32(text.encode("utf-8")) % DIM] += 0.1
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+class FakeChatModel(BaseChatModel):
+    """
+    جایگزین ChatOpenAI: بعد از پیام کاربر اولین ابزار متصل را با آرگومان‌های استخراج شده از متن فرا می‌خواند،
+    و بعد از نتیجه‌ی ابزار یک پاسخ answer_tokens توکنی استریم می‌کند. تاخیرها با first_token_ms و token_ms
+    تنظیم می‌شوند و usage_metadata مثل OpenAI گزارش می‌شود.
+    """
+
+    first_token_ms: float = 300.0
+    token_ms: float = 15.0
+    answer_tokens: int = 40
+    tools: List[Any] = []
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake-chat"
+
+    def bind_tools(self, tools, **kwargs):
+        return self.model_copy(update={"tools": list(tools)})
+
+    def with_structured_output(self, schema, **kwargs):
+        def decide(prompt_value):
+            text = prompt_value.to_string() if hasattr(prompt_value, "to_string") else str(prompt_value)
+            text = text.rsplit("<user_input>", 1)[-1]
+            return schema(destination=next((dest for word, dest in _ROUTE_KEYWORDS if word in text), "FoodSearch"))
+
+        def route(prompt_value):
+            time.sleep(self.first_token_ms / 1000)
+            return decide(prompt_value)
+
+        async def aroute(prompt_value):
+            await asyncio.sleep(self.first_token_ms / 1000)
+            return decide(prompt_value)
+        return RunnableLambda(route, afunc=aroute)
+
+    def _tool_call(self, text: str) -> dict:
+        tool = self.tools[0]
+        args = {}
+        numbers = [int(n) for n in _DIGITS.findall(normalize_text(text))]
+        if "query" in tool.args:
+            args["query"] = text
+        if "order_id" in tool.args:
+            args["order_id"] = numbers[0] if numbers else 1
+        if "max_price" in tool.args and numbers:
+            args["max_price"] = float(numbers[-1] * (1000 if "هزار" in text else 1))
+        return {"name": tool.name, "args": args, "id": f"fake_{zlib.crc32(text.encode('utf-8')):x}"}
+
+    def _respond(self, messages: list) -> AIMessage:
+        last = messages[-1]
+        prompt_tokens = sum(len(str(message.content)) for message in messages) // 3 + 1
+        if self.tools and last.type == "human":
+            call = self._tool_call(str(last.content))
+            return AIMessage(content="", tool_calls=[call], usage_metadata={"input_tokens": prompt_tokens, "output_tokens": 10, "total_tokens": prompt_tokens + 10})
+        content = " ".join(f"کلمه{i}" for i in range(self.answer_tokens))
+        return AIMessage(content=content, usage_metadata={"input_tokens": prompt_tokens, "output_tokens": self.answer_tokens,
+                                                          "total_tokens": prompt_tokens + self.answer_tokens})
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+        message = self._respond(messages)
+        time.sleep((self.first_token_ms + self.token_ms * len(message.content.split())) / 1000)
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs):
+        message = self._respond(messages)
+        await asyncio.sleep((self.first_token_ms + self.token_ms * len(message.content.split())) / 1000)
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    async def _astream(self, messages, stop=None, run_manager=None, **kwargs):
+        message = self._respond(messages)
+        await asyncio.sleep(self.first_token_ms / 1000)
+        if message.tool_calls:
+            call = message.tool_calls[0]
+            yield ChatGenerationChunk(message=AIMessageChunk(
+                content="", usage_metadata=message.usage_metadata,
+                tool_call_chunks=[{"name": call["name"], "args": json.dumps(call["args"], ensure_ascii=False), "id": call["id"], "index": 0}]))
+            return
+        words = message.content.split(" ")
+        for i, word in enumerate(words):
+            if i:
+                await asyncio.sleep(self.token_ms / 1000)
+            text = word if i == 0 else " " + word
+            chunk = ChatGenerationChunk(message=AIMessageChunk(
+                content=text, usage_metadata=message.usage_metadata if i == len(words) - 1 else None))
+            if run_manager:
+                await run_manager.on_llm_new_token(text, chunk=chunk)
+            yield chunk
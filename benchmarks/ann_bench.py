@@ -0,0 +1,100 @@
+"""
+بنچمارک دقت (recall@k) در برابر تاخیر برای جدول برداری LanceDB: جستجوی کامل (flat) در برابر ایندکس IVF-PQ
+با چند مقدار nprobes و refine_factor. بردارها مصنوعی و خوشه‌ای هستند (هم‌بعد MiniLM یعنی ۳۸۴).
+
+    python -m benchmarks.ann_bench --sizes 10000,100000
+    python -m benchmarks.ann_bench --sizes 1000000 --queries 50   # نیازمند چند گیگابایت حافظه و دیسک
+"""
+import argparse
+import os
+import shutil
+import statistics
+import time
+
+import lancedb
+import numpy as np
+
+from retrieval import build_vector_index, INDEX_METRIC
+
+DIM = 384
+K = 10
+SETTINGS = [(10, None), (20, None), (20, 5), (50, 10)]
+
+
+def _vectors(rng, n: int, centers: np.ndarray) -> np.ndarray:
+    labels = rng.integers(0, len(centers), size=n)
+    vectors = centers[labels] + rng.normal(scale=0.35, size=(n, DIM)).astype(np.float32)
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+def _build_table(db, n: int, rng, centers):
+    batch = 100000
+    table = None
+    for start in range(0, n, batch):
+        vectors = _vectors(rng, min(batch, n - start), centers)
+        rows = [{"vector": v, "id": str(start + i), "text": f"doc {start + i}",
+                 "metadata": {"source": "bench", "category": "", "restaurant": ""}} for i, v in enumerate(vectors)]
+        table = db.create_table(f"bench_{n}", data=rows, mode="overwrite") if table is None else table
+        if start:
+            table.add(rows)
+    return table
+
+
+def _ground_truth(table, queries: np.ndarray) -> list:
+    matrix = np.stack(table.to_arrow().column("vector").to_numpy(zero_copy_only=False))
+    ids = table.to_arrow().column("id").to_pylist()
+    truth = []
+    for q in queries:
+        top = np.argpartition(-(matrix @ q), K)[:K]
+        truth.append({ids[i] for i in top})
+    return truth
+
+
+def _run(table, queries, truth, nprobes=None, refine=None, flat=False) -> tuple:
+    recalls, timings = [], []
+    for q, expected in zip(queries, truth):
+        start = time.perf_counter()
+        query = table.search(q).distance_type(INDEX_METRIC).limit(K).select(["id"])
+        if flat:
+            query = query.bypass_vector_index()
+        else:
+            query = query.nprobes(nprobes)
+            if refine:
+                query = query.refine_factor(refine)
+        found = {row["id"] for row in query.to_list()}
+        timings.append((time.perf_counter() - start) * 1000)
+        recalls.append(len(found & expected) / K)
+    timings.sort()
+    return statistics.mean(recalls), statistics.median(timings), timings[int(len(timings) * 0.95) - 1]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", default="10000,100000")
+    parser.add_argument("--queries", type=int, default=100)
+    parser.add_argument("--db", default=os.path.join("db", "bench_ann"))
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(7)
+    centers = rng.normal(size=(256, DIM)).astype(np.float32)
+    db = lancedb.connect(args.db)
+    print(f"{'n':>9} {'روش':<28}{'recall@10':>10}{'p50 (ms)':>10}{'p95 (ms)':>10}")
+    for n in (int(s) for s in args.sizes.split(",")):
+        table = _build_table(db, n, rng, centers)
+        queries = _vectors(rng, args.queries, centers)
+        truth = _ground_truth(table, queries)
+        recall, p50, p95 = _run(table, queries, truth, flat=True)
+        print(f"{n:>9} {'flat':<28}{recall:>10.3f}{p50:>10.2f}{p95:>10.2f}")
+        start = time.perf_counter()
+        build_vector_index(table, force=True)
+        print(f"{n:>9} {'ساخت IVF-PQ':<28}{'':>10}{(time.perf_counter() - start) * 1000:>10.0f}")
+        for nprobes, refine in SETTINGS:
+            recall, p50, p95 = _run(table, queries, truth, nprobes, refine)
+            label = f"ivf_pq nprobes={nprobes}" + (f" refine={refine}" if refine else "")
+            print(f"{n:>9} {label:<28}{recall:>10.3f}{p50:>10.2f}{p95:>10.2f}")
+        db.drop_table(f"bench_{n}")
+    shutil.rmtree(args.db, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+"""
+بنچمارک سبد خرید: N کاربر همزمان که هر کدام پشت سر هم روی «افزودن به سبد» کلیک می‌کنند.
+نوشتن مستقیم (یک تراکنش upsert برای هر کلیک) با بافر write-behind ماژول cart_store مقایسه می‌شود.
+برای هر حالت زمان کل، تاخیر هر کلیک و تعداد تراکنش‌های نوشتن گزارش می‌شود و در پایان درستی تعدادها بررسی می‌شود.
+
+    python -m benchmarks.cart_bench --users 50 --clicks 40
+"""
+import argparse
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import cart_store
+import database
+import tools
+from benchmarks._data import build_menu_db
+
+FOODS_PER_CART = 5
+
+
+def _direct_add(cart_id: str, food_name: str):
+    now = time.time()
+    with database.connection() as conn:
+        with conn:
+            conn.execute("INSERT INTO carts (cart_id, created, updated) VALUES (?, ?, ?) ON CONFLICT (cart_id) DO UPDATE SET updated = excluded.updated",
+                         (cart_id, now, now))
+            conn.execute("""INSERT INTO cart_items (cart_id, food_name, quantity, added) VALUES (?, ?, 1, ?)
+                            ON CONFLICT (cart_id, food_name) DO UPDATE SET quantity = quantity + 1""", (cart_id, food_name, now))
+
+
+def _buffered_add(cart_id: str, food_name: str):
+    tools.add_to_cart(cart_id, food_name)
+
+
+def _run(label: str, add, users: int, clicks: int, foods: list) -> dict:
+    def user_session(user: int) -> list:
+        latencies = []
+        for click in range(clicks):
+            started = time.perf_counter()
+            add(f"{label}-{user}", foods[(user + click) % FOODS_PER_CART])
+            latencies.append(time.perf_counter() - started)
+        return latencies
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=users) as pool:
+        latencies = sorted(latency for result in pool.map(user_session, range(users)) for latency in result)
+    cart_store.get_buffer().flush()
+    elapsed = time.perf_counter() - started
+    counts = database.fetchall("SELECT SUM(quantity) FROM cart_items WHERE cart_id LIKE ? GROUP BY cart_id", (f"{label}-%",))
+    return {
+        "wall_time_s": round(elapsed, 3),
+        "clicks_per_s": round(users * clicks / elapsed),
+        "p50_ms": round(latencies[len(latencies) // 2] * 1000, 3),
+        "p95_ms": round(latencies[int(len(latencies) * 0.95)] * 1000, 3),
+        "correct": len(counts) == users and all(row[0] == clicks for row in counts),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--clicks", type=int, default=40)
+    parser.add_argument("--db", default=os.path.join("db", "bench_cart.db"))
+    args = parser.parse_args()
+
+    database.configure_database(build_menu_db(args.db, 1000))
+    cart_store.ensure_ready()
+    with database.connection() as conn:
+        with conn:
+            conn.execute("DELETE FROM cart_items")
+    foods = [row[0] for row in database.fetchall("SELECT name FROM foods LIMIT ?", (FOODS_PER_CART,))]
+
+    for label, add in (("direct", _direct_add), ("buffered", _buffered_add)):
+        print(label, _run(label, add, args.users, args.clicks, foods))
+    print("buffer", tools.get_cart_stats())
+
+
+if __name__ == "__main__":
+    main()
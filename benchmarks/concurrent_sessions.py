@@ -0,0 +1,66 @@
+"""
+بنچمارک بار: N جلسه همزمان که هر کدام یک جستجوی منو و یک «فراخوانی LLM» شبیه‌سازی شده انجام می‌دهند.
+مسیر همگام (فراخوانی مستقیم tools.search_food داخل event loop) با مسیر async (executor اختصاصی) مقایسه می‌شود.
+علاوه بر زمان کل، بیشترین تاخیر event loop هم اندازه‌گیری می‌شود؛ در مسیر همگام این عدد با زمان کوئری رشد می‌کند.
+
+    python -m benchmarks.concurrent_sessions --sessions 32 --foods 200000
+"""
+import argparse
+import asyncio
+import os
+import time
+
+import database
+import tools
+from benchmarks._data import build_menu_db
+
+LLM_LATENCY = 0.05
+
+
+async def _loop_lag_monitor(stop: asyncio.Event, interval: float = 0.005) -> float:
+    worst = 0.0
+    while not stop.is_set():
+        start = time.perf_counter()
+        await asyncio.sleep(interval)
+        worst = max(worst, time.perf_counter() - start - interval)
+    return worst
+
+
+async def _session_sync(query: str):
+    tools.search_food(query)
+    await asyncio.sleep(LLM_LATENCY)
+
+
+async def _session_async(query: str):
+    await tools.asearch_food(query)
+    await asyncio.sleep(LLM_LATENCY)
+
+
+async def _run(session, sessions: int) -> dict:
+    stop = asyncio.Event()
+    monitor = asyncio.create_task(_loop_lag_monitor(stop))
+    start = time.perf_counter()
+    await asyncio.gather(*(session(f"ویژه {i}") for i in range(sessions)))
+    elapsed = time.perf_counter() - start
+    stop.set()
+    return {"wall_time_s": round(elapsed, 3), "max_loop_lag_ms": round(await monitor * 1000, 2)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sessions", type=int, default=32)
+    parser.add_argument("--foods", type=int, default=200000)
+    parser.add_argument("--db", default=os.path.join("db", "bench_sessions.db"))
+    args = parser.parse_args()
+
+    database.configure_database(build_menu_db(args.db, args.foods))
+    tools.search_food("گرم کردن")
+
+    for label, session in (("sync", _session_sync), ("async", _session_async)):
+        result = asyncio.run(_run(session, args.sessions))
+        print(f"{label:>5}: {args.sessions} جلسه در {result['wall_time_s']}s، بیشترین تاخیر event loop: {result['max_loop_lag_ms']}ms")
+    print(database.get_pool_stats())
+
+
+if __name__ == "__main__":
+    main()
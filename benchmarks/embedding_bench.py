@@ -0,0 +1,91 @@
+"""
+بنچمارک سرویس امبدینگ: N جلسه‌ی همزمان که هر کدام یک سوال جدید امبد می‌کنند.
+
+برای هر backend (torch = fp32، onnx-int8 = کوانتیزه) سه حالت اندازه‌گیری می‌شود:
+  single    هر سوال یک فراخوانی مدل (رفتار قبلی HuggingFaceEmbeddings)
+  batched   micro-batching سوال‌های همزمان در پنجره‌ی --window-ms
+  cached    همان سوال‌ها دوباره (از cache دیسک/حافظه، بدون مدل)
+و برای int8 میانگین شباهت کسینوسی بردارها با fp32 گزارش می‌شود تا افت کیفیت کوانتیزه کردن دیده شود.
+
+    python -m benchmarks.embedding_bench --sessions 64 --backends torch,onnx-int8
+"""
+import argparse
+import asyncio
+import os
+import tempfile
+import time
+
+import numpy as np
+
+import embedding_service
+
+DISHES = ['پیتزا', 'کباب کوبیده', 'قورمه سبزی', 'پاستا آلفردو', 'سالاد سزار', 'برگر ذغالی', 'استیک', 'جوجه کباب']
+QUESTIONS = ['{} چیست؟', 'طرز تهیه {} چطور است؟', 'کالری {} چقدر است؟', '{} با چه سسی سرو می‌شود؟']
+
+
+def _questions(count: int, seed: int) -> list:
+    return [QUESTIONS[(seed + i) % len(QUESTIONS)].format(f"{DISHES[i % len(DISHES)]} شماره {seed}-{i}") for i in range(count)]
+
+
+async def _burst(service: embedding_service.EmbeddingService, texts: list) -> tuple:
+    started = time.perf_counter()
+    vectors = await asyncio.gather(*(service.aembed_query(text) for text in texts))
+    return time.perf_counter() - started, np.asarray(vectors, dtype=np.float32)
+
+
+def _run(backend: str, encoder, sessions: int, rounds: int, window_ms: float, cache_dir: str) -> dict:
+    results, vectors = {}, None
+    for mode in ("single", "batched"):
+        cache = embedding_service.EmbeddingCache(os.path.join(cache_dir, f"{backend}-{mode}.db"), backend)
+        service = embedding_service.EmbeddingService(
+            backend=backend, encoder=encoder, cache=cache,
+            batch_window_ms=0 if mode == "single" else window_ms, max_batch_size=1 if mode == "single" else sessions,
+        )
+        elapsed = 0.0
+        for round_ in range(rounds):
+            seconds, batch_vectors = asyncio.run(_burst(service, _questions(sessions, round_)))
+            elapsed += seconds
+        results[mode] = {"queries_per_s": round(sessions * rounds / elapsed, 1), "avg_batch": round(service.stats()["avg_batch"], 1)}
+        if mode == "batched":
+            started = time.perf_counter()
+            for round_ in range(rounds):
+                asyncio.run(_burst(service, _questions(sessions, round_)))
+            results["cached"] = {"queries_per_s": round(sessions * rounds / (time.perf_counter() - started), 1),
+                                 "hit_rate": round(service.stats()["cache_hit_rate"], 2)}
+            vectors = batch_vectors
+    return results, vectors
+
+
+def _cosine(a: np.ndarray, b: np.ndarray) -> float:
+    a = a / np.linalg.norm(a, axis=1, keepdims=True)
+    b = b / np.linalg.norm(b, axis=1, keepdims=True)
+    return float(np.mean(np.sum(a * b, axis=1)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sessions", type=int, default=64)
+    parser.add_argument("--rounds", type=int, default=5)
+    parser.add_argument("--window-ms", type=float, default=embedding_service.BATCH_WINDOW_MS)
+    parser.add_argument("--backends", default="torch,onnx-int8")
+    args = parser.parse_args()
+
+    reference = None
+    with tempfile.TemporaryDirectory() as cache_dir:
+        for backend in args.backends.split(","):
+            try:
+                encoder = embedding_service.load_encoder(backend)
+            except Exception as e:
+                print(f"{backend}: در دسترس نیست ({e})")
+                continue
+            encoder(["گرم کردن"])
+            results, vectors = _run(backend, encoder, args.sessions, args.rounds, args.window_ms, cache_dir)
+            if reference is None:
+                reference = vectors
+            else:
+                results["cosine_vs_" + args.backends.split(",")[0]] = round(_cosine(reference, vectors), 4)
+            print(backend, results)
+
+
+if __name__ == "__main__":
+    main()
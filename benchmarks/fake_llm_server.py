@@ -0,0 +1,211 @@
+"""
+سرور محلی سازگار با API چت OpenAI (POST /v1/chat/completions) برای اجرای برنامه و بنچمارک‌ها بدون شبکه و هزینه.
+پاسخ‌ها قطعی‌اند و تاخیر اولین توکن و هر توکن قابل تنظیم است؛ استریم (SSE با usage)، فراخوانی ابزار و
+خروجی ساختاریافته (json_schema) پشتیبانی می‌شوند. مثل سرویس واقعی سقف همزمانی و نرخ دارد و بیش از آن
+با 429 و هدر retry-after-ms پاسخ می‌دهد.
+
+    python -m benchmarks.fake_llm_server --port 8900 --max-concurrency 8 --rps 20
+    OPENAI_BASE_URL=http://127.0.0.1:8900/v1 OPENAI_API_KEY=fake chainlit run app.py
+"""
+import argparse
+import json
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+_DIGITS = re.compile(r"\d+")
+_QUOTED = re.compile(r"'([^']+)'")
+
+
+def _last_user_text(messages: list) -> str:
+    for message in reversed(messages):
+        if message.get("role") == "user":
+            content = message.get("content")
+            if isinstance(content, list):
+                return " ".join(part.get("text", "") for part in content if isinstance(part, dict))
+            return str(content or "")
+    return ""
+
+def _fill(schema: dict, text: str) -> dict:
+    """آرگومان‌های ساختگی برای یک JSON schema: رشته‌ها متن کاربر (یا اولین گزینه‌ی داخل '...' توضیح فیلد) و اعداد اولین عدد متن."""
+    numbers = [int(n) for n in _DIGITS.findall(text)]
+    args = {}
+    for name, prop in (schema.get("properties") or {}).items():
+        kind = prop.get("type")
+        if name not in schema.get("required", []) and kind != "string":
+            continue
+        if kind in ("integer", "number"):
+            args[name] = numbers[0] if numbers else 1
+        elif "enum" in prop:
+            args[name] = prop["enum"][0]
+        else:
+            options = _QUOTED.findall(prop.get("description", ""))
+            args[name] = options[0] if options else text
+    return args
+
+
+class FakeLLMServer:
+    """سرور در یک thread پس‌زمینه؛ stats تعداد درخواست‌ها، 429ها و بیشترین همزمانی دیده شده را نگه می‌دارد."""
+
+    def __init__(self, port: int = 0, first_token_ms: float = 300.0, token_ms: float = 15.0, answer_tokens: int = 40,
+                 max_concurrency: int = 0, rps: float = 0.0, host: str = "127.0.0.1"):
+        self.first_token_ms, self.token_ms, self.answer_tokens = first_token_ms, token_ms, answer_tokens
+        self.max_concurrency, self.rps = max_concurrency, rps
+        self.stats = {"requests": 0, "rate_limited": 0, "completed": 0, "max_inflight": 0}
+        self._inflight = 0
+        self._lock = threading.Lock()
+        # سطل توکن برای سقف نرخ (درخواست در ثانیه)
+        self._tokens, self._refilled = max(1.0, rps), time.monotonic()
+        self._server = ThreadingHTTPServer((host, port), self._handler())
+        self._server.daemon_threads = True
+        self.port = self._server.server_address[1]
+        self.base_url = f"http://{host}:{self.port}/v1"
+
+    def start(self) -> "FakeLLMServer":
+        threading.Thread(target=self._server.serve_forever, name="fake-llm", daemon=True).start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def _admit(self) -> float:
+        """0 یعنی پذیرفته شد؛ در غیر این صورت چند ثانیه بعد دوباره تلاش شود."""
+        with self._lock:
+            self.stats["requests"] += 1
+            if self.rps:
+                now = time.monotonic()
+                self._tokens = min(max(1.0, self.rps), self._tokens + (now - self._refilled) * self.rps)
+                self._refilled = now
+                if self._tokens < 1:
+                    self.stats["rate_limited"] += 1
+                    return (1 - self._tokens) / self.rps
+            if self.max_concurrency and self._inflight >= self.max_concurrency:
+                self.stats["rate_limited"] += 1
+                return self.first_token_ms / 1000
+            if self.rps:
+                self._tokens -= 1
+            self._inflight += 1
+            self.stats["max_inflight"] = max(self.stats["max_inflight"], self._inflight)
+            return 0.0
+
+    def _done(self):
+        with self._lock:
+            self._inflight -= 1
+            self.stats["completed"] += 1
+
+    def _respond(self, body: dict) -> dict:
+        """پیام پاسخ: فراخوانی اولین ابزار بعد از پیام کاربر، JSON برای خروجی ساختاریافته، یا متن answer_tokens کلمه‌ای."""
+        messages = body.get("messages", [])
+        text = _last_user_text(messages)
+        tools = body.get("tools") or []
+        if tools and messages and messages[-1].get("role") == "user":
+            function = tools[0]["function"]
+            return {"tool_call": {"id": f"call_{abs(hash(text)) % 10 ** 8}", "name": function["name"],
+                                  "arguments": json.dumps(_fill(function.get("parameters", {}), text), ensure_ascii=False)}}
+        response_format = body.get("response_format") or {}
+        if response_format.get("type") == "json_schema":
+            return {"content": json.dumps(_fill(response_format["json_schema"].get("schema", {}), text), ensure_ascii=False)}
+        return {"content": " ".join(f"کلمه{i}" for i in range(self.answer_tokens))}
+
+    def _handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, format, *args):
+                pass
+
+            def _json(self, status: int, payload: dict, headers: dict = None):
+                data = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(data)
+
+            def _event(self, payload):
+                self.wfile.write(f"data: {payload if isinstance(payload, str) else json.dumps(payload, ensure_ascii=False)}\n\n".encode("utf-8"))
+                self.wfile.flush()
+
+            def do_POST(self):
+                if not self.path.rstrip("/").endswith("/chat/completions"):
+                    self._json(404, {"error": {"message": "not found"}})
+                    return
+                body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+                retry_after = server._admit()
+                if retry_after:
+                    self._json(429, {"error": {"message": "Rate limit reached", "type": "requests", "code": "rate_limit_exceeded"}},
+                               {"retry-after-ms": str(int(retry_after * 1000)), "retry-after": f"{retry_after:.3f}"})
+                    return
+                try:
+                    self._complete(body)
+                except (BrokenPipeError, ConnectionResetError):
+                    pass
+                finally:
+                    server._done()
+
+            def _complete(self, body: dict):
+                answer = server._respond(body)
+                prompt_tokens = sum(len(str(m.get("content") or "")) for m in body.get("messages", [])) // 3 + 1
+                words = answer["content"].split(" ") if "content" in answer else []
+                usage = {"prompt_tokens": prompt_tokens, "completion_tokens": len(words) or 10, "total_tokens": prompt_tokens + (len(words) or 10)}
+                base = {"id": f"chatcmpl-fake-{time.time_ns()}", "created": int(time.time()), "model": body.get("model", "fake")}
+                time.sleep(server.first_token_ms / 1000)
+                tool_calls = None
+                if "tool_call" in answer:
+                    call = answer["tool_call"]
+                    tool_calls = [{"index": 0, "id": call["id"], "type": "function", "function": {"name": call["name"], "arguments": call["arguments"]}}]
+                finish = "tool_calls" if tool_calls else "stop"
+
+                if not body.get("stream"):
+                    time.sleep(server.token_ms * max(0, len(words) - 1) / 1000)
+                    message = {"role": "assistant", "content": answer.get("content")}
+                    if tool_calls:
+                        message["tool_calls"] = [{key: value for key, value in call.items() if key != "index"} for call in tool_calls]
+                    self._json(200, {**base, "object": "chat.completion", "usage": usage,
+                                     "choices": [{"index": 0, "message": message, "finish_reason": finish}]})
+                    return
+
+                self.send_response(200)
+                self.send_header("Content-Type", "text/event-stream")
+                self.send_header("Connection", "close")
+                self.end_headers()
+                chunk = {**base, "object": "chat.completion.chunk"}
+                if tool_calls:
+                    self._event({**chunk, "choices": [{"index": 0, "delta": {"role": "assistant", "content": None, "tool_calls": tool_calls}, "finish_reason": None}]})
+                for i, word in enumerate(words):
+                    if i:
+                        time.sleep(server.token_ms / 1000)
+                    delta = {"role": "assistant", "content": word} if i == 0 else {"content": " " + word}
+                    self._event({**chunk, "choices": [{"index": 0, "delta": delta, "finish_reason": None}]})
+                self._event({**chunk, "choices": [{"index": 0, "delta": {}, "finish_reason": finish}]})
+                if (body.get("stream_options") or {}).get("include_usage"):
+                    self._event({**chunk, "choices": [], "usage": usage})
+                self._event("[DONE]")
+
+        return Handler
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--port", type=int, default=8900)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--first-token-ms", type=float, default=300.0)
+    parser.add_argument("--token-ms", type=float, default=15.0)
+    parser.add_argument("--answer-tokens", type=int, default=40)
+    parser.add_argument("--max-concurrency", type=int, default=8, help="درخواست همزمان بیشتر از این 429 می‌گیرد (0 یعنی بدون سقف)")
+    parser.add_argument("--rps", type=float, default=0.0, help="سقف درخواست در ثانیه (0 یعنی بدون سقف)")
+    args = parser.parse_args()
+    server = FakeLLMServer(args.port, args.first_token_ms, args.token_ms, args.answer_tokens, args.max_concurrency, args.rps, args.host)
+    print(f"✅ سرور LLM جعلی روی {server.base_url}")
+    try:
+        server._server.serve_forever()
+    except KeyboardInterrupt:
+        print(f"\n{server.stats}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+"""
+بنچمارک جستجوی همزمان ایجنت اطلاعات با منابع محلی شبیه‌سازی شده (بدون شبکه و مدل):
+
+  sequential   رفتار قبلی: پایگاه دانش، سپس وب (بعد از یک نوبت دیگر LLM با تاخیر --llm-ms)
+  fan-out      همه‌ی منابع همزمان با مهلت جداگانه
+  short-circuit  fan-out وقتی پایگاه دانش سند کافی دارد و جستجوی وب لغو می‌شود
+
+    python -m benchmarks.fanout_bench --queries 50 --kb-ms 40 --menu-ms 10 --web-ms 800 --llm-ms 600
+"""
+import argparse
+import asyncio
+import time
+
+from langchain_core.documents import Document
+
+import fanout
+
+
+class KeywordEmbeddings:
+    """امبدینگ کیسه‌ی کلمات؛ برای اینکه رتبه‌بندی دوباره بدون مدل واقعی قابل اجرا باشد."""
+    def __init__(self):
+        self.vocabulary = {}
+
+    def _vector(self, text: str) -> list:
+        vector = [0.0] * 256
+        for word in text.split():
+            vector[self.vocabulary.setdefault(word, len(self.vocabulary) % 256)] += 1.0
+        return vector
+
+    async def aembed_query(self, text: str) -> list:
+        return self._vector(text)
+
+    async def aembed_documents(self, texts: list) -> list:
+        return [self._vector(text) for text in texts]
+
+
+def _stub(name: str, delay_ms: float, relevant: bool):
+    async def source(query: str) -> list:
+        await asyncio.sleep(delay_ms / 1000)
+        text = query if relevant else f"نتیجه‌ی عمومی {name}"
+        return [Document(page_content=f"{text} ({name} {i})") for i in range(3)]
+    return source
+
+
+async def _sequential(query: str, args) -> float:
+    started = time.perf_counter()
+    await _stub("knowledge_base", args.kb_ms, False)(query)
+    await asyncio.sleep(args.llm_ms / 1000)
+    await _stub("web", args.web_ms, False)(query)
+    return time.perf_counter() - started
+
+
+async def _fan_out(query: str) -> float:
+    started = time.perf_counter()
+    await fanout.fan_out(query, embeddings=KeywordEmbeddings())
+    return time.perf_counter() - started
+
+
+async def _measure(func, queries: list) -> dict:
+    latencies = sorted(await asyncio.gather(*(func(query) for query in queries)))
+    return {"avg_ms": round(1000 * sum(latencies) / len(latencies), 1), "p95_ms": round(1000 * latencies[int(len(latencies) * 0.95) - 1], 1)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--queries", type=int, default=50)
+    parser.add_argument("--kb-ms", type=float, default=40.0)
+    parser.add_argument("--menu-ms", type=float, default=10.0)
+    parser.add_argument("--web-ms", type=float, default=800.0)
+    parser.add_argument("--llm-ms", type=float, default=600.0)
+    args = parser.parse_args()
+    queries = [f"طرز تهیه غذای شماره {i}" for i in range(args.queries)]
+
+    print("sequential", asyncio.run(_measure(lambda query: _sequential(query, args), queries)))
+    for mode, relevant in (("fan-out", False), ("short-circuit", True)):
+        fanout.register_source("knowledge_base", _stub("knowledge_base", args.kb_ms, relevant))
+        fanout.register_source("menu", _stub("menu", args.menu_ms, False))
+        fanout.register_source("web", _stub("web", args.web_ms, False))
+        print(mode, asyncio.run(_measure(_fan_out, queries)))
+    for source, histogram in fanout.get_fanout_stats().items():
+        print(source, {"avg_ms": round(1000 * histogram["avg"], 1), "outcomes": histogram["outcomes"]})
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,212 @@
+"""
+بنچمارک زمان‌بند LLM (llm_scheduler.py) در برابر سرور LLM جعلی محلی با سقف همزمانی (benchmarks/fake_llm_server.py).
+
+یک انفجار بار: --sessions جلسه‌ی تعاملی که هر کدام --turns نوبت (مسیریاب بدون استریم + پاسخ استریم ایجنت)
+می‌فرستند، --background درخواست پس‌زمینه (مثل ساخت پیام‌های پیشنهاد) و --duplicates از نوبت‌های اول که
+کاربر دو بار فرستاده است. دو حالت مقایسه می‌شوند:
+
+  direct     ChatOpenAI با کلاینت پیش‌فرض (تلاش دوباره‌ی خود openai، بدون صف)
+  scheduled  ChatOpenAI با کلاینت llm_scheduler (صف اولویت‌دار، نوبت‌دهی بین جلسه‌ها، یکی کردن درخواست‌های یکسان، backoff)
+
+گزارش: نوبت‌های موفق و ناموفق، تاخیر و TTFT نوبت‌های تعاملی، درخواست‌های پس‌زمینه، و 429های سرویس.
+
+    python -m benchmarks.llm_scheduler_bench --sessions 60 --background 40 --provider-concurrency 8
+
+با --check به جای بنچمارک، بررسی رگرسیون اجرا می‌شود: درخواست‌های در صف زیر بار لغو می‌شوند (قطع اتصال و
+مهلت صف، از جمله لغو درست قبل از آزاد شدن یک جای خالی) و اگر بعد از آن شمارنده‌های زمان‌بند صفر نشوند یا
+درخواست تازه جای خالی نگیرد با کد خروج ۱ تمام می‌شود:
+
+    python -m benchmarks.llm_scheduler_bench --check
+"""
+import argparse
+import asyncio
+import random
+import sys
+import time
+
+import httpx
+from langchain_openai import ChatOpenAI
+
+import llm_scheduler
+from benchmarks.fake_llm_server import FakeLLMServer
+
+
+def _percentiles(values: list) -> str:
+    if not values:
+        return "-"
+    values = sorted(values)
+    pick = lambda q: values[min(len(values) - 1, int(q * len(values)))]
+    return f"p50 {pick(0.5):.2f}s / p95 {pick(0.95):.2f}s / max {values[-1]:.2f}s"
+
+
+async def _turn(llm, session_id: str, text: str, results: dict):
+    started = time.perf_counter()
+    ttft = None
+    try:
+        with llm_scheduler.session(session_id):
+            await llm.ainvoke(f"مسیریابی: {text}")
+            async for _ in llm.astream(text):
+                if ttft is None:
+                    ttft = time.perf_counter() - started
+        results["latency"].append(time.perf_counter() - started)
+        results["ttft"].append(ttft)
+    except Exception as e:
+        results["errors"].append(type(e).__name__)
+
+async def _session(llm, index: int, args, rng: random.Random, results: dict):
+    session_id = f"session-{index}"
+    for turn in range(args.turns):
+        text = f"جلسه {index} نوبت {turn}: یه غذای خوب پیشنهاد بده"
+        if turn == 0 and rng.random() < args.duplicates:
+            # کاربر همان پیام را دو بار فرستاده است.
+            await asyncio.gather(_turn(llm, session_id, text, results), _turn(llm, session_id, text, results))
+        else:
+            await _turn(llm, session_id, text, results)
+        await asyncio.sleep(rng.uniform(0, args.think_ms / 1000))
+
+async def _background(llm, index: int, results: dict):
+    started = time.perf_counter()
+    try:
+        with llm_scheduler.session("recommendations", llm_scheduler.BACKGROUND):
+            await llm.ainvoke(f"پیام خوش‌آمد برای کاربر {index} بنویس")
+        results["latency"].append(time.perf_counter() - started)
+    except Exception as e:
+        results["errors"].append(type(e).__name__)
+
+
+async def run(mode: str, server: FakeLLMServer, args) -> dict:
+    if mode == "scheduled":
+        client = httpx.AsyncClient(transport=llm_scheduler.ScheduledTransport(), timeout=httpx.Timeout(600.0, connect=5.0))
+        llm = ChatOpenAI(model="gpt-4o-mini", base_url=server.base_url, api_key="fake", stream_usage=True,
+                         max_retries=0, http_async_client=client)
+    else:
+        llm = ChatOpenAI(model="gpt-4o-mini", base_url=server.base_url, api_key="fake", stream_usage=True)
+    rng = random.Random(args.seed)
+    interactive = {"latency": [], "ttft": [], "errors": []}
+    background = {"latency": [], "errors": []}
+    started = time.perf_counter()
+    await asyncio.gather(*(_background(llm, i, background) for i in range(args.background)),
+                         *(_session(llm, i, args, rng, interactive) for i in range(args.sessions)))
+    return {"wall": time.perf_counter() - started, "interactive": interactive, "background": background}
+
+
+async def _hold(scheduler: llm_scheduler.Scheduler, priority: str, session_id: str, seconds: float, results: dict):
+    try:
+        await scheduler.acquire(priority, session_id)
+    except llm_scheduler.Overloaded:
+        results["timeouts"] += 1
+        return
+    except asyncio.CancelledError:
+        results["cancelled"] += 1
+        raise
+    try:
+        await asyncio.sleep(seconds)
+    finally:
+        try:
+            scheduler.release(priority)
+        except Exception as e:
+            results["release_errors"].append(type(e).__name__)
+
+async def check_cancellation(requests: int, concurrency: int, seed: int) -> list:
+    """درخواست‌های در صف را زیر بار لغو می‌کند و خطاهای حسابداری جای خالی را برمی‌گرداند."""
+    rng = random.Random(seed)
+    scheduler = llm_scheduler.Scheduler(max_concurrency=concurrency, max_queue=requests * 2)
+    results = {"timeouts": 0, "cancelled": 0, "release_errors": []}
+
+    # حالت قطعی: لغو یک درخواست در صف و آزاد شدن جای خالی در همان گام event loop.
+    holder = asyncio.create_task(_hold(scheduler, llm_scheduler.INTERACTIVE, "holder", 0, results))
+    await asyncio.sleep(0)
+    scheduler.limit = 1.0
+    blockers = [asyncio.create_task(_hold(scheduler, llm_scheduler.INTERACTIVE, f"blocker-{i}", 10, results)) for i in range(concurrency)]
+    waiter = asyncio.create_task(_hold(scheduler, llm_scheduler.INTERACTIVE, "waiter", 0, results))
+    await asyncio.sleep(0.01)
+    waiter.cancel()
+    for task in blockers:
+        task.cancel()
+    await asyncio.gather(holder, waiter, *blockers, return_exceptions=True)
+    scheduler.limit = float(concurrency)
+
+    # حالت تصادفی: قطع اتصال‌ها و مهلت صف کوتاه در میان درخواست‌های عادی.
+    timeout = llm_scheduler.QUEUE_TIMEOUT
+    llm_scheduler.QUEUE_TIMEOUT = 0.05
+    try:
+        tasks = []
+        for i in range(requests):
+            priority = llm_scheduler.BACKGROUND if rng.random() < 0.3 else llm_scheduler.INTERACTIVE
+            tasks.append(asyncio.create_task(_hold(scheduler, priority, f"session-{i % 20}", rng.uniform(0, 0.02), results)))
+            if rng.random() < 0.3:
+                await asyncio.sleep(0)
+            if tasks and rng.random() < 0.3:
+                rng.choice(tasks).cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+    finally:
+        llm_scheduler.QUEUE_TIMEOUT = timeout
+
+    failures = [f"release خطا داد: {name}" for name in sorted(set(results["release_errors"]))]
+    if any(scheduler.active.values()) or any(scheduler.waiting.values()) or any(scheduler._queues.values()):
+        failures.append(f"بعد از پایان همه‌ی درخواست‌ها: active={scheduler.active} waiting={scheduler.waiting}")
+    try:
+        async with asyncio.timeout(1):
+            await scheduler.acquire(llm_scheduler.INTERACTIVE, "after")
+        scheduler.release(llm_scheduler.INTERACTIVE)
+    except (TimeoutError, llm_scheduler.Overloaded):
+        failures.append("درخواست تازه بعد از لغوها جای خالی نگرفت")
+    print(f"   {requests} درخواست، {results['cancelled']} لغو، {results['timeouts']} مهلت صف")
+    return failures
+
+
+def _report(mode: str, result: dict, server_stats: dict, scheduler_stats: dict = None):
+    interactive, background = result["interactive"], result["background"]
+    print(f"\n{mode} ({result['wall']:.1f}s)")
+    print(f"  نوبت‌های تعاملی: {len(interactive['latency'])} موفق، {len(interactive['errors'])} ناموفق")
+    print(f"    تاخیر: {_percentiles(interactive['latency'])}")
+    print(f"    TTFT:  {_percentiles([t for t in interactive['ttft'] if t is not None])}")
+    print(f"  پس‌زمینه: {len(background['latency'])} موفق، {len(background['errors'])} ناموفق، تاخیر {_percentiles(background['latency'])}")
+    print(f"  سرویس: {server_stats['requests']} درخواست، {server_stats['rate_limited']} پاسخ 429، بیشترین همزمانی {server_stats['max_inflight']}")
+    if scheduler_stats:
+        print(f"  زمان‌بند: {scheduler_stats['coalesced']} درخواست یکی شده، {scheduler_stats['retries']} تلاش دوباره، "
+              f"{scheduler_stats['rejected']} رد شده، بیشترین صف {scheduler_stats['max_queue_depth']}، "
+              f"انتظار صف {scheduler_stats['queue_wait_s']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sessions", type=int, default=60)
+    parser.add_argument("--turns", type=int, default=3)
+    parser.add_argument("--background", type=int, default=40)
+    parser.add_argument("--duplicates", type=float, default=0.2)
+    parser.add_argument("--think-ms", type=float, default=500.0)
+    parser.add_argument("--provider-concurrency", type=int, default=8)
+    parser.add_argument("--provider-rps", type=float, default=0.0)
+    parser.add_argument("--first-token-ms", type=float, default=300.0)
+    parser.add_argument("--token-ms", type=float, default=10.0)
+    parser.add_argument("--answer-tokens", type=int, default=30)
+    parser.add_argument("--modes", default="direct,scheduled")
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--check", action="store_true", help="بررسی لغو درخواست‌های در صف به جای بنچمارک")
+    args = parser.parse_args()
+
+    if args.check:
+        failures = asyncio.run(check_cancellation(2000, args.provider_concurrency, args.seed))
+        for failure in failures:
+            print(f"!!! {failure}")
+        if failures:
+            sys.exit(1)
+        print("✅ لغو درخواست‌های در صف هیچ جای خالی زمان‌بند را از بین نبرد.")
+        return
+
+    server = FakeLLMServer(first_token_ms=args.first_token_ms, token_ms=args.token_ms, answer_tokens=args.answer_tokens,
+                           max_concurrency=args.provider_concurrency, rps=args.provider_rps).start()
+    print(f"سرور جعلی: سقف همزمانی {args.provider_concurrency}، زمان‌بند: سقف همزمانی {llm_scheduler.MAX_CONCURRENCY}")
+    try:
+        for mode in args.modes.split(","):
+            server.stats.update({key: 0 for key in server.stats})
+            llm_scheduler._stats.update({key: 0 for key in llm_scheduler._stats})
+            result = asyncio.run(run(mode, server, args))
+            _report(mode, result, dict(server.stats), llm_scheduler.get_stats() if mode == "scheduled" else None)
+    finally:
+        server.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,235 @@
+"""
+تست بار آفلاین کل سیستم: گراف supervisor واقعی (main.get_app) با یک مدل چت جعلی و قطعی (تاخیر قابل تنظیم)،
+پایگاه داده‌ی مصنوعی بزرگ (پیش‌فرض ۱۰۰ هزار غذا و ۱ میلیون سفارش)، پایگاه دانش LanceDB مصنوعی و جستجوی وب
+از فایل نتایج ثابت. گفتگوهای چند نوبتی از پیش نوشته شده (همه‌ی مسیرها: جستجو، فیلتر قیمت، سبد، سفارش، اطلاعات)
+با همزمانی قابل تنظیم از طریق streaming.stream_events اجرا می‌شوند، درست مثل app.py.
+
+با --llm server به جای مدل جعلی داخل پروسه، ChatOpenAI واقعی از مسیر زمان‌بند LLM (llm_scheduler.py) به سرور
+سازگار با OpenAI محلی (benchmarks/fake_llm_server.py) با سقف همزمانی --provider-concurrency وصل می‌شود.
+
+گزارش: throughput، صدک‌های تاخیر نوبت و زمان تا اولین توکن (کل و برای هر مسیر)، خطاها و حافظه‌ی پروسه.
+نتیجه در یک فایل JSON نوشته می‌شود؛ با --baseline با یک اجرای قبلی مقایسه می‌شود و اگر پسرفتی بیشتر از
+--tolerance وجود داشته باشد با کد خروج ۱ تمام می‌شود (برای CI). baseline به سخت‌افزار وابسته است و در مخزن
+نیست؛ اول با --save-baseline روی همان ماشین ساخته می‌شود.
+
+همه‌ی فایل‌ها (پایگاه داده‌ها، cacheها، traceها) داخل --workdir ساخته می‌شوند و در اجراهای بعدی دوباره استفاده می‌شوند.
+
+    python -m benchmarks.load_test --sessions 200 --concurrency 50 --save-baseline benchmarks/baseline.json
+    python -m benchmarks.load_test --sessions 200 --concurrency 50 --baseline benchmarks/baseline.json
+    python -m benchmarks.load_test --sessions 100 --concurrency 50 --llm server --provider-concurrency 8
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import resource
+import sys
+import time
+
+from langchain_core.messages import HumanMessage
+
+import database
+import embedding_service
+import llm_scheduler
+import main as chatfood
+import startup
+import streaming
+import web_search
+from benchmarks._data import DISHES, build_menu_db, build_rag_corpus
+from benchmarks._fakes import FakeChatModel, hash_encoder
+from benchmarks.fake_llm_server import FakeLLMServer
+
+# گفتگوهای نمونه؛ {dish} و {order} برای هر جلسه پر می‌شوند. لغو سفارش عمدا نیست چون پایگاه داده را تغییر می‌دهد.
+CONVERSATIONS = [
+    ["{dish} دارید", "{dish} زیر 300 هزار تومان", "سبد خریدم رو نشون بده"],
+    ["وضعیت سفارش {order}", "{dish} چیست؟", "{dish} ویژه می‌خوام"],
+    ["طرز تهیه {dish} چطوره", "یه {dish} ارزون پیدا کن", "سفارش {order} کجاست"],
+    ["یه غذای خوب برای شام", "{dish} کلاسیک", "کالری {dish} چقدره"],
+]
+# برای مقایسه با baseline: (کلید، بزرگ‌تر بهتر است)
+REGRESSION_KEYS = [("turns_per_s", True), ("latency_ms.p50", False), ("latency_ms.p95", False),
+                   ("latency_ms.p99", False), ("ttft_ms.p95", False), ("memory_mb.peak_rss", False)]
+
+
+def _rss_mb() -> float:
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2 ** 20
+    except OSError:
+        return 0.0
+
+def _peak_rss_mb() -> float:
+    # ru_maxrss در لینوکس کیلوبایت و در macOS بایت است.
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 2 ** 20 if sys.platform == "darwin" else peak / 1024
+
+def _percentiles(values: list) -> dict:
+    if not values:
+        return {"count": 0}
+    values = sorted(values)
+    pick = lambda q: round(values[min(len(values) - 1, int(q * len(values)))], 1)
+    return {"count": len(values), "p50": pick(0.50), "p95": pick(0.95), "p99": pick(0.99), "max": round(values[-1], 1)}
+
+
+def setup(args):
+    """داده‌ها و جایگزین‌ها را آماده می‌کند؛ باید بعد از chdir به workdir اجرا شود."""
+    fixtures = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "web_search_fixtures.json")
+    started = time.perf_counter()
+    database.configure_database(build_menu_db(os.path.join("db", "chatfood.db"), args.foods, args.orders))
+    if args.embeddings == "hash":
+        embedding_service._service = embedding_service.EmbeddingService(
+            encoder=hash_encoder, cache=embedding_service.EmbeddingCache(namespace="load-test-hash"))
+    build_rag_corpus(os.path.join(os.getcwd(), "db"), args.docs, chatfood.get_embedding_model().embed_documents)
+    print(f"داده‌ها در {time.perf_counter() - started:.1f}s آماده شد "
+          f"({args.foods} غذا، {args.orders} سفارش، {args.docs} سند)")
+
+    if args.llm == "server":
+        server = FakeLLMServer(first_token_ms=args.first_token_ms, token_ms=args.token_ms, answer_tokens=args.answer_tokens,
+                               max_concurrency=args.provider_concurrency).start()
+        os.environ.update({"OPENAI_BASE_URL": server.base_url, "OPENAI_API_KEY": "fake"})
+        chatfood._llm = None
+    else:
+        chatfood._llm = FakeChatModel(first_token_ms=args.first_token_ms, token_ms=args.token_ms, answer_tokens=args.answer_tokens)
+    chatfood._bound_models.clear()
+    web_search.set_backend(web_search.FixtureBackend(fixtures))
+    # همان کارهای گرم کردن app.py؛ اندازه‌گیری از حالت گرم شروع می‌شود.
+    for warm in (chatfood.warm_embeddings, chatfood.get_rag_table, chatfood.warm_database, chatfood.warm_graphs):
+        warm()
+    startup._ready.set()
+
+
+def _script(index: int, n_orders: int, rng: random.Random) -> list:
+    dish, order = rng.choice(DISHES), rng.randint(1, max(1, n_orders))
+    return [turn.format(dish=dish, order=order) for turn in CONVERSATIONS[index % len(CONVERSATIONS)]]
+
+
+async def _session(index: int, turns: list, semaphore: asyncio.Semaphore, results: list):
+    thread_id = f"load-{index}-{time.time_ns()}"
+    config = chatfood.session_config(thread_id)
+    async with semaphore:
+        for text in turns:
+            started = time.perf_counter()
+            ttft, route, error = None, None, None
+            try:
+                with llm_scheduler.session(thread_id):
+                    async for kind, data in streaming.stream_events(chatfood.get_app(), {"messages": [HumanMessage(content=text)]}, config):
+                        if kind in ("token", "foods") and ttft is None:
+                            ttft = time.perf_counter() - started
+                        elif kind == "done":
+                            route = data["agent"]
+            except Exception as e:
+                error = f"{type(e).__name__}: {e}"
+            results.append({"route": route or "error", "latency": time.perf_counter() - started, "ttft": ttft, "error": error})
+        await chatfood.end_session(thread_id)
+
+
+async def run(args) -> dict:
+    rng = random.Random(args.seed)
+    scripts = [_script(i, args.orders, rng) for i in range(args.sessions)]
+    semaphore = asyncio.Semaphore(args.concurrency)
+    results = []
+    rss_before = _rss_mb()
+    started = time.perf_counter()
+    await asyncio.gather(*(_session(i, turns, semaphore, results) for i, turns in enumerate(scripts)))
+    elapsed = time.perf_counter() - started
+
+    ok = [r for r in results if r["error"] is None]
+    errors = [r["error"] for r in results if r["error"] is not None]
+    routes = {}
+    for r in ok:
+        routes.setdefault(r["route"], []).append(r)
+    return {
+        "config": {key: getattr(args, key) for key in ("sessions", "concurrency", "foods", "orders", "docs",
+                                                       "first_token_ms", "token_ms", "answer_tokens", "embeddings", "llm")},
+        "turns": len(results),
+        "errors": len(errors),
+        "error_samples": sorted(set(errors))[:5],
+        "wall_time_s": round(elapsed, 2),
+        "turns_per_s": round(len(results) / elapsed, 2),
+        "latency_ms": _percentiles([1000 * r["latency"] for r in ok]),
+        "ttft_ms": _percentiles([1000 * r["ttft"] for r in ok if r["ttft"] is not None]),
+        "routes": {route: {"latency_ms": _percentiles([1000 * r["latency"] for r in items]),
+                           "ttft_ms": _percentiles([1000 * r["ttft"] for r in items if r["ttft"] is not None])}
+                   for route, items in sorted(routes.items())},
+        "memory_mb": {"rss_before": round(rss_before, 1), "rss_after": round(_rss_mb(), 1), "peak_rss": round(_peak_rss_mb(), 1)},
+        "router": chatfood.get_router_stats(),
+        "rag_cache": chatfood.get_rag_cache_stats(),
+        "db_pool": database.get_pool_stats(),
+        "llm_scheduler": llm_scheduler.get_stats(),
+    }
+
+
+def _lookup(result: dict, key: str):
+    for part in key.split("."):
+        result = result.get(part) if isinstance(result, dict) else None
+    return result
+
+def compare(result: dict, baseline: dict, tolerance: float) -> list:
+    """پسرفت‌های بیشتر از tolerance (نسبی) نسبت به baseline؛ به علاوه‌ی هر خطایی که baseline نداشت."""
+    regressions = []
+    for key, higher_is_better in REGRESSION_KEYS:
+        current, previous = _lookup(result, key), _lookup(baseline, key)
+        if not current or not previous:
+            continue
+        change = (current - previous) / previous
+        if (-change if higher_is_better else change) > tolerance:
+            regressions.append(f"{key}: {previous} -> {current} ({change:+.1%})")
+    if result["errors"] > baseline.get("errors", 0):
+        regressions.append(f"errors: {baseline.get('errors', 0)} -> {result['errors']}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workdir", default=os.path.join("db", "load_test"))
+    parser.add_argument("--foods", type=int, default=100000)
+    parser.add_argument("--orders", type=int, default=1000000)
+    parser.add_argument("--docs", type=int, default=20000)
+    parser.add_argument("--sessions", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--first-token-ms", type=float, default=300.0)
+    parser.add_argument("--token-ms", type=float, default=15.0)
+    parser.add_argument("--answer-tokens", type=int, default=40)
+    parser.add_argument("--embeddings", default="hash", choices=["hash", "model"],
+                        help="hash: امبدینگ قطعی بدون مدل؛ model: مدل واقعی سرویس امبدینگ")
+    parser.add_argument("--llm", default="model", choices=["model", "server"],
+                        help="model: مدل جعلی داخل پروسه؛ server: ChatOpenAI و زمان‌بند LLM در برابر سرور جعلی محلی")
+    parser.add_argument("--provider-concurrency", type=int, default=8, help="سقف همزمانی سرور جعلی در حالت --llm server")
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--out", default=os.path.join("db", "load_test_result.json"))
+    parser.add_argument("--baseline", help="فایل JSON یک اجرای قبلی برای مقایسه")
+    parser.add_argument("--save-baseline", help="نتیجه‌ی این اجرا به عنوان baseline در این مسیر ذخیره می‌شود")
+    parser.add_argument("--tolerance", type=float, default=0.10)
+    args = parser.parse_args()
+    out, baseline_path, save_path = (os.path.abspath(p) if p else None for p in (args.out, args.baseline, args.save_baseline))
+    if baseline_path and not os.path.exists(baseline_path):
+        print(f"!!! فایل baseline در {baseline_path} پیدا نشد؛ اول با --save-baseline {args.baseline} یک baseline بسازید.")
+        sys.exit(2)
+
+    os.makedirs(args.workdir, exist_ok=True)
+    os.chdir(args.workdir)
+    setup(args)
+    result = asyncio.run(run(args))
+
+    print(json.dumps({key: result[key] for key in ("turns", "errors", "wall_time_s", "turns_per_s", "latency_ms", "ttft_ms", "memory_mb")},
+                     ensure_ascii=False, indent=2))
+    for route, stats in result["routes"].items():
+        print(f"{route:>18}: latency {stats['latency_ms']}, ttft {stats['ttft_ms']}")
+    for path in filter(None, (out, save_path)):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+        print(f"نتیجه در {path} ذخیره شد.")
+
+    if baseline_path:
+        with open(baseline_path, encoding="utf-8") as f:
+            regressions = compare(result, json.load(f), args.tolerance)
+        if regressions:
+            print(f"!!! پسرفت نسبت به baseline (آستانه {args.tolerance:.0%}):\n  " + "\n  ".join(regressions))
+            sys.exit(1)
+        print(f"✅ بدون پسرفت نسبت به baseline (آستانه {args.tolerance:.0%}).")
+
+
+if __name__ == "__main__":
+    main()
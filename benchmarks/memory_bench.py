@@ -0,0 +1,127 @@
+"""
+بنچمارک حافظه گفتگو: یک گفتگوی ۲۰۰ نوبتی (هر نوبت: پیام کاربر، فراخوانی ابزار جستجو، نتیجه‌ی ابزار و پاسخ)
+با تاریخچه‌ی کامل (رفتار قبلی) و با ConversationMemory مقایسه می‌شود.
+
+برای هر نوبت توکن‌های prompt ایجنت، توکن‌های ورودی مسیریاب و زمان آماده‌سازی context اندازه‌گیری می‌شود.
+زمان LLM متناسب با توکن‌های prompt شبیه‌سازی می‌شود (--ms-per-1k-tokens) و خلاصه‌ساز یک تابع محلی
+با همان قرارداد summarize است، پس عددها فقط رشد context را نشان می‌دهند نه کیفیت خلاصه را.
+
+    python -m benchmarks.memory_bench --turns 200
+
+با --check فقط حالت حافظه‌ی محدود اجرا می‌شود و اگر توکن‌های prompt یا تاخیر نوبت آخر بیش از --max-growth
+برابر نوبت ۱۰ باشد با کد خروج ۱ تمام می‌شود:
+
+    python -m benchmarks.memory_bench --turns 200 --check
+"""
+import argparse
+import asyncio
+import json
+import sys
+import time
+
+from langchain_core.messages import AIMessage, HumanMessage, ToolMessage
+from langgraph.graph.message import add_messages
+
+import memory
+
+CHECK_TURN = 10
+FOODS = [{"name": f"پیتزا ویژه {i}", "restaurant": "رستوران نمونه", "price": 150000 + i * 1000} for i in range(5)]
+
+
+async def _local_summarize(summary: str, messages: list) -> str:
+    # خلاصه‌ساز محلی: فقط پیام‌های کاربر را نگه می‌دارد و طول خلاصه را محدود می‌کند.
+    asks = [str(message.content) for message in messages if message.type == "human"]
+    text = (summary + " | " if summary else "") + "؛ ".join(asks)
+    return text[-memory.SUMMARY_MAX_TOKENS * memory.CHARS_PER_TOKEN:]
+
+
+def _turn_messages(turn: int) -> list:
+    call_id = f"call_{turn}"
+    return [
+        AIMessage(content="", tool_calls=[{"name": "simple_food_search_tool", "args": {"query": f"پیتزا {turn}"}, "id": call_id}]),
+        ToolMessage(content=json.dumps(FOODS, ensure_ascii=False), tool_call_id=call_id, name="simple_food_search_tool"),
+        AIMessage(content=f"این {len(FOODS)} پیتزا را پیدا کردم؛ کدام را به سبد اضافه کنم؟"),
+    ]
+
+
+async def _run(turns: int, bounded: bool, ms_per_1k_tokens: float) -> list:
+    conversation = memory.ConversationMemory(summarize=_local_summarize) if bounded else None
+    state = {"messages": [], "summary": None}
+    samples = []
+    for turn in range(turns):
+        state["messages"] = add_messages(state["messages"], [HumanMessage(content=f"پیتزا {turn} با پنیر اضافه دارید؟")])
+        started = time.perf_counter()
+        if bounded:
+            update = await conversation.compact(state)
+            if update:
+                state["messages"] = add_messages(state["messages"], update["messages"])
+                state["summary"] = update["summary"]
+            router_input = memory.router_view(state["messages"], state["summary"])
+            prompt = memory.prompt_messages(state)
+        else:
+            # رفتار قبلی: مسیریاب کل تاریخچه را رشته می‌کرد و ایجنت کل تاریخچه را می‌دید.
+            router_input = [HumanMessage(content="\n".join(f"{m.type}: {m.content}" for m in state["messages"]))]
+            prompt = state["messages"]
+        prompt_tokens = memory.messages_tokens(prompt)
+        router_tokens = memory.messages_tokens(router_input)
+        prepare = time.perf_counter() - started
+        simulated_llm = (prompt_tokens + router_tokens) / 1000 * ms_per_1k_tokens / 1000
+        samples.append({"turn": turn + 1, "prompt_tokens": prompt_tokens, "router_tokens": router_tokens,
+                        "latency_ms": (prepare + simulated_llm) * 1000})
+        state["messages"] = add_messages(state["messages"], _turn_messages(turn))
+    return samples
+
+
+def _average(samples: list, turn: int, key: str, span: int = 2) -> float:
+    # میانگین چند نوبت اطراف turn تا نوسان زمان‌سنجی روی یک نوبت نتیجه را عوض نکند.
+    window = [s[key] for s in samples if abs(s["turn"] - turn) <= span]
+    return sum(window) / len(window)
+
+def check(samples: list, max_growth: float) -> list:
+    """خطاها اگر رشد توکن‌های prompt یا تاخیر از نوبت CHECK_TURN تا نوبت آخر بیش از max_growth برابر باشد."""
+    last = samples[-1]["turn"]
+    failures = []
+    for key in ("prompt_tokens", "latency_ms"):
+        start, end = _average(samples, CHECK_TURN, key), _average(samples, last, key)
+        if end > start * max_growth:
+            failures.append(f"{key}: نوبت {last} = {end:.1f}، نوبت {CHECK_TURN} = {start:.1f} (بیش از x{max_growth})")
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--turns", type=int, default=200)
+    parser.add_argument("--ms-per-1k-tokens", type=float, default=20.0, help="هزینه‌ی شبیه‌سازی شده‌ی prefill مدل")
+    parser.add_argument("--check", action="store_true", help="فقط حافظه‌ی محدود؛ ثابت نبودن توکن‌ها و تاخیر کد خروج ۱ می‌دهد")
+    parser.add_argument("--max-growth", type=float, default=2.0, help="بیشترین نسبت مجاز نوبت آخر به نوبت ۱۰ در --check")
+    args = parser.parse_args()
+
+    memory.count_tokens("گرم کردن")
+    if args.check:
+        if args.turns <= CHECK_TURN:
+            parser.error(f"--check به بیش از {CHECK_TURN} نوبت نیاز دارد")
+        failures = check(asyncio.run(_run(args.turns, True, args.ms_per_1k_tokens)), args.max_growth)
+        for failure in failures:
+            print(f"!!! {failure}")
+        if failures:
+            sys.exit(1)
+        print(f"✅ توکن‌های prompt و تاخیر در {args.turns} نوبت ثابت ماندند (حداکثر x{args.max_growth} نسبت به نوبت {CHECK_TURN})")
+        return
+
+    checkpoints = sorted({1, 10, 50, 100, args.turns})
+    for label, bounded in (("full_history", False), ("bounded", True)):
+        samples = asyncio.run(_run(args.turns, bounded, args.ms_per_1k_tokens))
+        print(label)
+        for sample in samples:
+            if sample["turn"] in checkpoints:
+                print(f"  turn {sample['turn']:4d}: prompt={sample['prompt_tokens']:6d} router={sample['router_tokens']:6d} "
+                      f"latency={sample['latency_ms']:8.2f}ms")
+        # مقایسه‌ی دهک آخر با دهک وسط گفتگو: با حافظه‌ی محدود بعد از پر شدن پنجره تاخیر ثابت می‌ماند.
+        size = len(samples) // 10 or 1
+        middle, last = samples[len(samples) // 2 - size:len(samples) // 2], samples[-size:]
+        growth = sum(s["latency_ms"] for s in last) / len(last) / (sum(s["latency_ms"] for s in middle) / len(middle))
+        print(f"  latency growth (last 10% / middle 10%): x{growth:.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,148 @@
+"""
+بنچمارک جدول سفارش‌ها روی چند میلیون سفارش، قبل و بعد از مهاجرت‌ها (migrations.py):
+
+  history    تاریخچه‌ی کاربر: اسکن orders بدون ایندکس، همان کوئری با ایندکس پوششی، و جدول تجمیع شده‌ی user_order_history
+  insert     هزینه‌ی تریگرهای زمان و تاریخچه روی درج سفارش‌های جدید
+  cancel     لغو همزمان یک سفارش از چند thread: خواندن و سپس UPDATE (رفتار قبلی) در برابر UPDATE شرطی اتمی؛
+             در حالت درست برای هر سفارش دقیقا یک لغو موفق گزارش می‌شود.
+
+پایگاه داده‌ی پایه یک بار ساخته می‌شود و هر اجرا روی یک کپی از آن کار می‌کند.
+
+    python -m benchmarks.orders_bench --orders 3000000 --users 100000
+"""
+import argparse
+import os
+import random
+import shutil
+import sqlite3
+import statistics
+import threading
+import time
+
+import database
+import migrations
+import tools
+from benchmarks._data import build_menu_db
+
+HISTORY_SQL = "SELECT food_name FROM orders WHERE user_id = ? AND status = ?"
+
+
+def _latency(func, args_list: list) -> str:
+    timings = []
+    for args in args_list:
+        started = time.perf_counter()
+        func(*args)
+        timings.append((time.perf_counter() - started) * 1000)
+    timings.sort()
+    return f"p50 {statistics.median(timings):.3f}ms / p95 {timings[int(len(timings) * 0.95) - 1]:.3f}ms"
+
+
+def _insert_rate(db_path: str, count: int, users: int) -> float:
+    rng = random.Random(3)
+    conn = sqlite3.connect(db_path)
+    foods = [row[0] for row in conn.execute("SELECT name FROM foods LIMIT 1000")]
+    rows = [(f"user{rng.randint(1, users)}", rng.choice(foods), 'تحویل داده شده') for _ in range(count)]
+    started = time.perf_counter()
+    for start in range(0, count, 500):
+        with conn:
+            conn.executemany("INSERT INTO orders (user_id, food_name, status) VALUES (?, ?, ?)", rows[start:start + 500])
+    elapsed = time.perf_counter() - started
+    conn.close()
+    return count / elapsed
+
+
+def _cancel_read_then_update(order_id: int) -> bool:
+    """رفتار قبلی cancel_order: خواندن وضعیت و UPDATE بدون شرط در دو مرحله."""
+    with database.connection() as conn:
+        status = conn.execute("SELECT status FROM orders WHERE id = ?", (order_id,)).fetchone()[0]
+        if status != tools.PREPARING_STATUS:
+            return False
+        with conn:
+            conn.execute("UPDATE orders SET status = ? WHERE id = ?", (tools.CANCELLED_STATUS, order_id))
+        return True
+
+
+def _concurrent_cancels(cancel, order_ids: list, threads: int) -> int:
+    successes = 0
+    lock = threading.Lock()
+    for order_id in order_ids:
+        barrier = threading.Barrier(threads)
+
+        def worker():
+            nonlocal successes
+            barrier.wait()
+            if cancel(order_id):
+                with lock:
+                    successes += 1
+        workers = [threading.Thread(target=worker) for _ in range(threads)]
+        for thread in workers:
+            thread.start()
+        for thread in workers:
+            thread.join()
+    return successes
+
+
+def _new_orders(db_path: str, count: int) -> list:
+    conn = sqlite3.connect(db_path)
+    with conn:
+        ids = [conn.execute("INSERT INTO orders (user_id, food_name, status) VALUES ('bench', 'x', ?)", (tools.PREPARING_STATUS,)).lastrowid
+               for _ in range(count)]
+    conn.close()
+    return ids
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--orders", type=int, default=3000000)
+    parser.add_argument("--users", type=int, default=100000)
+    parser.add_argument("--foods", type=int, default=20000)
+    parser.add_argument("--lookups", type=int, default=200)
+    parser.add_argument("--inserts", type=int, default=20000)
+    parser.add_argument("--cancels", type=int, default=50)
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--db", default=os.path.join("db", "bench_orders.db"))
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    base = build_menu_db(args.db, args.foods, args.orders, n_users=args.users)
+    work = f"{args.db}.work"
+    for suffix in ("", "-wal", "-shm"):
+        if os.path.exists(work + suffix):
+            os.remove(work + suffix)
+    shutil.copyfile(base, work)
+    print(f"پایگاه داده‌ی پایه ({args.orders:,} سفارش، {args.users:,} کاربر) در {time.perf_counter() - started:.1f}s آماده شد.\n")
+    database.configure_database(work)
+
+    rng = random.Random(11)
+    lookups = [(f"user{rng.randint(1, args.users)}", migrations.DELIVERED_STATUS) for _ in range(args.lookups)]
+    print("قبل از مهاجرت")
+    print(f"  history (اسکن orders):           {_latency(lambda *a: database.fetchall(HISTORY_SQL, a, read_only=True), lookups[:20])}")
+    print(f"  insert: {_insert_rate(work, args.inserts, args.users):,.0f} سفارش/ثانیه")
+    order_ids = _new_orders(work, args.cancels)
+    reported = _concurrent_cancels(_cancel_read_then_update, order_ids, args.threads)
+    print(f"  cancel (خواندن سپس UPDATE):     {reported} لغو موفق گزارش شد برای {len(order_ids)} سفارش")
+
+    print("\nمهاجرت‌ها")
+    with database.connection() as conn:
+        migrations.migrate(conn)
+
+    print("\nبعد از مهاجرت")
+    print(f"  history (ایندکس پوششی):          {_latency(lambda *a: database.fetchall(HISTORY_SQL, a, read_only=True), lookups)}")
+    print(f"  history (user_order_history):    {_latency(lambda user, _: tools.get_favourite_foods(user, limit=None), lookups)}")
+    print(f"  insert (با تریگرها): {_insert_rate(work, args.inserts, args.users):,.0f} سفارش/ثانیه")
+    order_ids = _new_orders(work, args.cancels)
+    reported = _concurrent_cancels(lambda order_id: "موفقیت" in tools.cancel_order(order_id), order_ids, args.threads)
+    print(f"  cancel (UPDATE شرطی اتمی):       {reported} لغو موفق گزارش شد برای {len(order_ids)} سفارش")
+
+    # جدول تجمیع شده باید دقیقا با تجمیع مستقیم سفارش‌ها برابر باشد.
+    mismatched = 0
+    for user, status in lookups:
+        expected = dict(database.fetchall("SELECT food_name, COUNT(*) FROM orders WHERE user_id = ? AND status = ? GROUP BY food_name",
+                                          (user, status), read_only=True))
+        actual = {item["name"]: item["delivered"] for item in tools.get_favourite_foods(user, limit=None)}
+        mismatched += expected != actual
+    print(f"  سازگاری user_order_history: {len(lookups) - mismatched}/{len(lookups)} کاربر")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+"""
+بنچمارک جستجوی منو: اسکن کامل با LIKE '%q%' در برابر ایندکس FTS5/trigram و ایندکس (category, price)،
+و همه‌ی نتایج در برابر فقط صفحه‌ی اول (search_page، همان چیزی که ابزارهای جستجو و UI می‌خوانند).
+
+    python -m benchmarks.search_bench --foods 100000 --repeat 50
+"""
+import argparse
+import os
+import sqlite3
+import statistics
+import time
+
+import database
+import search_index
+from benchmarks._data import build_menu_db
+
+_ARABIC_VARIANTS = str.maketrans({'ی': 'ي', 'ک': 'ك', **{str(i): d for i, d in enumerate('۰۱۲۳۴۵۶۷۸۹')}})
+
+
+def _queries(conn) -> list:
+    name = conn.execute("SELECT name FROM foods WHERE id = 4242").fetchone()[0]
+    first_word = name.split()[0]
+    typo = first_word[:-1] + ('ز' if first_word[-1] != 'ز' else 'ر')
+    return [
+        ("نام دقیق", name, None),
+        ("نام با ارقام فارسی و ي/ك عربی", name.translate(_ARABIC_VARIANTS), None),
+        ("پیشوند دو کلمه + قیمت", " ".join(name.split()[:2]), 80000),
+        ("دسته‌بندی + قیمت", "دسر", 60000),
+        ("زیررشته", "یتز", 55000),
+        ("غلط تایپی", name.replace(first_word, typo, 1), None),
+    ]
+
+
+def _like_search(conn, query, max_price):
+    term = f"%{query}%"
+    sql = "SELECT name, restaurant_name, price FROM foods WHERE (name LIKE ? OR category LIKE ?)"
+    params = [term, term]
+    if max_price is not None:
+        sql += " AND price <= ?"
+        params.append(max_price)
+    return conn.execute(sql, params).fetchall()
+
+
+def _measure(func, repeat: int):
+    timings, result = [], None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        timings.append((time.perf_counter() - start) * 1000)
+    timings.sort()
+    return statistics.median(timings), timings[int(len(timings) * 0.95) - 1], len(result)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--foods", type=int, default=100000)
+    parser.add_argument("--repeat", type=int, default=50)
+    parser.add_argument("--db", default=os.path.join("db", "bench_search.db"))
+    args = parser.parse_args()
+
+    db_path = build_menu_db(args.db, args.foods)
+    database.configure_database(db_path)
+    start = time.perf_counter()
+    with database.connection() as conn:
+        search_index.ensure_search_index(conn)
+    print(f"ساخت/بررسی ایندکس برای {args.foods:,} غذا: {time.perf_counter() - start:.2f}s\n")
+
+    raw = sqlite3.connect(db_path)
+    print(f"{'کوئری':<28}{'LIKE p50/p95 (ms)':>22}{'ایندکس p50/p95 (ms)':>24}{'صفحه اول p50/p95 (ms)':>26}{'نتایج':>12}")
+    for label, query, max_price in _queries(raw):
+        like = _measure(lambda: _like_search(raw, query, max_price), args.repeat)
+        indexed = _measure(lambda: search_index.search(query, max_price), args.repeat)
+        page = _measure(lambda: search_index.search_page(query, max_price)["rows"], args.repeat)
+        print(f"{label:<28}{like[0]:>10.3f} / {like[1]:<9.3f}{indexed[0]:>12.3f} / {indexed[1]:<9.3f}"
+              f"{page[0]:>14.3f} / {page[1]:<9.3f}{like[2]:>5} / {indexed[2]:<5}")
+    raw.close()
+
+
+if __name__ == "__main__":
+    main()
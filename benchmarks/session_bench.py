@@ -0,0 +1,67 @@
+"""
+بنچمارک ساخت جلسه: هزینه on_chat_start برای N جلسه (بدون فراخوانی LLM).
+
+  per_session  رفتار قبلی: کامپایل گراف اصلی و گراف پیشنهاد برای هر جلسه و نگهداری آن‌ها در حافظه جلسه
+  registry     گراف‌های مشترک پروسه و فقط یک thread_id برای هر جلسه
+
+علاوه بر زمان، حافظه‌ای که جلسه‌ها بعد از ساخته شدن نگه می‌دارند (tracemalloc) هم گزارش می‌شود.
+
+    python -m benchmarks.session_bench --sessions 1000
+"""
+import argparse
+import json
+import os
+import statistics
+import time
+import tracemalloc
+
+os.environ.setdefault("OPENAI_API_KEY", "benchmark")
+
+import main
+
+
+def _per_session(i: int) -> dict:
+    return {"app": main.build_app(), "recommendation_app": main.build_recommendation_app(), "message_history": []}
+
+
+def _registry(i: int) -> dict:
+    main.get_app()
+    main.get_recommendation_app()
+    return {"config": main.session_config(f"bench-{i}")}
+
+
+def _run(create_session, sessions: int) -> dict:
+    tracemalloc.start()
+    baseline = tracemalloc.get_traced_memory()[0]
+    latencies, alive = [], []
+    started = time.perf_counter()
+    for i in range(sessions):
+        session_started = time.perf_counter()
+        alive.append(create_session(i))
+        latencies.append(time.perf_counter() - session_started)
+    elapsed = time.perf_counter() - started
+    retained = tracemalloc.get_traced_memory()[0] - baseline
+    tracemalloc.stop()
+    latencies.sort()
+    return {
+        "sessions": sessions,
+        "total_s": round(elapsed, 3),
+        "mean_ms": round(statistics.mean(latencies) * 1000, 3),
+        "p95_ms": round(latencies[int(len(latencies) * 0.95) - 1] * 1000, 3),
+        "retained_mb": round(retained / 2 ** 20, 2),
+    }
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sessions", type=int, default=1000)
+    args = parser.parse_args()
+
+    # زیرگراف‌ها در هر دو حالت یک بار ساخته شده‌اند تا فقط هزینه ساخت جلسه مقایسه شود.
+    main.get_app()
+    for label, create_session in (("per_session", _per_session), ("registry", _registry)):
+        print(f"{label:12s} " + json.dumps(_run(create_session, args.sessions)))
+
+
+if __name__ == "__main__":
+    main_cli()
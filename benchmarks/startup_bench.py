@@ -0,0 +1,100 @@
+"""
+بنچمارک شروع سرد: هر سناریو در یک پروسه تازه پایتون اجرا می‌شود تا cacheهای ماژول‌ها اثری نداشته باشند.
+
+  eager_import   ایمپورت main به همراه کتابخانه‌های سنگین (رفتار قبلی که همه چیز را در ایمپورت بارگذاری می‌کرد)
+  lazy_import    ایمپورت main با ایمپورت‌های تنبل
+  cold_request   اولین درخواست (کامپایل گراف + جستجوی منو + بازیابی RAG) بدون گرم کردن
+  warm_request   همان درخواست بعد از start_warmup و رسیدن کاربر با تاخیر --arrival ثانیه
+
+    python -m benchmarks.startup_bench --runs 3 --arrival 5
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+_PRELUDE = """
+import json, time
+started = time.perf_counter()
+"""
+
+_HEAVY_IMPORTS = """
+import langchain_openai, lancedb, langchain_huggingface
+from langchain_community.tools import DuckDuckGoSearchRun
+"""
+
+_FIRST_REQUEST = """
+import tools
+request_started = time.perf_counter()
+errors = []
+main.get_app()
+tools.search_food("پیتزا")
+try:
+    main.get_retriever().invoke("کباب کوبیده چیست")
+except Exception as e:
+    errors.append(str(e))
+result["first_request_s"] = time.perf_counter() - request_started
+result["errors"] = errors
+"""
+
+SCENARIOS = {
+    "eager_import": _PRELUDE + _HEAVY_IMPORTS + """
+import main
+result = {"import_s": time.perf_counter() - started}
+""",
+    "lazy_import": _PRELUDE + """
+import main
+result = {"import_s": time.perf_counter() - started}
+""",
+    "cold_request": _PRELUDE + """
+import main
+result = {"import_s": time.perf_counter() - started}
+""" + _FIRST_REQUEST,
+    "warm_request": _PRELUDE + """
+import main, startup
+result = {"import_s": time.perf_counter() - started}
+startup.start_warmup()
+time.sleep(ARRIVAL)
+startup.wait_until_ready()
+result["warmup_s"] = startup.get_startup_status()["seconds"]
+""" + _FIRST_REQUEST,
+}
+
+
+def _run_scenario(code: str, arrival: float) -> dict:
+    code = code.replace("ARRIVAL", repr(arrival)) + "\nprint('RESULT ' + json.dumps(result))\n"
+    env = dict(os.environ)
+    env.setdefault("OPENAI_API_KEY", "benchmark")
+    proc = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, env=env)
+    for line in proc.stdout.splitlines():
+        if line.startswith("RESULT "):
+            return json.loads(line[len("RESULT "):])
+    return {"error": (proc.stderr.strip().splitlines() or ["unknown"])[-1]}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--arrival", type=float, default=5.0, help="فاصله بالا آمدن سرور تا اولین پیام کاربر (ثانیه)")
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS))
+    args = parser.parse_args()
+
+    for name in args.scenarios.split(","):
+        runs = [_run_scenario(SCENARIOS[name], args.arrival) for _ in range(args.runs)]
+        failed = [r for r in runs if "error" in r]
+        if failed:
+            print(f"{name:14s} error: {failed[0]['error']}")
+            continue
+        summary = {}
+        for key in ("import_s", "warmup_s", "first_request_s"):
+            values = [r[key] for r in runs if r.get(key) is not None]
+            if values:
+                summary[key] = round(statistics.median(values), 3)
+        errors = sorted({e for r in runs for e in r.get("errors", [])})
+        print(f"{name:14s} " + json.dumps(summary) + (f"  (retrieval errors: {errors})" if errors else ""))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+"""
+بنچمارک جستجوی وب با یک backend شبیه‌سازی شده (تاخیر ثابت و گاهی بسیار کند، بدون شبکه):
+
+  direct   رفتار قبلی: هر سوال یک درخواست مستقل به سرویس، بدون cache و مهلت
+  cached   web_search: cache سوال نرمال شده، یکی کردن درخواست‌های همزمان، محدودیت همزمانی و مهلت
+
+سوال‌ها از یک مجموعه‌ی کوچک با توزیع Zipf انتخاب می‌شوند (چند سوال پرتکرار مثل «پیتزا چیست»).
+
+    python -m benchmarks.web_search_bench --requests 400 --distinct 40 --latency-ms 300 --slow-ratio 0.05
+"""
+import argparse
+import asyncio
+import os
+import random
+import tempfile
+import time
+
+import web_search
+
+
+class SimulatedBackend:
+    name = "simulated"
+
+    def __init__(self, latency_ms: float, slow_ratio: float, seed: int = 7):
+        self.latency_ms = latency_ms
+        self.slow_ratio = slow_ratio
+        self.random = random.Random(seed)
+        self.calls = 0
+
+    def search(self, query: str, max_results: int) -> list:
+        self.calls += 1
+        # درخواست‌های کند (۲۰ برابر تاخیر معمول) همان چیزی است که قبلا کل جلسه را معطل می‌کرد.
+        slow = self.random.random() < self.slow_ratio
+        time.sleep(self.latency_ms / 1000 * (20 if slow else 1))
+        return [{"title": query, "snippet": f"نتیجه‌ی {i}", "link": ""} for i in range(max_results)]
+
+
+def _queries(count: int, distinct: int, seed: int = 11) -> list:
+    rng = random.Random(seed)
+    weights = [1 / (rank + 1) for rank in range(distinct)]
+    # تفاوت‌های نوشتاری (ي/ی، علامت سوال) باید به یک کلید cache برسند.
+    variants = ["{} چیست؟", "{} چيست", "{}  چیست"]
+    return [rng.choice(variants).format(f"غذای {rng.choices(range(distinct), weights)[0]}") for _ in range(count)]
+
+
+async def _direct(backend: SimulatedBackend, query: str) -> float:
+    started = time.perf_counter()
+    await asyncio.to_thread(backend.search, query, web_search.MAX_RESULTS)
+    return time.perf_counter() - started
+
+
+async def _cached(query: str) -> float:
+    started = time.perf_counter()
+    await web_search.search(query)
+    return time.perf_counter() - started
+
+
+async def _measure(func, queries: list, arrival_ms: float) -> dict:
+    async def delayed(index: int, query: str) -> float:
+        await asyncio.sleep(index * arrival_ms / 1000)
+        return await func(query)
+
+    started = time.perf_counter()
+    latencies = sorted(await asyncio.gather(*(delayed(i, q) for i, q in enumerate(queries))))
+    return {"wall_time_s": round(time.perf_counter() - started, 2), "avg_ms": round(1000 * sum(latencies) / len(latencies), 1),
+            "p99_ms": round(1000 * latencies[int(len(latencies) * 0.99) - 1], 1)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=400)
+    parser.add_argument("--distinct", type=int, default=40)
+    parser.add_argument("--latency-ms", type=float, default=300.0)
+    parser.add_argument("--slow-ratio", type=float, default=0.05)
+    parser.add_argument("--arrival-ms", type=float, default=5.0)
+    args = parser.parse_args()
+    queries = _queries(args.requests, args.distinct)
+
+    backend = SimulatedBackend(args.latency_ms, args.slow_ratio)
+    result = asyncio.run(_measure(lambda query: _direct(backend, query), queries, args.arrival_ms))
+    print("direct", {**result, "backend_calls": backend.calls})
+
+    with tempfile.TemporaryDirectory() as cache_dir:
+        backend = SimulatedBackend(args.latency_ms, args.slow_ratio)
+        web_search.set_backend(backend)
+        web_search._cache = web_search.SearchCache(os.path.join(cache_dir, "web_search_cache.db"))
+        web_search.SEARCH_TIMEOUT = args.latency_ms * 5 / 1000
+        result = asyncio.run(_measure(_cached, queries, args.arrival_ms))
+        print("cached", {**result, "backend_calls": backend.calls}, web_search.get_stats())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,119 @@
+"""
+بنچمارک چند worker: throughput با ۱، ۲، ۴ ... پروسه که همگی از یک backend مشترک (state_backend) استفاده می‌کنند.
+
+هر نوبت یک گراف لنگ‌گراف با checkpointer مشترک اجرا می‌کند: جستجوی منو در پایگاه داده، کار CPU شبیه‌سازی شده
+(--cpu-ms، به جای امبدینگ و پردازش پیام که GIL را نگه می‌دارند) و انتظار LLM (--llm-ms). نوبت‌های هر جلسه
+عمدا به صورت چرخشی بین workerها پخش می‌شوند (بدون sticky session) و در پایان بررسی می‌شود که تاریخچه‌ی
+هر جلسه کامل است، یعنی همه‌ی workerها یک وضعیت مشترک دیده‌اند.
+
+    python -m benchmarks.workers_bench --workers 1,2,4 --sessions 64 --turns 5 --backend sqlite
+"""
+import argparse
+import asyncio
+import multiprocessing as mp
+import os
+import time
+from typing import Annotated, List, TypedDict
+
+from langchain_core.messages import AIMessage, BaseMessage, HumanMessage
+from langgraph.graph import END, StateGraph
+from langgraph.graph.message import add_messages
+
+import database
+import search_index
+import state_backend
+import tools
+from benchmarks._data import build_menu_db
+
+
+class State(TypedDict):
+    messages: Annotated[List[BaseMessage], add_messages]
+
+
+def _build_graph(cpu_ms: float, llm_ms: float):
+    async def agent(state: State):
+        results = await tools.asearch_food(state["messages"][-1].content)
+        deadline = time.perf_counter() + cpu_ms / 1000
+        while time.perf_counter() < deadline:
+            pass
+        await asyncio.sleep(llm_ms / 1000)
+        return {"messages": [AIMessage(content=f"{len(results)} غذا پیدا شد")]}
+
+    workflow = StateGraph(State)
+    workflow.add_node("agent", agent)
+    workflow.set_entry_point("agent")
+    workflow.add_edge("agent", END)
+    return workflow.compile(checkpointer=state_backend.create_checkpointer())
+
+
+def _worker(inbox: mp.Queue, outbox: mp.Queue, cpu_ms: float, llm_ms: float):
+    app = _build_graph(cpu_ms, llm_ms)
+
+    async def turn(session: str, number: int):
+        config = {"configurable": {"thread_id": session}}
+        await app.ainvoke({"messages": [HumanMessage(content=f"پیتزا ویژه {number}")]}, config)
+
+    async def run_turns(sessions: list, number: int):
+        await asyncio.gather(*(turn(session, number) for session in sessions))
+
+    while True:
+        job = inbox.get()
+        if job is None:
+            break
+        sessions, number = job
+        asyncio.run(run_turns(sessions, number))
+        outbox.put(len(sessions))
+
+
+def _run(workers: int, sessions: int, turns: int, cpu_ms: float, llm_ms: float, run_id: str) -> dict:
+    ctx = mp.get_context("fork")
+    inboxes, outbox = [ctx.Queue() for _ in range(workers)], ctx.Queue()
+    processes = [ctx.Process(target=_worker, args=(inbox, outbox, cpu_ms, llm_ms)) for inbox in inboxes]
+    for process in processes:
+        process.start()
+    names = [f"{run_id}-{i}" for i in range(sessions)]
+    started = time.perf_counter()
+    for number in range(turns):
+        # نوبت number جلسه‌ی i به worker شماره (i + number) % workers می‌رود.
+        for index, inbox in enumerate(inboxes):
+            inbox.put(([name for i, name in enumerate(names) if (i + number) % workers == index], number))
+        for _ in inboxes:
+            outbox.get(timeout=600)
+    elapsed = time.perf_counter() - started
+    for inbox in inboxes:
+        inbox.put(None)
+    for process in processes:
+        process.join()
+
+    checkpointer = state_backend.create_checkpointer()
+    complete = sum(
+        1 for name in names
+        if len(checkpointer.get_tuple({"configurable": {"thread_id": name}}).checkpoint["channel_values"]["messages"]) == 2 * turns
+    ) if state_backend.get_shared_backend() is not None else None
+    return {"turns_per_s": round(sessions * turns / elapsed, 1), "wall_time_s": round(elapsed, 3), "complete_sessions": complete}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", default="1,2,4")
+    parser.add_argument("--sessions", type=int, default=64)
+    parser.add_argument("--turns", type=int, default=5)
+    parser.add_argument("--cpu-ms", type=float, default=10.0)
+    parser.add_argument("--llm-ms", type=float, default=50.0)
+    parser.add_argument("--backend", default="sqlite", choices=sorted(state_backend.BACKENDS))
+    parser.add_argument("--db", default=os.path.join("db", "bench_workers.db"))
+    args = parser.parse_args()
+
+    state_backend.STATE_BACKEND = args.backend
+    state_backend.STATE_DB_PATH = os.path.join(os.path.dirname(args.db) or ".", "bench_workers_state.db")
+    database.configure_database(build_menu_db(args.db, 20000))
+    search_index.ensure_ready()
+    database.close_pools()
+    print(f"cpu cores: {os.cpu_count()}, backend: {args.backend}")
+    for workers in (int(w) for w in args.workers.split(",")):
+        result = _run(workers, args.sessions, args.turns, args.cpu_ms, args.llm_ms, f"w{workers}-{time.time_ns()}")
+        print(f"workers={workers}", result)
+
+
+if __name__ == "__main__":
+    main()
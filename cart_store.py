@@ -0,0 +1,221 @@
+import atexit
+import os
+import sqlite3
+import threading
+import time
+from collections import defaultdict
+
+import database
+
+# ==================== تنظیمات ====================
+# کلیک‌های پشت سر هم روی «افزودن به سبد» در حافظه جمع و هر FLUSH_INTERVAL ثانیه (یا با رسیدن به
+# MAX_PENDING عملیات) در یک تراکنش نوشته می‌شوند. خواندن سبد و ثبت سفارش قبل از اجرا بافر را خالی می‌کنند.
+FLUSH_INTERVAL = float(os.getenv("CHATFOOD_CART_FLUSH_INTERVAL", "0.2"))
+MAX_PENDING = 256
+NEW_ORDER_STATUS = 'در حال آماده‌سازی'
+
+SCHEMA = [
+    "CREATE TABLE IF NOT EXISTS carts (cart_id TEXT PRIMARY KEY, user_id TEXT, created REAL NOT NULL, updated REAL NOT NULL)",
+    """CREATE TABLE IF NOT EXISTS cart_items (
+        cart_id TEXT NOT NULL, food_name TEXT NOT NULL, quantity INTEGER NOT NULL CHECK (quantity > 0), added REAL NOT NULL,
+        PRIMARY KEY (cart_id, food_name)) WITHOUT ROWID""",
+    """CREATE TABLE IF NOT EXISTS checkouts (
+        id INTEGER PRIMARY KEY AUTOINCREMENT, cart_id TEXT NOT NULL, user_id TEXT, total REAL NOT NULL, created REAL NOT NULL)""",
+    """CREATE TABLE IF NOT EXISTS checkout_items (
+        checkout_id INTEGER NOT NULL, food_name TEXT NOT NULL, quantity INTEGER NOT NULL, unit_price REAL NOT NULL, order_id INTEGER,
+        PRIMARY KEY (checkout_id, food_name))""",
+]
+
+
+def ensure_cart_tables(conn: sqlite3.Connection):
+    with conn:
+        for statement in SCHEMA:
+            conn.execute(statement)
+
+_ready = False
+_ready_lock = threading.Lock()
+
+def ensure_ready():
+    global _ready
+    if _ready:
+        return
+    with _ready_lock:
+        if not _ready:
+            with database.connection() as conn:
+                ensure_cart_tables(conn)
+            _ready = True
+
+
+class CartWriteBuffer:
+    """
+    بافر write-behind برای تغییرات سبد خرید. تغییرات هر (سبد، غذا) با هم جمع می‌شوند و یک thread پس‌زمینه
+    آن‌ها را به صورت دسته‌ای و در یک تراکنش با upsert در پایگاه داده می‌نویسد.
+    """
+
+    def __init__(self, interval: float = FLUSH_INTERVAL, max_pending: int = MAX_PENDING):
+        self.interval = interval
+        self.max_pending = max_pending
+        self._pending = defaultdict(int)  # (cart_id, food_name) -> تغییر تعداد
+        self._users = {}  # cart_id -> user_id
+        self._operations = 0
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread = None
+        self._stats = {"operations": 0, "flushes": 0, "rows_written": 0, "max_batch": 0, "errors": 0}
+
+    def _ensure_thread(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="chatfood-cart-flush", daemon=True)
+            self._thread.start()
+            atexit.register(self.flush)
+
+    def _run(self):
+        while True:
+            self._wakeup.wait(self.interval)
+            self._wakeup.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"!!! خطا در نوشتن دسته‌ای سبد خرید: {e}")
+
+    def add(self, cart_id: str, food_name: str, quantity: int = 1, user_id: str = None):
+        with self._lock:
+            self._ensure_thread()
+            self._pending[(cart_id, food_name)] += quantity
+            if user_id:
+                self._users[cart_id] = user_id
+            self._operations += 1
+            self._stats["operations"] += 1
+            if self._operations >= self.max_pending:
+                self._wakeup.set()
+
+    def pending_items(self, cart_id: str) -> dict:
+        """تغییرات در انتظار یک سبد: food_name -> تغییر تعداد (منفی برای حذف)."""
+        with self._lock:
+            return {food: delta for (pending_cart, food), delta in self._pending.items() if pending_cart == cart_id}
+
+    def pending_quantity(self, cart_id: str) -> int:
+        # حذف چیزی که اضافه نشده بود نباید تعداد را منفی کند.
+        return max(0, sum(self.pending_items(cart_id).values()))
+
+    def flush(self) -> int:
+        """همه‌ی تغییرات در انتظار را در یک تراکنش می‌نویسد و تعداد ردیف‌ها را برمی‌گرداند."""
+        with self._flush_lock:
+            with self._lock:
+                if not self._pending:
+                    return 0
+                pending, users = dict(self._pending), dict(self._users)
+                self._pending.clear()
+                self._users.clear()
+                self._operations = 0
+            now = time.time()
+            try:
+                ensure_ready()
+                with database.connection() as conn:
+                    with conn:
+                        conn.executemany("""
+                            INSERT INTO carts (cart_id, user_id, created, updated) VALUES (?, ?, ?, ?)
+                            ON CONFLICT (cart_id) DO UPDATE SET updated = excluded.updated, user_id = COALESCE(excluded.user_id, user_id)
+                        """, [(cart_id, users.get(cart_id), now, now) for cart_id in {cart_id for cart_id, _ in pending}])
+                        conn.executemany("""
+                            INSERT INTO cart_items (cart_id, food_name, quantity, added) VALUES (?, ?, ?, ?)
+                            ON CONFLICT (cart_id, food_name) DO UPDATE SET quantity = quantity + excluded.quantity
+                        """, [(cart_id, food, delta, now) for (cart_id, food), delta in pending.items() if delta > 0])
+                        # کاهش تعداد (حذف از سبد): ردیف‌هایی که به صفر یا کمتر برسند پاک می‌شوند.
+                        removals = [(delta, cart_id, food) for (cart_id, food), delta in pending.items() if delta < 0]
+                        conn.executemany("DELETE FROM cart_items WHERE quantity + ? <= 0 AND cart_id = ? AND food_name = ?", removals)
+                        conn.executemany("UPDATE cart_items SET quantity = quantity + ? WHERE cart_id = ? AND food_name = ?", removals)
+            except Exception:
+                # تغییرات از دست نمی‌روند و در flush بعدی دوباره تلاش می‌شوند.
+                with self._lock:
+                    for key, delta in pending.items():
+                        self._pending[key] += delta
+                    for cart_id, user_id in users.items():
+                        self._users.setdefault(cart_id, user_id)
+                    self._stats["errors"] += 1
+                raise
+            with self._lock:
+                self._stats["flushes"] += 1
+                self._stats["rows_written"] += len(pending)
+                self._stats["max_batch"] = max(self._stats["max_batch"], len(pending))
+            return len(pending)
+
+    def stats(self) -> dict:
+        with self._lock:
+            stats = dict(self._stats)
+            stats["pending"] = len(self._pending)
+        stats["coalescing_ratio"] = stats["operations"] / stats["rows_written"] if stats["rows_written"] else 0.0
+        return stats
+
+_buffer = None
+_buffer_lock = threading.Lock()
+
+def get_buffer() -> CartWriteBuffer:
+    global _buffer
+    if _buffer is None:
+        with _buffer_lock:
+            if _buffer is None:
+                _buffer = CartWriteBuffer()
+    return _buffer
+
+def _reset_after_fork():
+    global _buffer
+    _buffer = None
+
+os.register_at_fork(after_in_child=_reset_after_fork)
+
+# ==================== خواندن سبد و ثبت سفارش ====================
+_CART_ITEMS_SQL = """
+    SELECT ci.food_name, f.restaurant_name, f.price, ci.quantity FROM cart_items ci
+    JOIN foods f ON f.name = ci.food_name
+    WHERE ci.cart_id = ? ORDER BY ci.added, ci.food_name
+"""
+
+def load_cart(cart_id: str) -> dict:
+    """اقلام سبد با قیمت‌های فعلی منو؛ تغییرات در انتظار بافر قبل از خواندن نوشته می‌شوند."""
+    ensure_ready()
+    get_buffer().flush()
+    rows = database.fetchall(_CART_ITEMS_SQL, (cart_id,), read_only=True)
+    items = [{"name": name, "restaurant": restaurant, "price": price, "quantity": quantity, "subtotal": price * quantity}
+             for name, restaurant, price, quantity in rows]
+    return {"cart_id": cart_id, "items": items, "total": sum(item["subtotal"] for item in items),
+            "count": sum(item["quantity"] for item in items)}
+
+def cart_count(cart_id: str) -> int:
+    """
+    تعداد اقلام سبد بدون خالی کردن بافر (ذخیره شده + در انتظار). مثل load_cart فقط غذاهای موجود در منو
+    شمرده می‌شوند و تعداد هر غذا کمتر از صفر نمی‌شود، پس نشان سبد با نمایش سبد یکی است.
+    """
+    ensure_ready()
+    stored = dict(database.fetchall(
+        "SELECT ci.food_name, ci.quantity FROM cart_items ci JOIN foods f ON f.name = ci.food_name WHERE ci.cart_id = ?",
+        (cart_id,), read_only=True))
+    pending = get_buffer().pending_items(cart_id)
+    return sum(max(0, stored.get(food, 0) + pending.get(food, 0)) for food in stored.keys() | pending.keys())
+
+def checkout_cart(cart_id: str, user_id: str = None) -> dict | None:
+    """
+    سبد را در یک تراکنش به سفارش تبدیل می‌کند: برای هر قلم یک ردیف در orders، ثبت checkout با قیمت‌های
+    همان لحظه و خالی کردن سبد. اگر سبد خالی باشد None برمی‌گرداند.
+    """
+    ensure_ready()
+    get_buffer().flush()
+    with database.connection() as conn:
+        with conn:
+            rows = conn.execute(_CART_ITEMS_SQL, (cart_id,)).fetchall()
+            if not rows:
+                return None
+            user_id = user_id or cart_id
+            total = sum(price * quantity for _, _, price, quantity in rows)
+            checkout_id = conn.execute("INSERT INTO checkouts (cart_id, user_id, total, created) VALUES (?, ?, ?, ?)",
+                                       (cart_id, user_id, total, time.time())).lastrowid
+            order_ids = []
+            for name, _, price, quantity in rows:
+                order_id = conn.execute("INSERT INTO orders (user_id, food_name, status) VALUES (?, ?, ?)",
+                                        (user_id, name, NEW_ORDER_STATUS)).lastrowid
+                order_ids.append(order_id)
+                conn.execute("INSERT INTO checkout_items (checkout_id, food_name, quantity, unit_price, order_id) VALUES (?, ?, ?, ?, ?)",
+                             (checkout_id, name, quantity, price, order_id))
+            conn.execute("DELETE FROM cart_items WHERE cart_id = ?", (cart_id,))
+    return {"checkout_id": checkout_id, "order_ids": order_ids, "total": total}
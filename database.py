@@ -0,0 +1,251 @@
+import sqlite3
+import os
+import threading
+import time
+import queue
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+import telemetry
+
+DB_PATH = os.getenv("CHATFOOD_DB_PATH", os.path.join('db', 'chatfood.db'))
+
+# ==================== تنظیمات Pool ====================
+POOL_SIZE = int(os.getenv("CHATFOOD_DB_POOL_SIZE", "4"))
+READ_POOL_SIZE = int(os.getenv("CHATFOOD_DB_READ_POOL_SIZE", "8"))
+CHECKOUT_TIMEOUT = float(os.getenv("CHATFOOD_DB_CHECKOUT_TIMEOUT", "10"))
+BUSY_TIMEOUT_MS = 1000
+BUSY_RETRIES = 5
+# تعداد statementهای آماده‌ای که هر اتصال در حافظه نگه می‌دارد؛
+# چون اتصال‌ها بسته نمی‌شوند، کوئری‌های تکراری دوباره parse نمی‌شوند.
+CACHED_STATEMENTS = 256
+
+
+class PoolTimeout(sqlite3.OperationalError):
+    """زمانی که هیچ اتصال آزادی در مهلت مشخص شده در Pool پیدا نشود."""
+
+
+class ConnectionPool:
+    """
+    یک Pool محدود و thread-safe از اتصال‌های SQLite.
+    هر thread در طول یک checkout به اتصال خودش متصل می‌ماند (فراخوانی‌های تو در تو همان اتصال را می‌گیرند)
+    و اتصال‌های آزاد به صورت LIFO برگردانده می‌شوند تا cache مربوط به statementها گرم بماند.
+    """
+
+    def __init__(self, db_path: str, size: int, read_only: bool = False):
+        self.db_path = db_path
+        self.size = size
+        self.read_only = read_only
+        self._idle = queue.LifoQueue(maxsize=size)
+        self._created = 0
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._closed = False
+        self._stats = {"checkouts": 0, "wait_time": 0.0, "max_wait_time": 0.0, "busy_retries": 0, "timeouts": 0}
+
+    def _connect(self) -> sqlite3.Connection:
+        if self.read_only:
+            uri = f"file:{os.path.abspath(self.db_path)}?mode=ro"
+            conn = sqlite3.connect(uri, uri=True, check_same_thread=False, cached_statements=CACHED_STATEMENTS, timeout=BUSY_TIMEOUT_MS / 1000)
+        else:
+            conn = sqlite3.connect(self.db_path, check_same_thread=False, cached_statements=CACHED_STATEMENTS, timeout=BUSY_TIMEOUT_MS / 1000)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute(f"PRAGMA busy_timeout={BUSY_TIMEOUT_MS}")
+        return conn
+
+    def _checkout(self) -> sqlite3.Connection:
+        start = time.perf_counter()
+        try:
+            conn = self._idle.get_nowait()
+        except queue.Empty:
+            conn = None
+            with self._lock:
+                if self._created < self.size:
+                    self._created += 1
+                    create = True
+                else:
+                    create = False
+            if create:
+                try:
+                    conn = self._connect()
+                except Exception:
+                    with self._lock:
+                        self._created -= 1
+                    raise
+            else:
+                try:
+                    conn = self._idle.get(timeout=CHECKOUT_TIMEOUT)
+                except queue.Empty:
+                    with self._lock:
+                        self._stats["timeouts"] += 1
+                    raise PoolTimeout(f"هیچ اتصال آزادی در {CHECKOUT_TIMEOUT} ثانیه پیدا نشد ({self.db_path}).")
+        waited = time.perf_counter() - start
+        with self._lock:
+            self._stats["checkouts"] += 1
+            self._stats["wait_time"] += waited
+            self._stats["max_wait_time"] = max(self._stats["max_wait_time"], waited)
+        return conn
+
+    def _release(self, conn: sqlite3.Connection):
+        if conn.in_transaction:
+            conn.rollback()
+        if self._closed:
+            conn.close()
+            return
+        self._idle.put_nowait(conn)
+
+    @contextmanager
+    def connection(self):
+        """یک اتصال را برای thread فعلی قرض می‌دهد و در پایان آن را به Pool برمی‌گرداند."""
+        held = getattr(self._local, "conn", None)
+        if held is not None:
+            self._local.depth += 1
+            try:
+                yield held
+            finally:
+                self._local.depth -= 1
+            return
+        conn = self._checkout()
+        self._local.conn, self._local.depth = conn, 1
+        try:
+            yield conn
+        finally:
+            self._local.conn, self._local.depth = None, 0
+            self._release(conn)
+
+    def record_busy_retry(self):
+        with self._lock:
+            self._stats["busy_retries"] += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            stats = dict(self._stats)
+            stats["avg_wait_time"] = stats["wait_time"] / stats["checkouts"] if stats["checkouts"] else 0.0
+            stats["size"] = self.size
+            stats["open_connections"] = self._created
+            stats["idle_connections"] = self._idle.qsize()
+        return stats
+
+    def close(self):
+        self._closed = True
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                break
+        with self._lock:
+            self._created = 0
+
+
+# ==================== Poolهای مشترک ====================
+_write_pool = None
+_read_pool = None
+_pools_lock = threading.RLock()
+
+def get_pool() -> ConnectionPool:
+    global _write_pool
+    if _write_pool is None:
+        with _pools_lock:
+            if _write_pool is None:
+                _write_pool = ConnectionPool(DB_PATH, POOL_SIZE)
+    return _write_pool
+
+def get_read_pool() -> ConnectionPool:
+    """Pool فقط-خواندنی برای مسیرهای جستجو؛ این اتصال‌ها هیچ‌وقت قفل نوشتن نمی‌گیرند."""
+    global _read_pool
+    if _read_pool is None:
+        with _pools_lock:
+            if _read_pool is None:
+                # اتصال نویسنده باید قبل از خواننده‌ها حالت WAL را روی فایل فعال کرده باشد.
+                with get_pool().connection():
+                    pass
+                _read_pool = ConnectionPool(DB_PATH, READ_POOL_SIZE, read_only=True)
+    return _read_pool
+
+# ==================== مسیر async ====================
+# یک executor اختصاصی برای پایگاه داده؛ اندازه آن با مجموع دو Pool برابر است تا threadها
+# هیچ‌وقت پشت checkout منتظر نمانند و executor پیش‌فرض asyncio هم برای کارهای دیگر آزاد بماند.
+_executor = None
+
+def get_executor() -> ThreadPoolExecutor:
+    global _executor
+    if _executor is None:
+        with _pools_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(max_workers=POOL_SIZE + READ_POOL_SIZE, thread_name_prefix="chatfood-db")
+    return _executor
+
+def _reset_after_fork():
+    # اتصال‌های SQLite و threadهای executor به پروسه‌ی فرزند منتقل نمی‌شوند؛ هر worker (serve.py) Poolهای خودش را می‌سازد.
+    global _write_pool, _read_pool, _executor
+    _write_pool, _read_pool, _executor = None, None, None
+
+os.register_at_fork(after_in_child=_reset_after_fork)
+
+async def run_async(func, *args, **kwargs):
+    """یک تابع همگام پایگاه داده را روی executor اختصاصی اجرا می‌کند تا event loop مسدود نشود."""
+    loop = asyncio.get_running_loop()
+    # زمان span شامل انتظار در صف executor هم هست؛ همان تاخیری که نوبت گفتگو می‌بیند.
+    with telemetry.span("db", func.__name__):
+        return await loop.run_in_executor(get_executor(), functools.partial(func, *args, **kwargs))
+
+def configure_database(db_path: str):
+    """مسیر پایگاه داده را تغییر می‌دهد و Poolهای فعلی را می‌بندد (برای اسکریپت‌ها و بنچمارک‌ها)."""
+    global DB_PATH
+    close_pools()
+    DB_PATH = db_path
+
+def close_pools():
+    global _write_pool, _read_pool
+    with _pools_lock:
+        for pool in (_read_pool, _write_pool):
+            if pool is not None:
+                pool.close()
+        _write_pool, _read_pool = None, None
+
+@contextmanager
+def connection(read_only: bool = False):
+    pool = get_read_pool() if read_only else get_pool()
+    with pool.connection() as conn:
+        yield conn
+
+# ==================== اجرای کوئری با تلاش مجدد ====================
+def _is_busy(error: sqlite3.OperationalError) -> bool:
+    message = str(error).lower()
+    return "locked" in message or "busy" in message
+
+def _run(pool: ConnectionPool, work):
+    for attempt in range(BUSY_RETRIES + 1):
+        try:
+            with pool.connection() as conn:
+                return work(conn)
+        except sqlite3.OperationalError as e:
+            if isinstance(e, PoolTimeout) or not _is_busy(e) or attempt == BUSY_RETRIES:
+                raise
+            pool.record_busy_retry()
+            time.sleep(0.01 * (2 ** attempt))
+
+def fetchone(sql: str, params=(), read_only: bool = False):
+    pool = get_read_pool() if read_only else get_pool()
+    return _run(pool, lambda conn: conn.execute(sql, params).fetchone())
+
+def fetchall(sql: str, params=(), read_only: bool = False) -> list:
+    pool = get_read_pool() if read_only else get_pool()
+    return _run(pool, lambda conn: conn.execute(sql, params).fetchall())
+
+def execute(sql: str, params=()) -> int:
+    """یک دستور نوشتن را در یک تراکنش اجرا و commit می‌کند و تعداد ردیف‌های تغییر یافته را برمی‌گرداند."""
+    def work(conn):
+        with conn:
+            return conn.execute(sql, params).rowcount
+    return _run(get_pool(), work)
+
+def get_pool_stats() -> dict:
+    """آمار checkout، زمان انتظار و تلاش‌های مجدد ناشی از قفل برای هر دو Pool."""
+    return {
+        "write": _write_pool.stats() if _write_pool is not None else None,
+        "read": _read_pool.stats() if _read_pool is not None else None,
+    }
@@ -0,0 +1,320 @@
+import asyncio
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+import telemetry
+
+# ==================== تنظیمات ====================
+MODEL_NAME = "sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2"
+# torch: مدل اصلی fp32؛ onnx: همان مدل با onnxruntime؛ onnx-int8: نسخه‌ی کوانتیزه‌ی int8 برای CPU.
+# مسیرهای onnx به پکیج‌های optimum و onnxruntime نیاز دارند (pip install "sentence-transformers[onnx]").
+EMBEDDING_BACKEND = os.getenv("CHATFOOD_EMBEDDING_BACKEND", "torch")
+ONNX_INT8_FILE = os.getenv("CHATFOOD_ONNX_INT8_FILE", "onnx/model_quint8_avx2.onnx")
+CACHE_PATH = os.getenv("CHATFOOD_EMBEDDING_CACHE_PATH", os.path.join("db", "embedding_cache.db"))
+# درخواست‌های امبدینگ سوال از جلسه‌های مختلف که در این پنجره (میلی‌ثانیه) برسند با هم در یک batch اجرا می‌شوند.
+BATCH_WINDOW_MS = float(os.getenv("CHATFOOD_EMBEDDING_BATCH_WINDOW_MS", "5"))
+MAX_BATCH_SIZE = 64
+MEMORY_CACHE_SIZE = 2048
+# سقف ردیف‌های cache دیسک (هر بردار حدود ۱.۵ کیلوبایت)؛ کم‌استفاده‌ترین ردیف‌ها (LRU) حذف می‌شوند. باید از تعداد
+# قطعه‌های پایگاه دانش بزرگ‌تر باشد تا setup_rag.py آن‌ها را دوباره امبد نکند.
+DISK_CACHE_MAX_ENTRIES = int(os.getenv("CHATFOOD_EMBEDDING_CACHE_MAX_ENTRIES", "100000"))
+# زمان آخرین استفاده حداکثر با این دقت (ثانیه) به‌روز می‌شود تا هر خواندن یک نوشتن نباشد.
+DISK_CACHE_TOUCH_SECONDS = 600
+# حذف LRU بعد از این تعداد نوشتن اجرا می‌شود، نه بعد از هر نوشتن.
+DISK_CACHE_TRIM_EVERY = 100
+BUSY_TIMEOUT_MS = 5000
+
+
+def content_hash(text: str) -> bytes:
+    return hashlib.sha256(text.encode("utf-8")).digest()[:16]
+
+
+def load_encoder(backend: str = None, model_name: str = MODEL_NAME):
+    """تابع texts -> ndarray را برای backend انتخاب شده می‌سازد (مدل فقط یک بار بارگذاری می‌شود)."""
+    from sentence_transformers import SentenceTransformer
+
+    backend = backend or EMBEDDING_BACKEND
+    if backend == "torch":
+        model = SentenceTransformer(model_name, device="cpu")
+    elif backend == "onnx":
+        model = SentenceTransformer(model_name, device="cpu", backend="onnx")
+    elif backend == "onnx-int8":
+        model = SentenceTransformer(model_name, device="cpu", backend="onnx", model_kwargs={"file_name": ONNX_INT8_FILE})
+    else:
+        raise ValueError(f"CHATFOOD_EMBEDDING_BACKEND نامعتبر است: {backend} (گزینه‌ها: torch، onnx، onnx-int8)")
+    return lambda texts: model.encode(texts, batch_size=MAX_BATCH_SIZE, convert_to_numpy=True, show_progress_bar=False)
+
+
+# ==================== cache روی دیسک ====================
+class EmbeddingCache:
+    """
+    نگاشت hash محتوا -> بردار در یک فایل SQLite؛ متنی که یک بار امبد شده (قطعه‌های پایگاه دانش، سوال‌های
+    تکراری) دیگر هرگز از مدل عبور نمی‌کند، حتی بعد از راه‌اندازی دوباره یا در worker دیگر.
+    """
+
+    def __init__(self, path: str = None, namespace: str = "", max_entries: int = DISK_CACHE_MAX_ENTRIES):
+        self.path = path or CACHE_PATH
+        self.namespace = namespace
+        self.max_entries = max_entries
+        self._local = threading.local()
+        self._pid = os.getpid()
+        self._writes = 0
+
+    def _conn(self) -> sqlite3.Connection:
+        if self._pid != os.getpid():
+            self._local, self._pid = threading.local(), os.getpid()
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=BUSY_TIMEOUT_MS / 1000, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("""CREATE TABLE IF NOT EXISTS embeddings (
+                namespace TEXT NOT NULL, hash BLOB NOT NULL, vector BLOB NOT NULL, accessed REAL NOT NULL DEFAULT 0,
+                PRIMARY KEY (namespace, hash)) WITHOUT ROWID""")
+            # فایل‌های cache ساخته شده قبل از حذف LRU ستون accessed ندارند.
+            if "accessed" not in {row[1] for row in conn.execute("PRAGMA table_info(embeddings)")}:
+                conn.execute("ALTER TABLE embeddings ADD COLUMN accessed REAL NOT NULL DEFAULT 0")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_embeddings_accessed ON embeddings(accessed)")
+            self._local.conn = conn
+        return conn
+
+    def get_many(self, hashes: list) -> dict:
+        found, stale = {}, []
+        now = time.time()
+        conn = self._conn()
+        for i in range(0, len(hashes), 500):
+            chunk = hashes[i:i + 500]
+            rows = conn.execute(
+                f"SELECT hash, vector, accessed FROM embeddings WHERE namespace = ? AND hash IN ({', '.join('?' * len(chunk))})",
+                (self.namespace, *chunk),
+            ).fetchall()
+            for h, v, accessed in rows:
+                found[bytes(h)] = np.frombuffer(v, dtype=np.float32)
+                if now - accessed > DISK_CACHE_TOUCH_SECONDS:
+                    stale.append((now, self.namespace, h))
+        if stale:
+            self._write(conn, "UPDATE embeddings SET accessed = ? WHERE namespace = ? AND hash = ?", stale)
+        return found
+
+    @staticmethod
+    def _write(conn: sqlite3.Connection, sql: str, rows: list):
+        # اتصال در حالت autocommit است؛ بدون تراکنش صریح هر ردیف executemany جدا commit می‌شد.
+        conn.execute("BEGIN")
+        try:
+            conn.executemany(sql, rows)
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+    def put_many(self, items: list):
+        now = time.time()
+        self._write(self._conn(), "INSERT OR IGNORE INTO embeddings (namespace, hash, vector, accessed) VALUES (?, ?, ?, ?)",
+                    [(self.namespace, h, np.asarray(v, dtype=np.float32).tobytes(), now) for h, v in items])
+        self._writes += 1
+        if self._writes % DISK_CACHE_TRIM_EVERY == 0 or len(items) >= DISK_CACHE_TRIM_EVERY:
+            self.trim()
+
+    def trim(self) -> int:
+        """ردیف‌های بیش از max_entries را به ترتیب کم‌استفاده‌ترین حذف می‌کند (مثل SearchCache در web_search)."""
+        return self._conn().execute("""DELETE FROM embeddings WHERE (namespace, hash) IN (
+            SELECT namespace, hash FROM embeddings ORDER BY accessed DESC LIMIT -1 OFFSET ?)""", (self.max_entries,)).rowcount
+
+
+# ==================== سرویس امبدینگ ====================
+class EmbeddingService(Embeddings):
+    """
+    پیاده‌سازی Embeddings لنگ‌چین با سه لایه: cache حافظه (LRU)، cache دیسک بر اساس hash محتوا،
+    و micro-batching: درخواست‌های همزمان امبدینگ سوال از جلسه‌های مختلف در یک فراخوانی مدل اجرا می‌شوند.
+    """
+
+    def __init__(self, backend: str = None, encoder=None, cache: EmbeddingCache = None,
+                 batch_window_ms: float = BATCH_WINDOW_MS, max_batch_size: int = MAX_BATCH_SIZE):
+        self.backend = backend or EMBEDDING_BACKEND
+        self.batch_window = batch_window_ms / 1000
+        self.max_batch_size = max_batch_size
+        self._encoder = encoder
+        self.cache = cache if cache is not None else EmbeddingCache(namespace=f"{MODEL_NAME}:{self.backend}")
+        self._memory = OrderedDict()  # hash -> vector
+        self._queue = []  # [(text, hash, Future)]
+        self._queue_ready = threading.Condition()
+        self._thread = None
+        self._pid = None
+        self._load_lock = threading.Lock()
+        self._thread_lock = threading.Lock()
+        self._lock = threading.Lock()
+        self._stats = {"texts": 0, "memory_hits": 0, "disk_hits": 0, "encoded": 0, "batches": 0,
+                       "max_batch": 0, "encode_time": 0.0}
+
+    # --- مدل ---
+    def load(self):
+        """مدل را بارگذاری می‌کند (برای preload قبل از fork در serve.py و گرم کردن)."""
+        if self._encoder is None:
+            with self._load_lock:
+                if self._encoder is None:
+                    self._encoder = load_encoder(self.backend)
+        return self
+
+    def warm(self):
+        """بارگذاری و یک اجرای واقعی مدل (بدون cache) تا اولین درخواست کاربر هزینه‌ی آن را نپردازد."""
+        self.load()._encode(["گرم کردن"])
+
+    def _encode(self, texts: list) -> np.ndarray:
+        started = time.perf_counter()
+        vectors = np.asarray(self.load()._encoder(texts), dtype=np.float32)
+        with self._lock:
+            self._stats["encoded"] += len(texts)
+            self._stats["batches"] += 1
+            self._stats["max_batch"] = max(self._stats["max_batch"], len(texts))
+            self._stats["encode_time"] += time.perf_counter() - started
+        return vectors
+
+    # --- cache ---
+    def _remember(self, key: bytes, vector: np.ndarray):
+        self._memory[key] = vector
+        self._memory.move_to_end(key)
+        while len(self._memory) > MEMORY_CACHE_SIZE:
+            self._memory.popitem(last=False)
+
+    def _lookup(self, hashes: list) -> dict:
+        found = {}
+        with self._lock:
+            for key in hashes:
+                vector = self._memory.get(key)
+                if vector is not None:
+                    self._memory.move_to_end(key)
+                    found[key] = vector
+            self._stats["texts"] += len(hashes)
+            self._stats["memory_hits"] += len(found)
+        missing = [key for key in dict.fromkeys(hashes) if key not in found]
+        if missing:
+            try:
+                from_disk = self.cache.get_many(missing)
+            except sqlite3.Error as e:
+                print(f"!!! خطا در خواندن cache امبدینگ: {e}")
+                from_disk = {}
+            with self._lock:
+                self._stats["disk_hits"] += len(from_disk)
+                for key, vector in from_disk.items():
+                    self._remember(key, vector)
+            found.update(from_disk)
+        telemetry.inc("chatfood_cache_requests_total", len(found), cache="embedding", result="hit")
+        telemetry.inc("chatfood_cache_requests_total", len(set(hashes)) - len(found), cache="embedding", result="miss")
+        return found
+
+    def _store(self, items: list):
+        with self._lock:
+            for key, vector in items:
+                self._remember(key, vector)
+        try:
+            self.cache.put_many(items)
+        except sqlite3.Error as e:
+            print(f"!!! خطا در نوشتن cache امبدینگ: {e}")
+
+    # --- micro-batching ---
+    def _ensure_thread(self):
+        if self._thread is None or self._pid != os.getpid():
+            # thread پس‌زمینه بعد از fork در پروسه‌ی فرزند وجود ندارد.
+            self._pid = os.getpid()
+            self._queue, self._queue_ready = [], threading.Condition()
+            self._thread = threading.Thread(target=self._run, name="chatfood-embedding-batcher", daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            with self._queue_ready:
+                while not self._queue:
+                    self._queue_ready.wait()
+                # اولین درخواست رسیده؛ کمی صبر برای درخواست‌های همزمان دیگر، مگر اینکه batch پر شده باشد.
+                deadline = time.perf_counter() + self.batch_window
+                while len(self._queue) < self.max_batch_size:
+                    remaining = deadline - time.perf_counter()
+                    if remaining <= 0:
+                        break
+                    self._queue_ready.wait(remaining)
+                batch, self._queue = self._queue[:self.max_batch_size], self._queue[self.max_batch_size:]
+            # درخواست‌هایی که در این فاصله لغو شده‌اند (مثلا قطع شدن جلسه) کنار گذاشته می‌شوند.
+            batch = [item for item in batch if item[2].set_running_or_notify_cancel()]
+            if not batch:
+                continue
+            unique = list(dict.fromkeys((text, key) for text, key, _ in batch))
+            try:
+                vectors = dict(zip((key for _, key in unique), self._encode([text for text, _ in unique])))
+            except Exception as e:
+                for _, _, future in batch:
+                    future.set_exception(e)
+                continue
+            self._store(list(vectors.items()))
+            for _, key, future in batch:
+                future.set_result(vectors[key])
+
+    def _submit(self, text: str, key: bytes) -> Future:
+        future = Future()
+        with self._thread_lock:
+            self._ensure_thread()
+        with self._queue_ready:
+            self._queue.append((text, key, future))
+            self._queue_ready.notify()
+        return future
+
+    # --- رابط Embeddings ---
+    def embed_documents(self, texts: list) -> list:
+        """امبدینگ دسته‌ای (مثلا قطعه‌های پایگاه دانش)؛ فقط متن‌هایی که در cache نیستند امبد می‌شوند."""
+        hashes = [content_hash(text) for text in texts]
+        found = self._lookup(hashes)
+        missing = list(dict.fromkeys((text, key) for text, key in zip(texts, hashes) if key not in found))
+        for i in range(0, len(missing), self.max_batch_size):
+            chunk = missing[i:i + self.max_batch_size]
+            vectors = self._encode([text for text, _ in chunk])
+            items = [(key, vector) for (_, key), vector in zip(chunk, vectors)]
+            self._store(items)
+            found.update(items)
+        return [found[key].tolist() for key in hashes]
+
+    def embed_query(self, text: str) -> list:
+        key = content_hash(text)
+        found = self._lookup([key])
+        if key in found:
+            return found[key].tolist()
+        return self._submit(text, key).result().tolist()
+
+    async def aembed_query(self, text: str) -> list:
+        key = content_hash(text)
+        found = await asyncio.to_thread(self._lookup, [key])
+        if key in found:
+            return found[key].tolist()
+        # منتظر ماندن روی Future بدون اشغال یک thread
+        return (await asyncio.wrap_future(self._submit(text, key))).tolist()
+
+    async def aembed_documents(self, texts: list) -> list:
+        return await asyncio.to_thread(self.embed_documents, texts)
+
+    def stats(self) -> dict:
+        with self._lock:
+            stats = dict(self._stats)
+        stats["backend"] = self.backend
+        stats["avg_batch"] = stats["encoded"] / stats["batches"] if stats["batches"] else 0.0
+        stats["cache_hit_rate"] = (stats["memory_hits"] + stats["disk_hits"]) / stats["texts"] if stats["texts"] else 0.0
+        return stats
+
+
+_service = None
+_service_lock = threading.Lock()
+
+def get_embedding_service() -> EmbeddingService:
+    """سرویس مشترک پروسه؛ بازیاب، مسیریاب، cache معنایی و setup_rag.py همگی از همین استفاده می‌کنند."""
+    global _service
+    if _service is None:
+        with _service_lock:
+            if _service is None:
+                _service = EmbeddingService()
+    return _service
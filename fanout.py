@@ -0,0 +1,160 @@
+import asyncio
+import threading
+import time
+
+import numpy as np
+from langchain_core.documents import Document
+
+import telemetry
+from search_index import normalize_text
+
+# ==================== تنظیمات ====================
+# هر منبع مهلت خودش را دارد؛ منبعی که دیر کند بقیه را معطل نمی‌کند و فقط از نتیجه کنار گذاشته می‌شود.
+# مهلت وب بیشتر از web_search.SEARCH_TIMEOUT است تا نتیجه‌ی قدیمی cache که web_search در صورت تاخیر برمی‌گرداند از دست نرود.
+SOURCE_TIMEOUTS = {"knowledge_base": 2.0, "menu": 1.0, "web": 5.0}
+DEFAULT_TIMEOUT = 2.0
+# اگر بهترین سند (بعد از رتبه‌بندی دوباره) حداقل این شباهت را داشته باشد، منابع باقی‌مانده لغو می‌شوند.
+SUFFICIENT_SCORE = 0.6
+MAX_RESULTS = 6
+# ثابت Reciprocal Rank Fusion وقتی امبدینگ برای رتبه‌بندی دوباره در دسترس نباشد
+RRF_K = 60
+# مرزهای سطل‌های هیستوگرام تاخیر (ثانیه)
+LATENCY_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+_sources = {}  # name -> async func(query) -> List[Document]
+_lock = threading.Lock()
+_histograms = {}  # source -> {"buckets": [...], "count", "sum", "outcomes": {...}}
+
+
+def register_source(name: str, func, timeout: float = None):
+    """یک منبع جستجو ثبت می‌کند (یا جایگزین می‌کند، مثلا با نسخه‌ی محلی در تست‌ها و بنچمارک‌ها)."""
+    _sources[name] = func
+    if timeout is not None:
+        SOURCE_TIMEOUTS[name] = timeout
+
+def get_sources() -> list:
+    return list(_sources)
+
+
+# ==================== رتبه‌بندی دوباره ====================
+def _dedupe(documents: list) -> list:
+    seen, unique = set(), []
+    for document in documents:
+        key = normalize_text(document.page_content)[:200]
+        if key not in seen:
+            seen.add(key)
+            unique.append(document)
+    return unique
+
+def _rrf(results: dict) -> list:
+    scores, documents = {}, {}
+    for ranked in results.values():
+        for rank, document in enumerate(ranked):
+            key = normalize_text(document.page_content)[:200]
+            scores[key] = scores.get(key, 0.0) + 1.0 / (RRF_K + rank + 1)
+            documents.setdefault(key, document)
+    # امتیاز RRF همیشه خیلی کمتر از SUFFICIENT_SCORE است، پس بدون امبدینگ منبعی زودتر لغو نمی‌شود.
+    return [(scores[key], documents[key]) for key in sorted(scores, key=scores.get, reverse=True)]
+
+async def rerank(query: str, results: dict, embeddings=None) -> list:
+    """
+    اسناد همه‌ی منابع را ادغام و بر اساس شباهت کسینوسی امبدینگ سوال و متن سند مرتب می‌کند
+    (امتیاز خود منابع قابل مقایسه نیستند). بدون امبدینگ از Reciprocal Rank Fusion استفاده می‌شود.
+    """
+    documents = _dedupe([document for ranked in results.values() for document in ranked])
+    if not documents:
+        return []
+    if embeddings is not None:
+        try:
+            query_vector = np.asarray(await embeddings.aembed_query(query), dtype=np.float32)
+            vectors = np.asarray(await embeddings.aembed_documents([d.page_content for d in documents]), dtype=np.float32)
+            scores = vectors @ query_vector / (np.linalg.norm(vectors, axis=1) * np.linalg.norm(query_vector) + 1e-9)
+            ranked = sorted(zip(scores.tolist(), documents), key=lambda item: item[0], reverse=True)
+        except Exception as e:
+            print(f"!!! رتبه‌بندی دوباره با امبدینگ ناموفق بود؛ استفاده از RRF: {e}")
+            ranked = _rrf(results)
+    else:
+        ranked = _rrf(results)
+    return [Document(page_content=d.page_content, metadata={**d.metadata, "rerank_score": round(score, 4)})
+            for score, d in ranked[:MAX_RESULTS]]
+
+
+# ==================== اجرای همزمان منابع ====================
+def _observe(source: str, seconds: float, outcome: str):
+    telemetry.record_span("source", source, seconds, status={"timeout": "error", "error": "error", "cancelled": "cancelled"}.get(outcome, "ok"),
+                          outcome=outcome)
+    with _lock:
+        histogram = _histograms.setdefault(source, {
+            "buckets": [0] * (len(LATENCY_BUCKETS) + 1), "count": 0, "sum": 0.0,
+            "outcomes": {"ok": 0, "empty": 0, "timeout": 0, "error": 0, "cancelled": 0},
+        })
+        histogram["buckets"][next((i for i, bound in enumerate(LATENCY_BUCKETS) if seconds <= bound), len(LATENCY_BUCKETS))] += 1
+        histogram["count"] += 1
+        histogram["sum"] += seconds
+        histogram["outcomes"][outcome] += 1
+
+async def _run_source(name: str, func, query: str) -> list:
+    started = time.perf_counter()
+    try:
+        documents = await asyncio.wait_for(func(query), timeout=SOURCE_TIMEOUTS.get(name, DEFAULT_TIMEOUT))
+    except asyncio.TimeoutError:
+        _observe(name, time.perf_counter() - started, "timeout")
+        print(f"!!! منبع '{name}' در مهلت {SOURCE_TIMEOUTS.get(name, DEFAULT_TIMEOUT)}s پاسخ نداد.")
+        return []
+    except asyncio.CancelledError:
+        _observe(name, time.perf_counter() - started, "cancelled")
+        raise
+    except Exception as e:
+        _observe(name, time.perf_counter() - started, "error")
+        print(f"!!! خطا در منبع '{name}': {e}")
+        return []
+    documents = [Document(page_content=d.page_content, metadata={**d.metadata, "source_type": name}) for d in documents or []]
+    _observe(name, time.perf_counter() - started, "ok" if documents else "empty")
+    return documents
+
+async def fan_out(query: str, sources: list = None, embeddings=None) -> dict:
+    """
+    همه‌ی منابع را همزمان اجرا می‌کند. بعد از رسیدن هر نتیجه اسناد دوباره رتبه‌بندی می‌شوند و اگر بهترین سند
+    به SUFFICIENT_SCORE برسد، منابع باقی‌مانده (معمولا جستجوی وب) لغو می‌شوند.
+    خروجی: {"documents", "sources": {name: تعداد سند}, "short_circuit": نام منبعی که کافی بود یا None}
+    """
+    names = [name for name in (sources or _sources) if name in _sources]
+    tasks = {asyncio.create_task(_run_source(name, _sources[name], query)): name for name in names}
+    results, ranked, short_circuit = {}, [], None
+    try:
+        pending = set(tasks)
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                results[tasks[task]] = task.result()
+            if any(results[tasks[task]] for task in done):
+                ranked = await rerank(query, results, embeddings)
+                if pending and ranked and ranked[0].metadata["rerank_score"] >= SUFFICIENT_SCORE:
+                    short_circuit = ranked[0].metadata["source_type"]
+                    break
+    finally:
+        for task in tasks:
+            if not task.done():
+                task.cancel()
+    return {"documents": ranked, "sources": {name: len(results.get(name, [])) for name in names}, "short_circuit": short_circuit}
+
+
+def format_documents(documents: list) -> str:
+    if not documents:
+        return "هیچ اطلاعاتی در منابع پیدا نشد."
+    return "\n\n".join(f"[{d.metadata.get('source_type', '')}] {d.page_content}" for d in documents)
+
+
+def get_fanout_stats() -> dict:
+    """هیستوگرام تاخیر هر منبع (سطل‌های تجمعی، مثل Prometheus) و تعداد نتیجه‌ها به تفکیک وضعیت."""
+    with _lock:
+        report = {}
+        for source, histogram in _histograms.items():
+            cumulative, buckets = 0, {}
+            for bound, count in zip(LATENCY_BUCKETS + (float("inf"),), histogram["buckets"]):
+                cumulative += count
+                buckets["+Inf" if bound == float("inf") else str(bound)] = cumulative
+            report[source] = {"buckets": buckets, "count": histogram["count"], "sum": histogram["sum"],
+                              "avg": histogram["sum"] / histogram["count"] if histogram["count"] else 0.0,
+                              "outcomes": dict(histogram["outcomes"])}
+    return report
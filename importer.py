@@ -0,0 +1,287 @@
+import argparse
+import csv
+import gzip
+import io
+import json
+import os
+import random
+import sqlite3
+import time
+from contextlib import contextmanager
+from datetime import datetime
+
+import database
+import migrations
+import search_index
+
+# ==================== ورود انبوه منو و سفارش‌ها ====================
+# فایل‌های CSV یا JSONL (اختیاری gzip شده) به صورت جریانی خوانده می‌شوند و در دسته‌های بزرگ، هر دسته در یک تراکنش،
+# درج می‌شوند؛ حافظه‌ی مصرفی به اندازه‌ی فایل بستگی ندارد. در طول بارگذاری:
+#   - PRAGMAهای اتصال ورود برای نوشتن انبوه تنظیم می‌شوند (synchronous=OFF، cache بزرگ، temp_store در حافظه)،
+#   - تریگرها و ایندکس‌های ثانویه‌ی جدول مقصد برداشته می‌شوند و بعد از بارگذاری دوباره ساخته می‌شوند،
+#   - جداول مشتق شده (ایندکس جستجوی منو، user_order_history) در انتها یک بار کامل بازسازی می‌شوند.
+# غذاها و رستوران‌ها روی کلید یکتای name و سفارش‌های دارای id روی id upsert می‌شوند، پس اجرای دوباره‌ی
+# همان فایل ردیف تکراری نمی‌سازد و چیزی را هم پاک نمی‌کند.
+BATCH_SIZE = int(os.getenv("CHATFOOD_IMPORT_BATCH_SIZE", "50000"))
+LOAD_PRAGMAS = {"synchronous": "OFF", "cache_size": "-262144", "temp_store": "MEMORY", "wal_autocheckpoint": "10000"}
+MAX_REPORTED_ERRORS = 10
+
+
+def _text(row: dict, *keys, required: bool = True):
+    for key in keys:
+        value = row.get(key)
+        if value is not None and str(value).strip() != "":
+            return str(value).strip()
+    if required:
+        raise ValueError(f"ستون '{keys[0]}' خالی است")
+    return None
+
+def _number(value, cast=float):
+    if value is None or str(value).strip() == "":
+        return None
+    return cast(str(value).strip().translate(search_index._TRANSLATION).replace(",", ""))
+
+def _timestamp(value):
+    """زمان به صورت ثانیه‌ی یونیکس یا رشته‌ی ISO."""
+    if value is None or str(value).strip() == "":
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        return datetime.fromisoformat(str(value).strip()).timestamp()
+
+def _food(row: dict) -> tuple:
+    price = _number(row.get("price"))
+    if price is None or price < 0:
+        raise ValueError("قیمت نامعتبر است")
+    return (_text(row, "name"), _text(row, "category"), _text(row, "restaurant_name", "restaurant"), price)
+
+def _restaurant(row: dict) -> tuple:
+    return (_text(row, "name"), _text(row, "city", required=False), _text(row, "address", required=False),
+            _text(row, "phone", required=False), _number(row.get("rating")))
+
+def _order(row: dict) -> tuple:
+    return (_number(row.get("id"), int), _text(row, "user_id"), _text(row, "food_name", "food"), _text(row, "status"),
+            _text(row, "review", required=False), _timestamp(row.get("created")), _timestamp(row.get("updated")))
+
+# هر نوع داده: جدول مقصد، تبدیل ردیف ورودی به پارامترها و دستور upsert
+ENTITIES = {
+    "foods": ("foods", _food, """INSERT INTO foods (name, category, restaurant_name, price) VALUES (?, ?, ?, ?)
+        ON CONFLICT (name) DO UPDATE SET category = excluded.category, restaurant_name = excluded.restaurant_name,
+            price = excluded.price"""),
+    "restaurants": ("restaurants", _restaurant, """INSERT INTO restaurants (name, city, address, phone, rating) VALUES (?, ?, ?, ?, ?)
+        ON CONFLICT (name) DO UPDATE SET city = COALESCE(excluded.city, city), address = COALESCE(excluded.address, address),
+            phone = COALESCE(excluded.phone, phone), rating = COALESCE(excluded.rating, rating)"""),
+    # id خالی یعنی سفارش جدید (شناسه‌ی خودکار)؛ برای id موجود سفارش به‌روز می‌شود. created/updated خالی همین حالا است
+    # (همان کار تریگرهای زمان که در طول بارگذاری برداشته شده‌اند) و created سفارش موجود را عوض نمی‌کند.
+    "orders": ("orders", _order, f"""INSERT INTO orders (id, user_id, food_name, status, review, created, updated)
+        VALUES (?1, ?2, ?3, ?4, ?5, COALESCE(?6, {migrations._NOW}), COALESCE(?7, ?6, {migrations._NOW}))
+        ON CONFLICT (id) DO UPDATE SET user_id = excluded.user_id, food_name = excluded.food_name, status = excluded.status,
+            review = excluded.review, created = COALESCE(?6, created), updated = excluded.updated"""),
+}
+
+
+# ==================== خواندن جریانی ====================
+def _open(path: str, mode: str = "rt"):
+    if path.endswith(".gz"):
+        return gzip.open(path, mode, encoding="utf-8-sig" if "r" in mode else "utf-8", newline="")
+    return open(path, mode, encoding="utf-8-sig" if "r" in mode else "utf-8", newline="")
+
+def _format(path: str) -> str:
+    name = path[:-3] if path.endswith(".gz") else path
+    if name.endswith((".jsonl", ".ndjson")):
+        return "jsonl"
+    if name.endswith(".csv"):
+        return "csv"
+    raise ValueError(f"قالب فایل '{path}' پشتیبانی نمی‌شود (csv یا jsonl، با gzip اختیاری)")
+
+def read_rows(path: str):
+    """ردیف‌های فایل را یکی یکی به صورت dict برمی‌گرداند (سطر خالی JSONL نادیده گرفته می‌شود)."""
+    file_format = _format(path)
+    with _open(path) as f:
+        if file_format == "csv":
+            yield from csv.DictReader(f)
+        else:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+
+
+# ==================== بارگذاری ====================
+@contextmanager
+def _suspended(conn: sqlite3.Connection, table: str, keep_indexes: bool):
+    """تریگرها (و در صورت نیاز ایندکس‌های ثانویه) را برمی‌دارد و در انتها با همان SQL ذخیره شده دوباره می‌سازد."""
+    kinds = ("trigger",) if keep_indexes else ("trigger", "index")
+    objects = conn.execute(
+        f"SELECT type, name, sql FROM sqlite_master WHERE tbl_name = ? AND sql IS NOT NULL AND type IN ({', '.join('?' * len(kinds))})",
+        (table, *kinds)).fetchall()
+    with conn:
+        for kind, name, _ in objects:
+            conn.execute(f'DROP {kind.upper()} "{name}"')
+    try:
+        yield [name for _, name, _ in objects]
+    finally:
+        started = time.perf_counter()
+        with conn:
+            for _, _, sql in objects:
+                conn.execute(sql)
+        if objects:
+            print(f"✅ {len(objects)} تریگر/ایندکس '{table}' در {time.perf_counter() - started:.1f}s دوباره ساخته شد.")
+
+def _rebuild_derived(conn: sqlite3.Connection, entity: str):
+    started = time.perf_counter()
+    try:
+        if entity == "foods":
+            search_index.ensure_search_index(conn)
+            search_index.rebuild_search_index(conn)
+            print(f"✅ ایندکس جستجوی منو در {time.perf_counter() - started:.1f}s بازسازی شد.")
+        elif entity == "orders":
+            migrations.rebuild_user_history(conn)
+            print(f"✅ تاریخچه‌ی تجمیع شده‌ی کاربران در {time.perf_counter() - started:.1f}s بازسازی شد.")
+    except BaseException:
+        print(f"!!! بازسازی داده‌های وابسته به '{entity}' کامل نشد؛ ایندکس جستجو یا تاریخچه‌ی کاربران با جدول هماهنگ نیست. "
+              "import را دوباره اجرا کنید.")
+        raise
+
+def import_files(entity: str, paths: list, db_path: str = None, batch_size: int = BATCH_SIZE, keep_indexes: bool = False) -> dict:
+    """
+    فایل‌ها را در جدول entity بارگذاری می‌کند و آمار {rows, skipped, seconds, rows_per_s} را برمی‌گرداند.
+    ردیف‌های نامعتبر کنار گذاشته و شمرده می‌شوند؛ خطای پایگاه داده کل دسته‌ی جاری را برمی‌گرداند و متوقف می‌کند.
+    بعد از خطا هم داده‌های وابسته (ایندکس جستجو، تاریخچه‌ی کاربران) برای دسته‌های commit شده بازسازی می‌شوند.
+    """
+    table, convert, sql = ENTITIES[entity]
+    conn = sqlite3.connect(db_path or database.DB_PATH)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute(f"PRAGMA busy_timeout={int(migrations.LOCK_TIMEOUT * 1000)}")
+    migrations.migrate(conn)
+    # PRAGMAها فقط روی همین اتصال اثر دارند؛ اتصال‌های برنامه همچنان synchronous=NORMAL هستند.
+    for name, value in LOAD_PRAGMAS.items():
+        conn.execute(f"PRAGMA {name} = {value}")
+    rows, skipped = 0, 0
+    started = time.perf_counter()
+    loaded = False
+    try:
+        with _suspended(conn, table, keep_indexes):
+            for path in paths:
+                batch = []
+                for line, row in enumerate(read_rows(path), start=2 if _format(path) == "csv" else 1):
+                    try:
+                        batch.append(convert(row))
+                    except (ValueError, TypeError, AttributeError) as e:
+                        skipped += 1
+                        if skipped <= MAX_REPORTED_ERRORS:
+                            print(f"!!! ردیف {line} از '{path}' نادیده گرفته شد: {e}")
+                        continue
+                    if len(batch) >= batch_size:
+                        rows += _write(conn, sql, batch)
+                        batch = []
+                        elapsed = time.perf_counter() - started
+                        print(f"   {rows:,} ردیف ({rows / elapsed:,.0f} ردیف/ثانیه)")
+                rows += _write(conn, sql, batch)
+        load_seconds = time.perf_counter() - started
+        loaded = True
+    finally:
+        try:
+            # تریگرها هنگام بارگذاری برداشته شده بودند، پس دسته‌های commit شده حتی بعد از خطا یا Ctrl-C
+            # بدون بازسازی ایندکس جستجو و تاریخچه‌ی کاربران جا می‌مانند.
+            if rows:
+                if not loaded:
+                    print(f"!!! بارگذاری '{entity}' بعد از {rows:,} ردیف متوقف شد؛ داده‌های وابسته برای همین ردیف‌ها بازسازی می‌شوند.")
+                _rebuild_derived(conn, entity)
+            if loaded:
+                conn.execute("PRAGMA synchronous = NORMAL")
+                conn.execute("PRAGMA optimize")
+                conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        finally:
+            conn.close()
+    seconds = time.perf_counter() - started
+    stats = {"entity": entity, "rows": rows, "skipped": skipped, "load_seconds": round(load_seconds, 2),
+             "seconds": round(seconds, 2), "rows_per_s": round(rows / load_seconds) if load_seconds else rows}
+    print(f"✅ {rows:,} ردیف '{entity}' در {seconds:.1f}s وارد شد ({stats['rows_per_s']:,} ردیف/ثانیه در بارگذاری، "
+          f"{skipped:,} ردیف نامعتبر).")
+    return stats
+
+def _write(conn: sqlite3.Connection, sql: str, batch: list) -> int:
+    if not batch:
+        return 0
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        conn.executemany(sql, batch)
+        conn.execute("COMMIT")
+    except BaseException:
+        conn.execute("ROLLBACK")
+        raise
+    return len(batch)
+
+
+# ==================== داده‌ی مصنوعی ====================
+CATEGORIES = ['فست فود', 'ایرانی', 'ایتالیایی', 'پیش غذا', 'دریایی', 'گیاهی', 'صبحانه', 'دسر']
+DISHES = ['پیتزا', 'برگر', 'کباب', 'پاستا', 'سالاد', 'خورش', 'ساندویچ', 'استیک', 'سوپ', 'چلو', 'میگو', 'کیک']
+ADJECTIVES = ['ویژه', 'ذغالی', 'مخصوص', 'خانگی', 'تند', 'سنتی', 'دودی', 'کلاسیک', 'پنیری', 'سبزیجات']
+CITIES = ['تهران', 'اصفهان', 'شیراز', 'مشهد', 'تبریز']
+STATUSES = ['تحویل داده شده', 'تحویل داده شده', 'تحویل داده شده', 'لغو شده', 'در حال آماده‌سازی']
+
+def _food_name(index: int) -> str:
+    # نام از روی شماره ساخته می‌شود تا سفارش‌ها بدون نگه داشتن کل منو در حافظه به غذای موجود اشاره کنند.
+    return f"{DISHES[index % len(DISHES)]} {ADJECTIVES[index // len(DISHES) % len(ADJECTIVES)]} {index}"
+
+def generate(out_dir: str, foods: int, orders: int, restaurants: int = 500, users: int = 10000, seed: int = 42) -> dict:
+    """فایل‌های restaurants.csv، foods.csv و orders.jsonl.gz با اندازه‌ی دلخواه را به صورت جریانی می‌نویسد."""
+    os.makedirs(out_dir, exist_ok=True)
+    rng = random.Random(seed)
+    paths = {name: os.path.join(out_dir, file) for name, file in
+             (("restaurants", "restaurants.csv"), ("foods", "foods.csv"), ("orders", "orders.jsonl.gz"))}
+    with _open(paths["restaurants"], "wt") as f:
+        writer = csv.writer(f)
+        writer.writerow(["name", "city", "address", "phone", "rating"])
+        for i in range(1, restaurants + 1):
+            writer.writerow([f"رستوران {i}", rng.choice(CITIES), f"خیابان {rng.randint(1, 200)}، پلاک {i}",
+                             f"021{rng.randint(10000000, 99999999)}", round(rng.uniform(2.5, 5.0), 1)])
+    with _open(paths["foods"], "wt") as f:
+        writer = csv.writer(f)
+        writer.writerow(["name", "category", "restaurant_name", "price"])
+        for i in range(foods):
+            writer.writerow([_food_name(i), rng.choice(CATEGORIES), f"رستوران {rng.randint(1, restaurants)}", rng.randint(50, 900) * 1000])
+    now = time.time()
+    with _open(paths["orders"], "wt") as f:
+        buffer = io.StringIO()
+        for i in range(orders):
+            created = now - rng.uniform(0, 365 * 86400)
+            buffer.write(json.dumps({"user_id": f"user{rng.randint(1, users)}", "food_name": _food_name(rng.randrange(foods)),
+                                     "status": rng.choice(STATUSES), "created": round(created, 3)}, ensure_ascii=False) + "\n")
+            if i % 10000 == 9999:
+                f.write(buffer.getvalue())
+                buffer = io.StringIO()
+        f.write(buffer.getvalue())
+    print(f"✅ {restaurants:,} رستوران، {foods:,} غذا و {orders:,} سفارش در '{out_dir}' نوشته شد.")
+    return paths
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="ورود انبوه منو، رستوران‌ها و سفارش‌ها از فایل‌های CSV/JSONL و ساخت داده‌ی مصنوعی")
+    commands = parser.add_subparsers(dest="command", required=True)
+    for entity in ENTITIES:
+        command = commands.add_parser(entity, help=f"ورود {entity} از فایل‌های csv/jsonl (با gzip اختیاری)")
+        command.add_argument("files", nargs="+")
+        command.add_argument("--db", default=database.DB_PATH)
+        command.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+        command.add_argument("--keep-indexes", action="store_true",
+                             help="ایندکس‌های ثانویه در طول بارگذاری حفظ شوند (برای فایل‌های کوچک روی جدول بزرگ)")
+    command = commands.add_parser("generate", help="نوشتن فایل‌های داده‌ی مصنوعی")
+    command.add_argument("--out", default=os.path.join("db", "import"))
+    command.add_argument("--foods", type=int, default=100000)
+    command.add_argument("--orders", type=int, default=1000000)
+    command.add_argument("--restaurants", type=int, default=500)
+    command.add_argument("--users", type=int, default=10000)
+    command.add_argument("--seed", type=int, default=42)
+    command.add_argument("--load", action="store_true", help="فایل‌های ساخته شده بلافاصله وارد پایگاه داده شوند")
+    command.add_argument("--db", default=database.DB_PATH)
+    args = parser.parse_args()
+
+    if args.command == "generate":
+        files = generate(args.out, args.foods, args.orders, args.restaurants, args.users, args.seed)
+        if args.load:
+            for entity, path in files.items():
+                import_files(entity, [path], args.db)
+    else:
+        import_files(args.command, args.files, args.db, args.batch_size, args.keep_indexes)
@@ -0,0 +1,419 @@
+import asyncio
+import contextvars
+import hashlib
+import json
+import os
+import random
+import threading
+import time
+import weakref
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+
+import httpx
+
+import telemetry
+
+# ==================== تنظیمات ====================
+# همه‌ی فراخوانی‌های LLM (مسیریاب، ایجنت‌ها، خلاصه‌ساز حافظه، پیام‌های پیشنهاد) از کلاینت HTTP همین ماژول
+# می‌گذرند. زمان‌بند جلوی سرویس LLM می‌نشیند و:
+#   - حداکثر MAX_CONCURRENCY درخواست را همزمان به سرویس می‌فرستد و بقیه را در صف نگه می‌دارد،
+#   - نوبت‌های تعاملی کاربران را بر درخواست‌های پس‌زمینه (پیشنهاد فعال، پیش‌ساخت پیام‌ها) مقدم می‌کند،
+#   - بین جلسه‌ها نوبتی (round-robin) سرویس می‌دهد تا یک جلسه‌ی پرحرف بقیه را معطل نکند،
+#   - درخواست‌های کاملا یکسانی که همزمان در جریان‌اند را یکی می‌کند (پاسخ، حتی استریم، بین همه پخش می‌شود)،
+#   - پاسخ 429 و خطاهای موقت سرویس را با backoff نمایی دوباره امتحان می‌کند، در این مدت ارسال جدید را متوقف می‌کند
+#     و سقف همزمانی را موقتا پایین می‌آورد (AIMD: با هر 429 ضربی کم و با هر پاسخ موفق کم کم زیاد می‌شود)،
+#   - وقتی صف پر است یا انتظار از QUEUE_TIMEOUT بگذرد، درخواست را فورا با 429 محلی رد می‌کند (admission control).
+MAX_CONCURRENCY = int(os.getenv("CHATFOOD_LLM_CONCURRENCY", "8"))
+MAX_QUEUE = int(os.getenv("CHATFOOD_LLM_MAX_QUEUE", "256"))
+QUEUE_TIMEOUT = float(os.getenv("CHATFOOD_LLM_QUEUE_TIMEOUT", "30"))
+# سهم درخواست‌های پس‌زمینه از ظرفیت و از صف؛ بقیه همیشه برای نوبت‌های تعاملی آزاد می‌ماند.
+BACKGROUND_SHARE = float(os.getenv("CHATFOOD_LLM_BACKGROUND_SHARE", "0.5"))
+MAX_RETRIES = int(os.getenv("CHATFOOD_LLM_MAX_RETRIES", "4"))
+RETRY_BASE_DELAY = 0.5
+RETRY_MAX_DELAY = 20.0
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+COALESCE = os.getenv("CHATFOOD_LLM_COALESCE", "1") != "0"
+STATS_WINDOW = 1000
+# پاسخ‌های رد شده توسط خود زمان‌بند این هدر را دارند (در برابر 429 واقعی سرویس).
+REJECT_HEADER = "x-chatfood-scheduler"
+OVERLOADED_MESSAGE = "⏳ سرویس در حال حاضر شلوغ است؛ لطفاً چند لحظه‌ی دیگر دوباره تلاش کنید."
+
+INTERACTIVE = "interactive"
+BACKGROUND = "background"
+PRIORITIES = (INTERACTIVE, BACKGROUND)
+
+_session_id = contextvars.ContextVar("chatfood_llm_session", default=None)
+_priority = contextvars.ContextVar("chatfood_llm_priority", default=INTERACTIVE)
+
+
+@contextmanager
+def session(session_id: str, priority: str = INTERACTIVE):
+    """فراخوانی‌های LLM داخل این بلوک (و taskهایی که از آن ساخته می‌شوند) به این جلسه و اولویت نسبت داده می‌شوند."""
+    tokens = _session_id.set(session_id), _priority.set(priority)
+    try:
+        yield
+    finally:
+        _session_id.reset(tokens[0])
+        _priority.reset(tokens[1])
+
+def is_overloaded(error: BaseException) -> bool:
+    """آیا خطا (مثلا openai.RateLimitError) رد درخواست توسط زمان‌بند یا سقف نرخ سرویس است؟"""
+    response = getattr(error, "response", None)
+    return getattr(response, "status_code", None) == 429
+
+
+class Overloaded(Exception):
+    def __init__(self, reason: str):
+        super().__init__(reason)
+        self.reason = reason
+
+
+# ==================== صف اولویت‌دار ====================
+class Scheduler:
+    """سقف همزمانی و صف‌های اولویت‌دار با نوبت‌دهی بین جلسه‌ها؛ هر event loop زمان‌بند خودش را دارد."""
+
+    def __init__(self, max_concurrency: int = MAX_CONCURRENCY, max_queue: int = MAX_QUEUE, background_share: float = BACKGROUND_SHARE):
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.background_share = background_share
+        self.limit = float(max_concurrency)
+        self.background_queue = max(1, int(max_queue * background_share))
+        self.active = {priority: 0 for priority in PRIORITIES}
+        self.waiting = {priority: 0 for priority in PRIORITIES}
+        self._queues = {priority: OrderedDict() for priority in PRIORITIES}  # session -> deque[Future]
+        self.inflight = {}  # کلید درخواست -> _Shared
+        self.paused_until = 0.0
+        self._timer = None
+
+    def _can_start(self, priority: str) -> bool:
+        limit = max(1, int(self.limit))
+        if sum(self.active.values()) >= limit:
+            return False
+        return priority == INTERACTIVE or self.active[BACKGROUND] < max(1, int(limit * self.background_share))
+
+    def _dispatch(self):
+        now = time.monotonic()
+        if self.paused_until > now:
+            if self._timer is None:
+                self._timer = asyncio.get_running_loop().call_later(self.paused_until - now, self._resume)
+            return
+        for priority in PRIORITIES:
+            queues = self._queues[priority]
+            while queues and self._can_start(priority):
+                session_id, waiters = next(iter(queues.items()))
+                future = waiters.popleft()
+                # جلسه بعد از گرفتن یک نوبت به انتهای صف می‌رود.
+                if waiters:
+                    queues.move_to_end(session_id)
+                else:
+                    del queues[session_id]
+                self.waiting[priority] -= 1
+                # Task.cancel() (قطع اتصال یا مهلت صف) future را فورا لغو می‌کند ولی task منتظر بعدا اجرا می‌شود؛
+                # چنین نوبتی رد می‌شود تا جای خالی به درخواست بعدی برسد و هرگز گم نشود.
+                if future.done():
+                    continue
+                self.active[priority] += 1
+                future.set_result(None)
+        self._publish()
+
+    def _resume(self):
+        self._timer = None
+        self._dispatch()
+
+    def _discard(self, priority: str, session_id, future):
+        waiters = self._queues[priority].get(session_id)
+        if waiters and future in waiters:
+            waiters.remove(future)
+            self.waiting[priority] -= 1
+            if not waiters:
+                del self._queues[priority][session_id]
+        self._publish()
+
+    def _publish(self):
+        for priority in PRIORITIES:
+            telemetry.set_gauge("chatfood_llm_queue_depth", self.waiting[priority], priority=priority)
+            telemetry.set_gauge("chatfood_llm_inflight", self.active[priority], priority=priority)
+        telemetry.set_gauge("chatfood_llm_concurrency_limit", int(self.limit))
+        with _lock:
+            _stats["max_queue_depth"] = max(_stats["max_queue_depth"], sum(self.waiting.values()))
+
+    async def acquire(self, priority: str, session_id) -> float:
+        """یک جای خالی می‌گیرد و زمان انتظار را برمی‌گرداند؛ اگر صف پر باشد یا مهلت تمام شود Overloaded."""
+        limit = self.max_queue if priority == INTERACTIVE else self.background_queue
+        if sum(self.waiting.values()) >= limit:
+            raise Overloaded("queue_full")
+        future = asyncio.get_running_loop().create_future()
+        self._queues[priority].setdefault(session_id, deque()).append(future)
+        self.waiting[priority] += 1
+        started = time.monotonic()
+        self._dispatch()
+        try:
+            async with asyncio.timeout(QUEUE_TIMEOUT):
+                await future
+        except BaseException as e:
+            if future.done() and not future.cancelled():
+                # جای خالی درست همزمان با لغو رسیده بود.
+                self.release(priority)
+            else:
+                self._discard(priority, session_id, future)
+            if isinstance(e, TimeoutError):
+                raise Overloaded("queue_timeout") from None
+            raise
+        waited = time.monotonic() - started
+        telemetry.observe("chatfood_llm_queue_wait_seconds", waited, priority=priority)
+        with _lock:
+            _waits[priority].append(waited)
+        return waited
+
+    def release(self, priority: str):
+        self.active[priority] -= 1
+        self._dispatch()
+
+    def cooldown(self, seconds: float):
+        """سقف نرخ سرویس کل پروسه را محدود می‌کند؛ تا این مدت هیچ درخواست جدیدی شروع نمی‌شود."""
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+        self.limit = max(1.0, self.limit * 0.75)
+
+    def succeeded(self):
+        self.limit = min(float(self.max_concurrency), self.limit + 1 / self.limit)
+
+
+_schedulers = weakref.WeakKeyDictionary()  # event loop -> Scheduler
+_lock = threading.Lock()
+_stats = {"requests": 0, "coalesced": 0, "rejected": 0, "retries": 0, "rate_limited": 0, "errors": 0, "max_queue_depth": 0}
+_waits = {priority: deque(maxlen=STATS_WINDOW) for priority in PRIORITIES}
+
+def get_scheduler() -> Scheduler:
+    loop = asyncio.get_running_loop()
+    with _lock:
+        if loop not in _schedulers:
+            _schedulers[loop] = Scheduler()
+        return _schedulers[loop]
+
+def _count(name: str, value: int = 1):
+    with _lock:
+        _stats[name] += value
+
+
+# ==================== پاسخ مشترک ====================
+class _Shared:
+    """پاسخ یک درخواست به سرویس که تکه به تکه برای همه‌ی فراخوانندگان همان درخواست پخش می‌شود."""
+
+    def __init__(self):
+        self.head = asyncio.get_running_loop().create_future()  # (status, headers)
+        self.chunks = []
+        self.done = False
+        self.error = None
+        self.callers = 0
+        self.task = None
+        self._changed = asyncio.Event()
+
+    def start(self, status: int, headers):
+        if not self.head.done():
+            self.head.set_result((status, headers))
+
+    def push(self, chunk: bytes):
+        self.chunks.append(chunk)
+        self._notify()
+
+    def finish(self, error: BaseException = None):
+        self.done, self.error = True, error
+        if not self.head.done():
+            if error is None:
+                self.head.set_result((502, {}))
+            else:
+                self.head.set_exception(error)
+                # اگر هیچ فراخواننده‌ای دیگر منتظر نباشد، خطا بدون هشدار «exception never retrieved» کنار گذاشته می‌شود.
+                self.head.add_done_callback(lambda f: f.exception())
+        self._notify()
+
+    def _notify(self):
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    def leave(self):
+        self.callers -= 1
+        if self.callers <= 0 and not self.done and self.task is not None:
+            self.task.cancel()
+
+    async def replay(self):
+        index = 0
+        while True:
+            while index < len(self.chunks):
+                yield self.chunks[index]
+                index += 1
+            if self.done:
+                if self.error is not None:
+                    raise self.error
+                return
+            await self._changed.wait()
+
+
+class _ReplayStream(httpx.AsyncByteStream):
+    def __init__(self, shared: _Shared):
+        self._shared = shared
+        self._closed = False
+
+    async def __aiter__(self):
+        async for chunk in self._shared.replay():
+            yield chunk
+
+    async def aclose(self):
+        if not self._closed:
+            self._closed = True
+            self._shared.leave()
+
+
+def _retry_delay(response: httpx.Response, attempt: int) -> float:
+    # همان هدرهایی که کلاینت openai می‌خواند؛ در غیر این صورت backoff نمایی با jitter.
+    try:
+        if "retry-after-ms" in response.headers:
+            return min(RETRY_MAX_DELAY, float(response.headers["retry-after-ms"]) / 1000)
+        if "retry-after" in response.headers:
+            return min(RETRY_MAX_DELAY, float(response.headers["retry-after"]))
+    except ValueError:
+        pass
+    return min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * 2 ** attempt) * (0.5 + random.random() / 2)
+
+def _rejection(reason: str) -> tuple:
+    body = json.dumps({"error": {"message": f"LLM scheduler: {reason}", "type": "requests", "code": reason}}).encode()
+    return 429, {"content-type": "application/json", REJECT_HEADER: reason, "retry-after": "1"}, body
+
+def _coalesce_key(request: httpx.Request) -> str | None:
+    if request.method != "POST":
+        return None
+    try:
+        body = request.content
+    except httpx.RequestNotRead:
+        return None
+    digest = hashlib.sha256()
+    for part in (str(request.url).encode(), request.headers.get("authorization", "").encode(), body):
+        digest.update(part)
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+# ==================== transport ====================
+class ScheduledTransport(httpx.AsyncBaseTransport):
+    """transport کلاینت HTTP مدل: هر درخواست از صف زمان‌بند همان event loop می‌گذرد."""
+
+    def __init__(self, transport: httpx.AsyncBaseTransport = None):
+        self._transport = transport or httpx.AsyncHTTPTransport(
+            limits=httpx.Limits(max_connections=MAX_CONCURRENCY * 2, max_keepalive_connections=MAX_CONCURRENCY))
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        scheduler = get_scheduler()
+        priority, session_id = _priority.get(), _session_id.get()
+        key = _coalesce_key(request) if COALESCE else None
+        shared = scheduler.inflight.get(key) if key else None
+        if shared is not None:
+            _count("coalesced")
+            telemetry.inc("chatfood_llm_requests_total", priority=priority, outcome="coalesced")
+        else:
+            _count("requests")
+            shared = _Shared()
+            shared.task = asyncio.get_running_loop().create_task(self._fetch(scheduler, request, shared, priority, session_id))
+            if key:
+                scheduler.inflight[key] = shared
+                shared.task.add_done_callback(lambda _: scheduler.inflight.pop(key, None))
+        shared.callers += 1
+        try:
+            status, headers = await asyncio.shield(shared.head)
+        except BaseException:
+            shared.leave()
+            raise
+        return httpx.Response(status, headers=headers, stream=_ReplayStream(shared), request=request)
+
+    async def _fetch(self, scheduler: Scheduler, request: httpx.Request, shared: _Shared, priority: str, session_id):
+        try:
+            for attempt in range(MAX_RETRIES + 1):
+                try:
+                    await scheduler.acquire(priority, session_id)
+                except Overloaded as e:
+                    _count("rejected")
+                    telemetry.inc("chatfood_llm_requests_total", priority=priority, outcome="rejected")
+                    status, headers, body = _rejection(e.reason)
+                    shared.start(status, headers)
+                    shared.push(body)
+                    shared.finish()
+                    return
+                delay, reason = None, None
+                try:
+                    try:
+                        response = await self._transport.handle_async_request(request)
+                    except httpx.TransportError:
+                        if attempt == MAX_RETRIES:
+                            raise
+                        delay, reason = min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * 2 ** attempt), "transport"
+                    else:
+                        if response.status_code in RETRY_STATUSES and attempt < MAX_RETRIES:
+                            await response.aread()
+                            await response.aclose()
+                            delay, reason = _retry_delay(response, attempt), response.status_code
+                            if response.status_code == 429:
+                                _count("rate_limited")
+                                scheduler.cooldown(delay)
+                        else:
+                            if response.status_code < 400:
+                                scheduler.succeeded()
+                            shared.start(response.status_code, response.headers)
+                            try:
+                                async for chunk in response.aiter_raw():
+                                    shared.push(chunk)
+                            finally:
+                                await response.aclose()
+                            shared.finish()
+                            outcome = "ok" if response.status_code < 400 else "error"
+                            telemetry.inc("chatfood_llm_requests_total", priority=priority, outcome=outcome)
+                            return
+                finally:
+                    scheduler.release(priority)
+                _count("retries")
+                telemetry.inc("chatfood_llm_retries_total", status=reason)
+                await asyncio.sleep(delay)
+        except BaseException as e:
+            _count("errors")
+            telemetry.inc("chatfood_llm_requests_total", priority=priority, outcome="error")
+            shared.finish(e if isinstance(e, Exception) else httpx.ReadError("LLM request cancelled", request=request))
+            if not isinstance(e, Exception):
+                raise
+
+    async def aclose(self):
+        await self._transport.aclose()
+
+
+_client = None
+
+def get_http_client() -> httpx.AsyncClient:
+    """کلاینت مشترک async مدل (ChatOpenAI(http_async_client=...))؛ مهلت هر درخواست را خود کلاینت openai تعیین می‌کند."""
+    global _client
+    if _client is None:
+        with _lock:
+            if _client is None:
+                _client = httpx.AsyncClient(transport=ScheduledTransport(), timeout=httpx.Timeout(600.0, connect=5.0))
+    return _client
+
+def _reset_after_fork():
+    global _client
+    _client = None
+    _schedulers.clear()
+
+os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def _percentiles(values) -> dict:
+    values = sorted(values)
+    if not values:
+        return {}
+    return {"p50": round(values[len(values) // 2], 4), "p95": round(values[min(len(values) - 1, int(len(values) * 0.95))], 4)}
+
+def get_stats() -> dict:
+    with _lock:
+        stats = dict(_stats)
+        waits = {priority: _percentiles(_waits[priority]) for priority in PRIORITIES}
+        schedulers = list(_schedulers.values())
+    stats["queue_wait_s"] = waits
+    stats["queued"] = {priority: sum(s.waiting[priority] for s in schedulers) for priority in PRIORITIES}
+    stats["active"] = {priority: sum(s.active[priority] for s in schedulers) for priority in PRIORITIES}
+    return stats
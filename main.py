@@ -1,182 +1,349 @@
 import os
+import functools
+import uuid
 from dotenv import load_dotenv
-from typing import TypedDict, Annotated, List
+from typing import TypedDict, Annotated, List, Optional
 
 # LangChain & LangGraph Core
 from langgraph.graph import StateGraph, END
+from langgraph.graph.message import add_messages
 from langgraph.prebuilt import ToolNode
 from langchain_core.messages import BaseMessage, HumanMessage, AIMessage, ToolMessage
 from langchain_core.documents import Document
-from langchain_openai import ChatOpenAI
 from langchain_core.tools import tool
 from langchain_core.prompts import ChatPromptTemplate
+from langchain_core.runnables import RunnableConfig
 from pydantic.v1 import BaseModel, Field
 
 # ابزارهای ماژولار ما
-from tools import get_order_status, cancel_order, search_food, get_order_history, get_special_offers, search_and_filter_food, view_cart
+from tools import aget_order_status, acancel_order, asearch_food, asearch_food_page, aview_cart
 
-# کتابخانه‌های جانبی
-import lancedb
-from langchain_community.vectorstores import LanceDB
-from langchain_huggingface import HuggingFaceEmbeddings
-from langchain_community.tools import DuckDuckGoSearchRun
+from router import TieredRouter, extract_tool_call
+from memory import ConversationMemory, prompt_messages, router_view, messages_tokens, count_tokens, SUMMARY_MAX_TOKENS
+from semantic_cache import SemanticCache
+from embedding_service import get_embedding_service
+from retrieval import FoodRetriever, TABLE_NAME as RAG_TABLE_NAME
+import search_index
+import migrations
+import recommendations
+import cart_store
+import fanout
+import web_search
+import state_backend
+import startup
+import telemetry
+import llm_scheduler
+
+# کتابخانه‌های سنگین (langchain_openai، lancedb، langchain_huggingface، duckduckgo) فقط هنگام اولین
+# استفاده داخل توابع زیر ایمپورت می‌شوند تا ایمپورت main.py سریع بماند.
 
 load_dotenv()
 
 # ==================== Caching ====================
-_embedding_model = None
+_rag_table = None
 _retriever = None
 def get_embedding_model():
-    global _embedding_model
-    if _embedding_model is None:
-        _embedding_model = HuggingFaceEmbeddings(model_name="sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2")
-    return _embedding_model
+    # سرویس مشترک پروسه: micro-batching سوال‌های همزمان، cache دیسک و backend قابل انتخاب (torch/onnx/onnx-int8)
+    return get_embedding_service()
+def get_rag_table():
+    global _rag_table
+    if _rag_table is None:
+        import lancedb
+        db_path = os.path.join(os.getcwd(), "db")
+        _rag_table = lancedb.connect(db_path).open_table(RAG_TABLE_NAME)
+    return _rag_table
 def get_retriever():
     global _retriever
     if _retriever is None:
-        db_path = os.path.join(os.getcwd(), "db")
-        connection = lancedb.connect(db_path)
-        embeddings = get_embedding_model()
-        vectorstore = LanceDB(connection=connection, table_name="food_rag", embedding=embeddings)
-        _retriever = vectorstore.as_retriever()
+        _retriever = FoodRetriever(table=get_rag_table(), embeddings=get_embedding_model())
     return _retriever
 
 # ==================== ابزارها (Tools) با Docstring کامل ====================
+# همه ابزارها async هستند تا فراخوانی پایگاه داده، بازیابی و جستجوی وب event loop را مسدود نکند.
 @tool
-def get_order_status_tool(order_id: int) -> str:
+async def get_order_status_tool(order_id: int) -> str:
     """وضعیت یک سفارش را با استفاده از شناسه آن برمی‌گرداند."""
-    return get_order_status(order_id)
+    return await aget_order_status(order_id)
 
 @tool
-def cancel_order_tool(order_id: int) -> str:
+async def cancel_order_tool(order_id: int) -> str:
     """یک سفارش را لغو می‌کند."""
-    return cancel_order(order_id)
+    return await acancel_order(order_id)
 
+# ابزارهای جستجوی منو فقط صفحه‌ی اول نتایج (مرتبط‌ترین‌ها) و تعداد کل را برمی‌گردانند؛ صفحه‌های بعد را UI می‌خواند.
 @tool
-def simple_food_search_tool(query: str) -> list:
+async def simple_food_search_tool(query: str) -> dict:
     """برای جستجوی ساده غذاها بر اساس نام یا دسته‌بندی استفاده می‌شود."""
-    return search_food(query)
+    return {**await asearch_food_page(query), "query": query, "max_price": None}
 
 @tool
-def advanced_food_search_tool(query: str, max_price: float = None) -> list:
+async def advanced_food_search_tool(query: str, max_price: float = None) -> dict:
     """برای جستجوی غذاها با شرایط خاص مانند نام، دسته‌بندی و حداکثر قیمت استفاده می‌شود."""
-    return search_and_filter_food(query, max_price)
+    return {**await asearch_food_page(query, max_price), "query": query, "max_price": max_price}
 
 @tool
-def knowledge_base_retriever_tool(query: str) -> List[Document]:
-    """برای یافتن اطلاعات در مورد غذاها از پایگاه دانش محلی استفاده می‌کند."""
-    return get_retriever().invoke(query)
+async def knowledge_base_retriever_tool(query: str, category: Optional[str] = None, restaurant: Optional[str] = None) -> List[Document]:
+    """برای یافتن اطلاعات در مورد غذاها از پایگاه دانش محلی استفاده می‌کند. در صورت نیاز می‌توان نتایج را به یک دسته‌بندی یا رستوران محدود کرد."""
+    retriever = get_retriever()
+    filters = {"category": category, "restaurant": restaurant}
+    if any(filters.values()):
+        retriever = retriever.model_copy(update={"filters": filters})
+    return await retriever.ainvoke(query)
 
 @tool
-def web_search_tool(query: str) -> str:
+async def web_search_tool(query: str) -> str:
     """زمانی که دانش محلی کافی نیست، برای جستجوی اطلاعات در اینترنت استفاده می‌شود."""
-    return DuckDuckGoSearchRun().run(query)
+    return web_search.format_results(await web_search.search(query))
+
+# ==================== منابع جستجوی همزمان ایجنت اطلاعات ====================
+async def knowledge_base_source(query: str) -> List[Document]:
+    return await get_retriever().ainvoke(query)
+
+async def menu_source(query: str) -> List[Document]:
+    foods = await asearch_food(query)
+    return [Document(page_content=f"{food['name']} در منوی {food['restaurant']} با قیمت {float(food['price']):,.0f} تومان موجود است.",
+                     metadata={"name": food["name"], "restaurant": food["restaurant"]})
+            for food in foods if "error" not in food]
+
+async def web_source(query: str) -> List[Document]:
+    return [Document(page_content=f"{result['title']}: {result['snippet']}", metadata={"link": result["link"]})
+            for result in await web_search.search(query)]
+
+fanout.register_source("knowledge_base", knowledge_base_source)
+fanout.register_source("menu", menu_source)
+fanout.register_source("web", web_source)
+
+@tool
+async def information_search_tool(query: str) -> str:
+    """پایگاه دانش محلی، منوی رستوران‌ها و اینترنت را همزمان جستجو می‌کند و بهترین نتایج را برمی‌گرداند."""
+    result = await fanout.fan_out(query, embeddings=get_embedding_model())
+    return fanout.format_documents(result["documents"])
 
 @tool
-def view_cart_tool() -> str:
+async def view_cart_tool(config: RunnableConfig) -> str:
     """زمانی که کاربر می‌خواهد سبد خرید خود را ببیند، از این ابزار استفاده کن."""
-    return view_cart()
+    # شناسه‌ی سبد از config جلسه می‌آید، نه از LLM.
+    return await aview_cart(config.get("configurable", {}).get("cart_id", ""))
 
 # ==================== تنظیمات مشترک و State ====================
-llm = ChatOpenAI(model="gpt-4o-mini", temperature=0.2)
+_llm = None
+_bound_models = {}
+def get_llm():
+    global _llm
+    if _llm is None:
+        from langchain_openai import ChatOpenAI
+        # stream_usage: مصرف توکن در حالت استریم هم گزارش می‌شود (telemetry)
+        # همه‌ی فراخوانی‌های async از صف llm_scheduler می‌گذرند؛ تلاش دوباره روی 429 هم با همان زمان‌بند است.
+        _llm = ChatOpenAI(model="gpt-4o-mini", temperature=0.2, stream_usage=True, max_retries=0,
+                          http_async_client=llm_scheduler.get_http_client())
+    return _llm
+def get_bound_model(name: str, tools: list):
+    """مدل متصل به ابزارهای هر ایجنت فقط یک بار و در اولین استفاده ساخته می‌شود."""
+    if name not in _bound_models:
+        _bound_models[name] = get_llm().bind_tools(tools)
+    return _bound_models[name]
 class AgentState(TypedDict):
-    messages: Annotated[List[BaseMessage], lambda x, y: x + y]
+    # add_messages پیام‌ها را بر اساس id ادغام می‌کند؛ پیام‌هایی که زیرگراف‌ها همراه خروجی خود برمی‌گردانند
+    # دوباره به تاریخچه‌ی ذخیره شده در checkpointer اضافه نمی‌شوند.
+    messages: Annotated[List[BaseMessage], add_messages]
     tool_output: list | None
+    # خلاصه‌ی غلتان پیام‌هایی که از پنجره‌ی حافظه خارج شده‌اند
+    summary: Optional[str]
+    # اطلاعات صفحه‌بندی نتایج جستجوی منو همراه tool_output: {"query", "max_price", "total", "next_cursor"}
+    food_page: Optional[dict]
 def should_continue(state: AgentState):
     return "end" if not state["messages"][-1].tool_calls else "continue"
 
+# ==================== بازگشت مستقیم از ابزارها ====================
+# خروجی این ابزارها ساختاریافته (کارت‌های غذا) یا خودش پاسخ نهایی است؛ زیرگراف بعد از آن‌ها بدون
+# فراخوانی دوباره‌ی LLM تمام می‌شود. ابزارهای RAG نیاز به جمع‌بندی دارند و در این فهرست نیستند.
+DIRECT_RETURN_TOOLS = {"get_order_status_tool", "cancel_order_tool", "simple_food_search_tool", "advanced_food_search_tool", "view_cart_tool"}
+
+def after_tools(state: AgentState):
+    tool_calls = next(msg.tool_calls for msg in reversed(state["messages"]) if msg.type == "ai")
+    return "respond" if all(call["name"] in DIRECT_RETURN_TOOLS for call in tool_calls) else "agent"
+
+async def direct_response_node(state: AgentState):
+    """پاسخ نهایی را مستقیماً از خروجی ابزار می‌سازد، بدون LLM."""
+    tool_output = state.get("tool_output")
+    if isinstance(tool_output, list):
+        if tool_output:
+            total = (state.get("food_page") or {}).get("total") or len(tool_output)
+            names = "، ".join(item.get("name", "") for item in tool_output[:5])
+            content = f"{total} غذا پیدا شد: {names}" + ("، ..." if total > 5 else "")
+        else:
+            content = "متاسفانه غذایی با این مشخصات پیدا نشد."
+    else:
+        results = []
+        for msg in reversed(state["messages"]):
+            if msg.type != "tool":
+                break
+            results.append(str(msg.content))
+        content = "\n\n".join(reversed(results))
+    return {"messages": [AIMessage(content=content)]}
+
+def planned_tool_call(state: AgentState, tools: list) -> AIMessage | None:
+    """
+    اگر فراخوانی ابزار بدون LLM قابل تعیین باشد (آرگومان‌های استخراج شده توسط مسیریاب، یا ایجنتی که فقط
+    یک ابزار بدون آرگومان دارد)، پیام فراخوانی ابزار را می‌سازد.
+    """
+    last_message = state["messages"][-1]
+    if last_message.type != "human":
+        return None
+    if len(tools) == 1 and not tools[0].args:
+        call = {"name": tools[0].name, "args": {}}
+    else:
+        call = extract_tool_call(last_message.content)
+        if call is None or call["name"] not in {t.name for t in tools}:
+            return None
+    return AIMessage(content="", tool_calls=[{**call, "id": f"direct_{uuid.uuid4().hex[:12]}"}])
+
+async def agent_response(name: str, tools: list, state: AgentState):
+    return planned_tool_call(state, tools) or await get_bound_model(name, tools).ainvoke(prompt_messages(state))
+
+def build_tool_agent(agent_node, tool_node):
+    """زیرگراف استاندارد ایجنت و ابزار؛ بعد از ابزارهای بازگشت مستقیم به جای ایجنت به نود respond می‌رود."""
+    workflow = StateGraph(AgentState)
+    workflow.add_node("agent", agent_node)
+    workflow.add_node("tools", tool_node)
+    workflow.add_node("respond", direct_response_node)
+    workflow.set_entry_point("agent")
+    workflow.add_conditional_edges("agent", should_continue, {"continue": "tools", "end": END})
+    workflow.add_conditional_edges("tools", after_tools, {"respond": "respond", "agent": "agent"})
+    workflow.add_edge("respond", END)
+    return workflow.compile()
+
+async def food_search_tool_node(search_tool, state: AgentState):
+    """
+    ابزار جستجوی منو را اجرا می‌کند: صفحه‌ی اول نتایج به tool_output (کارت‌های UI) و اطلاعات صفحه‌بندی به
+    food_page می‌رود؛ LLM فقط همین صفحه و تعداد کل را می‌بیند، نه همه‌ی ردیف‌های تطبیق یافته.
+    """
+    tool_call = state["messages"][-1].tool_calls[0]
+    page = await search_tool.ainvoke(tool_call['args'])
+    if page.get("error"):
+        return {"messages": [ToolMessage(content=page["error"], tool_call_id=tool_call['id'])], "tool_output": None}
+    lines = [f"نام: {i['name']}, رستوران: {i['restaurant']}, قیمت: {i['price']}" for i in page["items"]]
+    if page["total"] > len(page["items"]):
+        lines.append(f"(نمایش {len(page['items'])} مورد مرتبط‌تر از {page['total']} نتیجه)")
+    food_page = {key: page[key] for key in ("query", "max_price", "total", "next_cursor")}
+    return {"messages": [ToolMessage(content="\n".join(lines), tool_call_id=tool_call['id'])],
+            "tool_output": page["items"], "food_page": food_page}
+
 # ==================== ایجنت‌ها ====================
 
 # --- ایجنت مدیر سفارش ---
 order_manager_tools = [get_order_status_tool, cancel_order_tool]
-order_manager_model = llm.bind_tools(order_manager_tools)
-def order_manager_node(state: AgentState):
-    response = order_manager_model.invoke(state["messages"])
+async def order_manager_node(state: AgentState):
+    response = await agent_response("order_manager", order_manager_tools, state)
     return {"messages": [response], "tool_output": None}
-order_manager_workflow = StateGraph(AgentState)
-order_manager_workflow.add_node("agent", order_manager_node)
-order_manager_workflow.add_node("tools", ToolNode(order_manager_tools))
-order_manager_workflow.set_entry_point("agent")
-order_manager_workflow.add_conditional_edges("agent", should_continue, {"continue": "tools", "end": END})
-order_manager_workflow.add_edge("tools", "agent")
-order_manager_agent = order_manager_workflow.compile()
+@functools.lru_cache(maxsize=None)
+def get_order_manager_agent():
+    return build_tool_agent(order_manager_node, ToolNode(order_manager_tools))
 
 # --- ایجنت جستجوی ساده ---
 food_search_tools = [simple_food_search_tool]
-food_search_model = llm.bind_tools(food_search_tools)
-def food_search_agent_node(state: AgentState):
-    response = food_search_model.invoke(state["messages"])
+async def food_search_agent_node(state: AgentState):
+    response = await agent_response("food_search", food_search_tools, state)
     return {"messages": [response]}
-def simple_tool_node(state: AgentState):
-    last_message = state["messages"][-1]
-    tool_call = last_message.tool_calls[0]
-    tool_output = simple_food_search_tool.invoke(tool_call['args'])
-    string_output = "\n".join([f"نام: {i.get('name', '')}, رستوران: {i.get('restaurant', '')}, قیمت: {i.get('price', '')}" for i in tool_output])
-    return {"messages": [ToolMessage(content=string_output, tool_call_id=tool_call['id'])], "tool_output": tool_output}
-food_search_workflow = StateGraph(AgentState)
-food_search_workflow.add_node("agent", food_search_agent_node)
-food_search_workflow.add_node("tools", simple_tool_node)
-food_search_workflow.set_entry_point("agent")
-food_search_workflow.add_conditional_edges("agent", should_continue, {"continue": "tools", "end": END})
-food_search_workflow.add_edge("tools", "agent")
-food_search_agent = food_search_workflow.compile()
+async def simple_tool_node(state: AgentState):
+    return await food_search_tool_node(simple_food_search_tool, state)
+@functools.lru_cache(maxsize=None)
+def get_food_search_agent():
+    return build_tool_agent(food_search_agent_node, simple_tool_node)
 
 # --- ایجنت جستجوی فیلتردار ---
 filter_agent_tools = [advanced_food_search_tool]
-filter_agent_model = llm.bind_tools(filter_agent_tools)
-def filter_agent_node(state: AgentState):
-    response = filter_agent_model.invoke(state["messages"])
+async def filter_agent_node(state: AgentState):
+    response = await agent_response("filter_agent", filter_agent_tools, state)
     return {"messages": [response]}
-def advanced_tool_node(state: AgentState):
-    last_message = state["messages"][-1]
-    tool_call = last_message.tool_calls[0]
-    tool_output = advanced_food_search_tool.invoke(tool_call['args'])
-    string_output = "\n".join([f"نام: {i.get('name', '')}, رستوران: {i.get('restaurant', '')}, قیمت: {i.get('price', '')}" for i in tool_output])
-    return {"messages": [ToolMessage(content=string_output, tool_call_id=tool_call['id'])], "tool_output": tool_output}
-filter_agent_workflow = StateGraph(AgentState)
-filter_agent_workflow.add_node("agent", filter_agent_node)
-filter_agent_workflow.add_node("tools", advanced_tool_node)
-filter_agent_workflow.set_entry_point("agent")
-filter_agent_workflow.add_conditional_edges("agent", should_continue, {"continue": "tools", "end": END})
-filter_agent_workflow.add_edge("tools", "agent")
-filter_agent = filter_agent_workflow.compile()
+async def advanced_tool_node(state: AgentState):
+    return await food_search_tool_node(advanced_food_search_tool, state)
+@functools.lru_cache(maxsize=None)
+def get_filter_agent():
+    return build_tool_agent(filter_agent_node, advanced_tool_node)
 
 # --- ایجنت سبد خرید ---
 cart_agent_tools = [view_cart_tool]
-cart_agent_model = llm.bind_tools(cart_agent_tools)
-def cart_agent_node(state: AgentState):
-    response = cart_agent_model.invoke(state["messages"])
+async def cart_agent_node(state: AgentState):
+    response = await agent_response("cart_agent", cart_agent_tools, state)
     return {"messages": [response], "tool_output": None}
-cart_agent_workflow = StateGraph(AgentState)
-cart_agent_workflow.add_node("agent", cart_agent_node)
-cart_agent_workflow.add_node("tools", ToolNode(cart_agent_tools))
-cart_agent_workflow.set_entry_point("agent")
-cart_agent_workflow.add_conditional_edges("agent", should_continue, {"continue": "tools", "end": END})
-cart_agent_workflow.add_edge("tools", "agent")
-cart_agent = cart_agent_workflow.compile()
+@functools.lru_cache(maxsize=None)
+def get_cart_agent():
+    return build_tool_agent(cart_agent_node, ToolNode(cart_agent_tools))
 
 # --- ایجنت اطلاعات (RAG) ---
-rag_tools = [knowledge_base_retriever_tool, web_search_tool]
-rag_model = llm.bind_tools(rag_tools)
-def rag_agent_node(state: AgentState):
-    response = rag_model.invoke(state["messages"])
+# قدم اول همیشه جستجوی همزمان همه‌ی منابع است (بدون LLM)؛ مدل فقط جمع‌بندی می‌کند و در صورت نیاز
+# می‌تواند با فیلتر پایگاه دانش یا جستجوی وب جستجوی تکمیلی انجام دهد.
+RAG_SEARCH_TOOLS = {"information_search_tool", "knowledge_base_retriever_tool"}
+rag_tools = [information_search_tool, knowledge_base_retriever_tool, web_search_tool]
+async def rag_agent_node(state: AgentState):
+    last_message = state["messages"][-1]
+    if last_message.type == "human":
+        call = {"name": information_search_tool.name, "args": {"query": last_message.content}, "id": f"direct_{uuid.uuid4().hex[:12]}"}
+        return {"messages": [AIMessage(content="", tool_calls=[call])], "tool_output": None}
+    response = await get_bound_model("rag", rag_tools).ainvoke(prompt_messages(state))
     return {"messages": [response], "tool_output": None}
-rag_workflow = StateGraph(AgentState)
-rag_workflow.add_node("agent", rag_agent_node)
-rag_workflow.add_node("tools", ToolNode(rag_tools))
-rag_workflow.set_entry_point("agent")
-rag_workflow.add_conditional_edges("agent", should_continue, {"continue": "tools", "end": END})
-rag_workflow.add_edge("tools", "agent")
-rag_agent = rag_workflow.compile()
+# cache معنایی: سوال‌های تقریباً تکراری پاسخ ذخیره شده را بدون LLM و جستجوی وب می‌گیرند.
+rag_cache = SemanticCache(backend=state_backend.get_shared_backend())
+# cache فقط روی متن سوال کلید می‌خورد و بین همه‌ی گفتگوها مشترک است؛ سوالی که بعد از نوبت‌های قبلی پرسیده
+# می‌شود («اون یکی که گفتی قیمتش چنده؟») ممکن است به آن‌ها وابسته باشد و از روی متن نمی‌شود این را فهمید،
+# پس این نوبت‌ها نه از cache پاسخ می‌گیرند و نه پاسخشان را برای گفتگوهای دیگر ذخیره می‌کنند.
+def rag_cacheable(state: AgentState, last_human: int) -> bool:
+    messages = state["messages"]
+    return not state.get("summary") and not any(msg.type == "human" for msg in messages[:last_human])
+async def rag_cache_node(state: AgentState):
+    query = state["messages"][-1].content
+    if not rag_cacheable(state, len(state["messages"]) - 1):
+        telemetry.inc("chatfood_cache_requests_total", cache="semantic", result="skip")
+        return {"messages": [], "tool_output": None}
+    try:
+        vector = await get_embedding_model().aembed_query(query)
+    except Exception as e:
+        print(f"!!! خطا در امبدینگ سوال برای cache معنایی: {e}")
+        return {"messages": [], "tool_output": None}
+    hit = rag_cache.lookup(vector)
+    telemetry.record_cache("semantic", hit is not None)
+    if hit is None:
+        return {"messages": [], "tool_output": None}
+    metadata = {"semantic_cache": {"query": hit["query"], "similarity": hit["similarity"], "documents": hit["documents"]}}
+    return {"messages": [AIMessage(content=hit["answer"], response_metadata=metadata)], "tool_output": None}
+def rag_cache_hit(state: AgentState):
+    return "hit" if state["messages"][-1].type == "ai" else "miss"
+async def rag_cache_store_node(state: AgentState):
+    messages = state["messages"]
+    last_human = max(i for i, msg in enumerate(messages) if msg.type == "human")
+    answer = messages[-1].content
+    if answer and rag_cacheable(state, last_human):
+        documents = [msg.content for msg in messages[last_human + 1:] if msg.type == "tool" and msg.name in RAG_SEARCH_TOOLS]
+        try:
+            vector = await get_embedding_model().aembed_query(messages[last_human].content)
+            rag_cache.store(vector, messages[last_human].content, answer, documents)
+        except Exception as e:
+            print(f"!!! خطا در ذخیره پاسخ در cache معنایی: {e}")
+    return {"messages": [], "tool_output": None}
+def get_rag_cache_stats() -> dict:
+    return rag_cache.stats()
+
+@functools.lru_cache(maxsize=None)
+def get_rag_agent():
+    rag_workflow = StateGraph(AgentState)
+    rag_workflow.add_node("cache", rag_cache_node)
+    rag_workflow.add_node("agent", rag_agent_node)
+    rag_workflow.add_node("tools", ToolNode(rag_tools))
+    rag_workflow.add_node("store", rag_cache_store_node)
+    rag_workflow.set_entry_point("cache")
+    rag_workflow.add_conditional_edges("cache", rag_cache_hit, {"hit": END, "miss": "agent"})
+    rag_workflow.add_conditional_edges("agent", should_continue, {"continue": "tools", "end": "store"})
+    rag_workflow.add_edge("tools", "agent")
+    rag_workflow.add_edge("store", END)
+    return rag_workflow.compile()
 
 # --- ایجنت پیشنهاددهنده ---
-async def recommendation_agent_node(state: AgentState):
-    user_id = "user123"
-    order_history, special_offers = get_order_history(user_id), get_special_offers()
-    prompt = ChatPromptTemplate.from_template("شما یک دستیار فروش دوستانه هستید. با توجه به تاریخچه سفارش کاربر ({history}) و پیشنهادهای ویژه امروز ({offers})، یک پیام خوش‌آمدگویی جذاب و شخصی‌سازی شده بساز.")
-    chain = prompt | llm
-    response = await chain.ainvoke({"history": order_history, "offers": special_offers})
-    return {"messages": [response], "tool_output": None}
+# پیشنهادهای هر کاربر به صورت دسته‌ای از جدول orders محاسبه می‌شوند (recommendations.py) و پیام خوش‌آمد
+# با TTL در cache است؛ شروع جلسه فقط یک lookup است و LLM فراخوانی نمی‌شود.
+async def recommendation_agent_node(state: AgentState, config: RunnableConfig):
+    greeting = await recommendations.aget_greeting(config.get("configurable", {}).get("user_id"))
+    return {"messages": [AIMessage(content=greeting)], "tool_output": None}
 
 # ==================== مسیریاب (Router) ====================
 class RouterQuery(BaseModel):
@@ -191,31 +358,93 @@ prompt_text = """شما یک دستیار هوشمند مسیریاب هستید
 **تاریخچه گفتگو:** {history}
 **آخرین پیام کاربر:** <user_input>{input}</user_input>"""
 prompt = ChatPromptTemplate.from_template(prompt_text)
-router_chain = prompt | llm.with_structured_output(RouterQuery)
-def get_destination(state: AgentState):
-    messages = state["messages"]
-    last_message = messages[-1]
+@functools.lru_cache(maxsize=None)
+def get_router_chain():
+    return prompt | get_llm().with_structured_output(RouterQuery)
+async def llm_route(messages: List[BaseMessage]) -> str:
     history_str = "\n".join([f"{msg.type}: {msg.content}" for msg in messages[:-1]])
-    result = router_chain.invoke({"history": history_str, "input": last_message.content})
-    print(f"\n--- مسیریاب (با حافظه) تصمیم گرفت: {result.destination} ---")
+    result = await get_router_chain().ainvoke({"history": history_str, "input": messages[-1].content})
     return result.destination
+# قوانین و دسته‌بند امبدینگ قبل از LLM؛ LLM فقط برای پیام‌های مبهم فراخوانی می‌شود.
+router = TieredRouter(llm_route=llm_route, get_embeddings=get_embedding_model)
+async def get_destination(state: AgentState):
+    # مسیریاب فقط نمای فشرده‌ی گفتگو را می‌بیند، نه کل تاریخچه و خروجی ابزارها.
+    destination, tier = await router.route(router_view(state["messages"], state.get("summary")))
+    print(f"\n--- مسیریاب ({tier}) تصمیم گرفت: {destination} ---")
+    telemetry.inc("chatfood_router_decisions_total", tier=tier, destination=destination)
+    return destination
+def get_router_stats() -> dict:
+    return router.stats()
 
-# ==================== توابع ساخت گراف ====================
-def get_recommendation_app():
+# ==================== حافظه گفتگو ====================
+summary_prompt = ChatPromptTemplate.from_template("""خلاصه‌ی فعلی گفتگوی یک دستیار سفارش غذا با کاربر و ادامه‌ی گفتگو را می‌بینی.
+یک خلاصه‌ی جدید و فشرده (حداکثر {max_tokens} توکن) بنویس که ترجیحات کاربر، غذاها و قیمت‌هایی که دیده،
+شماره سفارش‌ها و درخواست‌های باز را نگه دارد. فقط خود خلاصه را بنویس.
+**خلاصه فعلی:** {summary}
+**ادامه گفتگو:**
+{transcript}""")
+async def summarize_history(summary: str, messages: List[BaseMessage]) -> str:
+    transcript = "\n".join(f"{msg.type}: {str(msg.content)[:500]}" for msg in messages if msg.content)
+    response = await (summary_prompt | get_llm()).ainvoke({"summary": summary or "-", "transcript": transcript, "max_tokens": SUMMARY_MAX_TOKENS})
+    return response.content
+conversation_memory = ConversationMemory(summarize=summarize_history)
+async def memory_node(state: AgentState):
+    """قبل از مسیریابی، تاریخچه را در بودجه‌ی توکن نگه می‌دارد و توکن‌های هر نوبت را ثبت می‌کند."""
+    update = await conversation_memory.compact(state)
+    removed = {msg.id for msg in update.get("messages", [])}
+    messages = [msg for msg in state["messages"] if msg.id not in removed]
+    summary = update.get("summary", state.get("summary"))
+    context_tokens = messages_tokens(messages) + count_tokens(summary or "")
+    conversation_memory.record_turn(context_tokens, messages_tokens(router_view(messages, summary)))
+    return update or {"tool_output": None}
+def get_fanout_stats() -> dict:
+    return fanout.get_fanout_stats()
+def get_web_search_stats() -> dict:
+    return web_search.get_stats()
+def get_embedding_stats() -> dict:
+    return get_embedding_model().stats()
+def get_memory_stats() -> dict:
+    return conversation_memory.stats()
+
+# ==================== رجیستری گراف‌های کامپایل شده ====================
+# گراف‌ها یک بار در هر پروسه کامپایل و بین همه جلسه‌ها به اشتراک گذاشته می‌شوند؛
+# وضعیت هر جلسه (تاریخچه پیام‌ها) فقط در checkpointer و با thread_id همان جلسه نگهداری می‌شود.
+_checkpointer = None
+def get_checkpointer():
+    global _checkpointer
+    if _checkpointer is None:
+        # با CHATFOOD_STATE_BACKEND=sqlite|redis تاریخچه بین همه‌ی workerها مشترک است.
+        _checkpointer = state_backend.create_checkpointer()
+    return _checkpointer
+
+def session_config(thread_id: str, cart_id: str = None) -> dict:
+    return {"configurable": {"thread_id": thread_id, "cart_id": cart_id or thread_id}}
+
+async def end_session(thread_id: str):
+    """تاریخچه‌ی جلسه‌ی بسته شده را از checkpointer حذف می‌کند تا حافظه پروسه رشد نکند."""
+    await get_checkpointer().adelete_thread(thread_id)
+
+def build_recommendation_app():
     workflow = StateGraph(AgentState)
     workflow.add_node("recommend", recommendation_agent_node)
     workflow.set_entry_point("recommend")
     workflow.add_edge("recommend", END)
     return workflow.compile()
 
-def get_app():
+@functools.lru_cache(maxsize=None)
+def get_recommendation_app():
+    return build_recommendation_app()
+
+def build_app(checkpointer=None):
     super_workflow = StateGraph(AgentState)
-    super_workflow.add_node("cart_agent", cart_agent)
-    super_workflow.add_node("filter_agent", filter_agent)
-    super_workflow.add_node("order_manager", order_manager_agent)
-    super_workflow.add_node("food_search", food_search_agent)
-    super_workflow.add_node("information_agent", rag_agent)
-    super_workflow.add_conditional_edges("__start__", get_destination, {
+    super_workflow.add_node("cart_agent", get_cart_agent())
+    super_workflow.add_node("filter_agent", get_filter_agent())
+    super_workflow.add_node("order_manager", get_order_manager_agent())
+    super_workflow.add_node("food_search", get_food_search_agent())
+    super_workflow.add_node("information_agent", get_rag_agent())
+    super_workflow.add_node("memory", memory_node)
+    super_workflow.set_entry_point("memory")
+    super_workflow.add_conditional_edges("memory", get_destination, {
         "CartAgent": "cart_agent",
         "FilterAgent": "filter_agent",
         "OrderManager": "order_manager",
@@ -227,7 +456,37 @@ def get_app():
     super_workflow.add_edge("order_manager", END)
     super_workflow.add_edge("food_search", END)
     super_workflow.add_edge("information_agent", END)
-    return super_workflow.compile()
+    return super_workflow.compile(checkpointer=checkpointer)
+
+@functools.lru_cache(maxsize=None)
+def get_app():
+    return build_app(checkpointer=get_checkpointer())
+
+# ==================== گرم کردن در پس‌زمینه ====================
+def warm_embeddings():
+    """مدل امبدینگ را بارگذاری و یک بار اجرا می‌کند و بردارهای مثال‌های مسیریاب را از قبل می‌سازد."""
+    get_embedding_model().warm()
+    router.warm()
+
+def warm_database():
+    """مهاجرت‌ها و جدول‌های کمکی پشت سر هم آماده می‌شوند؛ همه قفل نوشتن می‌خواهند و مهاجرت روی جدول بزرگ طول می‌کشد."""
+    migrations.ensure_ready()
+    search_index.ensure_ready()
+    recommendations.ensure_ready()
+    cart_store.ensure_ready()
+
+def warm_graphs():
+    get_llm()
+    get_app()
+    get_recommendation_app()
+
+startup.register_warmup("embedding_model", warm_embeddings)
+startup.register_warmup("vector_store", get_rag_table)
+startup.register_warmup("database", warm_database)
+startup.register_warmup("web_search", web_search.get_backend)
+startup.register_warmup("graphs", warm_graphs)
+# encoding توکنایزر در اولین استفاده از شبکه دانلود می‌شود؛ نباید در اولین نوبت گفتگو و داخل event loop رخ دهد.
+startup.register_warmup("tokenizer", functools.partial(count_tokens, "گرم کردن"))
 
 if __name__ == "__main__":
     print("فایل main.py با موفقیت بارگذاری شد و آماده ایمپورت شدن توسط app.py است.")
\ No newline at end of file
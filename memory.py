@@ -0,0 +1,160 @@
+import functools
+import os
+import threading
+
+from langchain_core.messages import BaseMessage, HumanMessage, RemoveMessage, SystemMessage
+
+# ==================== تنظیمات بودجه توکن ====================
+# وقتی تاریخچه‌ی یک جلسه از MEMORY_TOKEN_BUDGET بیشتر شود، پیام‌های قدیمی‌تر از پنجره‌ی اخیر
+# (WINDOW_TOKEN_BUDGET) در یک خلاصه‌ی غلتان ادغام و از state حذف می‌شوند؛ پس اندازه‌ی prompt سقف ثابت دارد.
+MEMORY_TOKEN_BUDGET = int(os.getenv("CHATFOOD_MEMORY_TOKEN_BUDGET", "3000"))
+WINDOW_TOKEN_BUDGET = int(os.getenv("CHATFOOD_WINDOW_TOKEN_BUDGET", "1500"))
+SUMMARY_MAX_TOKENS = 300
+# نمای مسیریاب: فقط پیام‌های متنی کاربر و دستیار، کوتاه شده و در بودجه‌ای کوچک
+ROUTER_TOKEN_BUDGET = 400
+ROUTER_MESSAGE_CHARS = 300
+# هزینه ثابت قالب هر پیام در API چت
+MESSAGE_OVERHEAD_TOKENS = 4
+# تخمین توکن وقتی tiktoken در دسترس نیست (متن فارسی به طور میانگین حدود ۳ کاراکتر در هر توکن)
+CHARS_PER_TOKEN = 3
+
+_encoding = None
+_encoding_failed = False
+_encoding_lock = threading.Lock()
+
+
+def _get_encoding():
+    global _encoding, _encoding_failed
+    if _encoding is None and not _encoding_failed:
+        with _encoding_lock:
+            if _encoding is None and not _encoding_failed:
+                try:
+                    import tiktoken
+                    _encoding = tiktoken.get_encoding("o200k_base")
+                except Exception as e:
+                    # فایل encoding در اولین استفاده دانلود می‌شود؛ بدون شبکه به تخمین کاراکتری برمی‌گردیم.
+                    print(f"!!! tiktoken در دسترس نیست، تعداد توکن‌ها تخمینی است: {e}")
+                    _encoding_failed = True
+    return _encoding
+
+@functools.lru_cache(maxsize=4096)
+def count_tokens(text: str) -> int:
+    if not text:
+        return 0
+    encoding = _get_encoding()
+    if encoding is None:
+        return len(text) // CHARS_PER_TOKEN + 1
+    return len(encoding.encode(text))
+
+def _content_text(message: BaseMessage) -> str:
+    content = message.content
+    if isinstance(content, list):
+        content = " ".join(part.get("text", "") if isinstance(part, dict) else str(part) for part in content)
+    return content or ""
+
+def message_tokens(message: BaseMessage) -> int:
+    tokens = MESSAGE_OVERHEAD_TOKENS + count_tokens(_content_text(message))
+    for call in getattr(message, "tool_calls", None) or []:
+        tokens += count_tokens(call["name"]) + count_tokens(str(call["args"]))
+    return tokens
+
+def messages_tokens(messages: list) -> int:
+    return sum(message_tokens(message) for message in messages)
+
+def split_window(messages: list, budget: int = WINDOW_TOKEN_BUDGET) -> tuple[list, list]:
+    """
+    تاریخچه را به (قدیمی، اخیر) تقسیم می‌کند؛ بخش اخیر در بودجه جا می‌شود و همیشه از یک پیام کاربر شروع می‌شود
+    تا فراخوانی ابزار و نتیجه‌ی آن از هم جدا نشوند. آخرین نوبت کاربر در هر حال نگه داشته می‌شود.
+    """
+    human_indexes = [i for i, message in enumerate(messages) if isinstance(message, HumanMessage)]
+    if not human_indexes:
+        return [], list(messages)
+    cut = human_indexes[-1]
+    used = messages_tokens(messages[cut:])
+    for start in reversed(human_indexes[:-1]):
+        used += messages_tokens(messages[start:cut])
+        if used > budget:
+            break
+        cut = start
+    return list(messages[:cut]), list(messages[cut:])
+
+def prompt_messages(state: dict) -> list:
+    """پیام‌هایی که به مدل ایجنت‌ها داده می‌شوند: خلاصه‌ی گفتگوهای قبلی (اگر هست) و پنجره‌ی اخیر."""
+    summary = state.get("summary")
+    if not summary:
+        return state["messages"]
+    return [SystemMessage(content=f"خلاصه گفتگوی قبلی با کاربر:\n{summary}")] + list(state["messages"])
+
+def router_view(messages: list, summary: str = None, budget: int = ROUTER_TOKEN_BUDGET) -> list:
+    """نمای فشرده برای مسیریاب: بدون پیام‌های ابزار، هر پیام کوتاه شده، در بودجه‌ی توکن و با آخرین پیام کاربر در انتها."""
+    view = []
+    used = 0
+    for message in reversed(messages):
+        if message.type not in ("human", "ai"):
+            continue
+        text = _content_text(message)
+        if not text:
+            continue
+        if len(text) > ROUTER_MESSAGE_CHARS:
+            text = text[:ROUTER_MESSAGE_CHARS] + "…"
+        compact = message.model_copy(update={"content": text, "tool_calls": []} if message.type == "ai" else {"content": text})
+        used += message_tokens(compact)
+        if view and used > budget:
+            break
+        view.append(compact)
+    if summary:
+        view.append(SystemMessage(content=summary))
+    return list(reversed(view))
+
+
+class ConversationMemory:
+    """
+    مدیریت حافظه‌ی گفتگو: پنجره‌ی لغزان با بودجه‌ی توکن و خلاصه‌ی غلتان پیام‌های قدیمی‌تر.
+    summarize یک تابع async است که (خلاصه‌ی قبلی، پیام‌های قدیمی) را می‌گیرد و خلاصه‌ی جدید را برمی‌گرداند.
+    """
+
+    def __init__(self, summarize, budget: int = MEMORY_TOKEN_BUDGET, window_budget: int = WINDOW_TOKEN_BUDGET):
+        self._summarize = summarize
+        self.budget = budget
+        self.window_budget = window_budget
+        self._lock = threading.Lock()
+        self._stats = {"turns": 0, "context_tokens": 0, "max_context_tokens": 0, "router_tokens": 0,
+                       "summaries": 0, "summarized_messages": 0, "summary_failures": 0}
+
+    async def compact(self, state: dict) -> dict:
+        """اگر تاریخچه از بودجه بیشتر باشد، به‌روزرسانی state (حذف پیام‌های قدیمی و خلاصه‌ی جدید) را برمی‌گرداند."""
+        messages = state["messages"]
+        summary = state.get("summary") or ""
+        if messages_tokens(messages) <= self.budget:
+            return {}
+        older, _ = split_window(messages, self.window_budget)
+        if not older:
+            return {}
+        try:
+            summary = await self._summarize(summary, older)
+        except Exception as e:
+            # بدون خلاصه، پیام‌های قدیمی فعلاً نگه داشته می‌شوند و نوبت بعد دوباره تلاش می‌شود.
+            print(f"!!! خطا در خلاصه‌سازی تاریخچه گفتگو: {e}")
+            with self._lock:
+                self._stats["summary_failures"] += 1
+            return {}
+        with self._lock:
+            self._stats["summaries"] += 1
+            self._stats["summarized_messages"] += len(older)
+        return {"messages": [RemoveMessage(id=message.id) for message in older], "summary": summary}
+
+    def record_turn(self, context_tokens: int, router_tokens: int):
+        with self._lock:
+            self._stats["turns"] += 1
+            self._stats["context_tokens"] += context_tokens
+            self._stats["router_tokens"] += router_tokens
+            self._stats["max_context_tokens"] = max(self._stats["max_context_tokens"], context_tokens)
+
+    def stats(self) -> dict:
+        """میانگین و بیشینه‌ی توکن‌های context در هر نوبت، توکن‌های نمای مسیریاب و تعداد خلاصه‌سازی‌ها."""
+        with self._lock:
+            stats = dict(self._stats)
+        turns = stats["turns"]
+        stats["avg_context_tokens_per_turn"] = stats.pop("context_tokens") / turns if turns else 0.0
+        stats["avg_router_tokens_per_turn"] = stats.pop("router_tokens") / turns if turns else 0.0
+        return stats
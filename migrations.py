@@ -0,0 +1,161 @@
+import argparse
+import sqlite3
+import threading
+import time
+
+import database
+
+# ==================== مهاجرت‌های پایگاه داده ====================
+# نسخه‌ی ساختار پایگاه داده در PRAGMA user_version نگه داشته می‌شود. هر مهاجرت (نسخه، نام، دستورها) فقط یک بار
+# و در یک تراکنش BEGIN IMMEDIATE همراه با بالا بردن user_version اجرا می‌شود؛ اگر چند worker همزمان بالا بیایند،
+# فقط اولی مهاجرت را اجرا می‌کند و بقیه بعد از گرفتن قفل نسخه‌ی جدید را می‌بینند و کاری نمی‌کنند.
+DELIVERED_STATUS = 'تحویل داده شده'
+# مهاجرت روی جدول بزرگ سفارش‌ها ممکن است طول بکشد؛ workerهای دیگر تا این مدت برای قفل نوشتن صبر می‌کنند.
+LOCK_TIMEOUT = 600
+_NOW = "((julianday('now') - 2440587.5) * 86400.0)"
+_HISTORY_BACKFILL = f"""INSERT INTO user_order_history (user_id, food_name, orders, delivered, last_ordered)
+    SELECT user_id, food_name, COUNT(*), SUM(status = '{DELIVERED_STATUS}'), MAX(created) FROM orders
+    GROUP BY user_id, food_name"""
+
+MIGRATIONS = [
+    (1, "base_tables", [
+        """CREATE TABLE IF NOT EXISTS foods (
+            id INTEGER PRIMARY KEY AUTOINCREMENT, name TEXT NOT NULL UNIQUE, category TEXT NOT NULL,
+            restaurant_name TEXT NOT NULL, price REAL NOT NULL)""",
+        """CREATE TABLE IF NOT EXISTS orders (
+            id INTEGER PRIMARY KEY AUTOINCREMENT, user_id TEXT NOT NULL, food_name TEXT NOT NULL,
+            status TEXT NOT NULL, review TEXT)""",
+    ]),
+    # زمان ثبت و آخرین تغییر وضعیت هر سفارش؛ تریگرها آن‌ها را برای هر نویسنده‌ای (سبد خرید، ایمپورت، اسکریپت‌ها) پر می‌کنند.
+    (2, "order_timestamps", [
+        "ALTER TABLE orders ADD COLUMN created REAL",
+        "ALTER TABLE orders ADD COLUMN updated REAL",
+        f"""CREATE TRIGGER IF NOT EXISTS orders_created_ai AFTER INSERT ON orders WHEN new.created IS NULL BEGIN
+            UPDATE orders SET created = {_NOW}, updated = {_NOW} WHERE id = new.id;
+        END""",
+        f"""CREATE TRIGGER IF NOT EXISTS orders_updated_au AFTER UPDATE OF status ON orders BEGIN
+            UPDATE orders SET updated = {_NOW} WHERE id = new.id;
+        END""",
+    ]),
+    # ایندکس پوششی: سفارش‌های کاربر بر اساس وضعیت بدون مراجعه به جدول خوانده می‌شوند. هر ایندکس روی orders
+    # هزینه‌ی هر درج را بالا می‌برد، پس فقط ایندکسی که کوئری‌ها واقعا استفاده می‌کنند ساخته می‌شود.
+    (3, "orders_indexes", [
+        "CREATE INDEX IF NOT EXISTS idx_orders_user_status ON orders (user_id, status, food_name)",
+    ]),
+    # تاریخچه‌ی تجمیع شده‌ی هر کاربر (تعداد سفارش و تحویل هر غذا)؛ تریگرهای orders آن را افزایشی به‌روز نگه می‌دارند
+    # و خواندن تاریخچه و غذاهای محبوب کاربر به جای اسکن سفارش‌ها یک جستجوی کلید اصلی است.
+    (4, "user_order_history", [
+        """CREATE TABLE IF NOT EXISTS user_order_history (
+            user_id TEXT NOT NULL, food_name TEXT NOT NULL, orders INTEGER NOT NULL, delivered INTEGER NOT NULL,
+            last_ordered REAL, PRIMARY KEY (user_id, food_name)) WITHOUT ROWID""",
+        _HISTORY_BACKFILL,
+        f"""CREATE TRIGGER IF NOT EXISTS orders_history_ai AFTER INSERT ON orders BEGIN
+            INSERT INTO user_order_history (user_id, food_name, orders, delivered, last_ordered)
+            VALUES (new.user_id, new.food_name, 1, new.status = '{DELIVERED_STATUS}', COALESCE(new.created, {_NOW}))
+            ON CONFLICT (user_id, food_name) DO UPDATE SET orders = orders + 1, delivered = delivered + excluded.delivered,
+                last_ordered = MAX(COALESCE(last_ordered, 0), excluded.last_ordered);
+        END""",
+        f"""CREATE TRIGGER IF NOT EXISTS orders_history_au AFTER UPDATE OF user_id, food_name, status ON orders BEGIN
+            UPDATE user_order_history SET orders = orders - 1, delivered = delivered - (old.status = '{DELIVERED_STATUS}')
+                WHERE user_id = old.user_id AND food_name = old.food_name;
+            INSERT INTO user_order_history (user_id, food_name, orders, delivered, last_ordered)
+            VALUES (new.user_id, new.food_name, 1, new.status = '{DELIVERED_STATUS}', new.created)
+            ON CONFLICT (user_id, food_name) DO UPDATE SET orders = orders + 1, delivered = delivered + excluded.delivered;
+            DELETE FROM user_order_history WHERE user_id = old.user_id AND food_name = old.food_name AND orders <= 0;
+        END""",
+        f"""CREATE TRIGGER IF NOT EXISTS orders_history_ad AFTER DELETE ON orders BEGIN
+            UPDATE user_order_history SET orders = orders - 1, delivered = delivered - (old.status = '{DELIVERED_STATUS}')
+                WHERE user_id = old.user_id AND food_name = old.food_name;
+            DELETE FROM user_order_history WHERE user_id = old.user_id AND food_name = old.food_name AND orders <= 0;
+        END""",
+    ]),
+    # مشخصات رستوران‌ها (importer.py)؛ foods.restaurant_name با name این جدول یکی است.
+    (5, "restaurants", [
+        """CREATE TABLE IF NOT EXISTS restaurants (
+            name TEXT PRIMARY KEY, city TEXT, address TEXT, phone TEXT, rating REAL)""",
+    ]),
+    # سفارش‌هایی که از آخرین اجرای کار پیشنهادها تحویل داده شده‌اند (recommendations.py)؛ ایندکس جزئی فقط
+    # سفارش‌های تحویل شده را نگه می‌دارد تا درج سفارش‌های جدید هزینه‌ی اضافه نداشته باشد.
+    (6, "orders_delivered_updated", [
+        f"CREATE INDEX IF NOT EXISTS idx_orders_delivered_updated ON orders (updated) WHERE status = '{DELIVERED_STATUS}'",
+    ]),
+]
+
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+
+def current_version(conn: sqlite3.Connection) -> int:
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+def _begin_immediate(conn: sqlite3.Connection):
+    deadline = time.monotonic() + LOCK_TIMEOUT
+    while True:
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            return
+        except sqlite3.OperationalError as e:
+            if not database._is_busy(e) or time.monotonic() > deadline:
+                raise
+            time.sleep(0.2)
+
+def migrate(conn: sqlite3.Connection, target: int = None) -> list:
+    """مهاجرت‌های اجرا نشده را به ترتیب اجرا می‌کند و [(نسخه، نام، ثانیه)] اجرا شده‌ها را برمی‌گرداند."""
+    target = LATEST_VERSION if target is None else target
+    applied = []
+    if current_version(conn) >= target:
+        return applied
+    for version, name, statements in MIGRATIONS:
+        if version > target:
+            break
+        started = time.perf_counter()
+        _begin_immediate(conn)
+        try:
+            # نسخه بعد از گرفتن قفل نوشتن دوباره خوانده می‌شود (worker دیگری ممکن است همین الان مهاجرت کرده باشد).
+            if current_version(conn) >= version:
+                conn.rollback()
+                continue
+            for statement in statements:
+                conn.execute(statement)
+            conn.execute(f"PRAGMA user_version = {version}")
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
+        applied.append((version, name, time.perf_counter() - started))
+        print(f"✅ مهاجرت {version} ({name}) در {applied[-1][2]:.2f}s اجرا شد.")
+    if applied:
+        conn.execute("PRAGMA optimize")
+    return applied
+
+def rebuild_user_history(conn: sqlite3.Connection):
+    """user_order_history را کامل از روی orders بازسازی می‌کند (مثلاً بعد از بارگذاری انبوه با تریگرهای غیرفعال)."""
+    with conn:
+        conn.execute("DELETE FROM user_order_history")
+        conn.execute(_HISTORY_BACKFILL)
+
+_ready = False
+_ready_lock = threading.Lock()
+
+def ensure_ready():
+    global _ready
+    if _ready:
+        return
+    with _ready_lock:
+        if not _ready:
+            with database.connection() as conn:
+                migrate(conn)
+            _ready = True
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="اجرای مهاجرت‌های ساختار پایگاه داده (نسخه در PRAGMA user_version)")
+    parser.add_argument("--db", default=database.DB_PATH)
+    parser.add_argument("--status", action="store_true", help="فقط نمایش نسخه‌ی فعلی و مهاجرت‌های اجرا نشده")
+    parser.add_argument("--target", type=int, default=None)
+    args = parser.parse_args()
+    connection = sqlite3.connect(args.db)
+    version = current_version(connection)
+    pending = [f"{v} ({name})" for v, name, _ in MIGRATIONS if v > version]
+    print(f"نسخه‌ی فعلی: {version}، آخرین نسخه: {LATEST_VERSION}، اجرا نشده: {', '.join(pending) or '-'}")
+    if not args.status:
+        migrate(connection, args.target)
+    connection.close()
@@ -0,0 +1,237 @@
+import argparse
+import math
+import os
+import sqlite3
+import threading
+import time
+from collections import defaultdict
+
+import database
+import llm_scheduler
+import telemetry
+from tools import get_special_offers
+
+# ==================== تنظیمات ====================
+# فقط سفارش‌های تحویل داده شده در پیشنهادها حساب می‌شوند (همان معیار get_order_history).
+DELIVERED_STATUS = 'تحویل داده شده'
+CANDIDATES_PER_USER = 5
+# وزن شباهت هم‌دسته بودن دو غذا در کنار هم‌رخدادی سفارش‌ها
+CATEGORY_WEIGHT = 0.2
+GREETING_TTL_SECONDS = int(os.getenv("CHATFOOD_GREETING_TTL", str(24 * 3600)))
+# کاربری که هنوز سفارشی ندارد پیشنهادهای پرطرفدار را می‌گیرد.
+ANONYMOUS_USER = "__popular__"
+
+SCHEMA = [
+    # غذاهای متمایز هر کاربر؛ هم‌رخدادی فقط یک بار برای هر جفت (کاربر، غذا) شمرده می‌شود.
+    "CREATE TABLE IF NOT EXISTS user_items (user_id TEXT NOT NULL, food_name TEXT NOT NULL, PRIMARY KEY (user_id, food_name)) WITHOUT ROWID",
+    "CREATE TABLE IF NOT EXISTS item_cooccurrence (a TEXT NOT NULL, b TEXT NOT NULL, count INTEGER NOT NULL, PRIMARY KEY (a, b)) WITHOUT ROWID",
+    "CREATE TABLE IF NOT EXISTS recommendations (user_id TEXT NOT NULL, rank INTEGER NOT NULL, food_name TEXT NOT NULL, score REAL NOT NULL, PRIMARY KEY (user_id, rank)) WITHOUT ROWID",
+    "CREATE TABLE IF NOT EXISTS recommendation_greetings (user_id TEXT PRIMARY KEY, greeting TEXT NOT NULL, created REAL NOT NULL, expires REAL NOT NULL)",
+    "CREATE TABLE IF NOT EXISTS recommendation_state (key TEXT PRIMARY KEY, value REAL NOT NULL)",
+]
+
+
+def ensure_recommendation_tables(conn: sqlite3.Connection):
+    with conn:
+        for statement in SCHEMA:
+            conn.execute(statement)
+
+_ready = False
+_ready_lock = threading.Lock()
+
+def ensure_ready():
+    global _ready
+    if _ready:
+        return
+    with _ready_lock:
+        if not _ready:
+            with database.connection() as conn:
+                ensure_recommendation_tables(conn)
+            _ready = True
+
+# ==================== محاسبه پیشنهادها ====================
+def _item_counts(conn) -> dict:
+    return dict(conn.execute("SELECT food_name, COUNT(*) FROM user_items GROUP BY food_name"))
+
+def _categories(conn) -> dict:
+    return dict(conn.execute("SELECT name, category FROM foods"))
+
+def score_candidates(conn, items: list, counts: dict, categories: dict, limit: int = CANDIDATES_PER_USER) -> list:
+    """
+    امتیاز غذاهای سفارش داده نشده برای کاربری با سابقه‌ی items:
+    شباهت کسینوسی هم‌رخدادی (count(a,b) / sqrt(n_a * n_b)) به علاوه‌ی وزن کوچکی برای هم‌دسته بودن.
+    """
+    owned = set(items)
+    scores = defaultdict(float)
+    for start in range(0, len(items), 500):
+        chunk = items[start:start + 500]
+        placeholders = ",".join("?" * len(chunk))
+        for a, b, count in conn.execute(f"SELECT a, b, count FROM item_cooccurrence WHERE a IN ({placeholders})", chunk):
+            if b not in owned:
+                scores[b] += count / math.sqrt(counts.get(a, 1) * counts.get(b, 1))
+    owned_categories = {categories.get(item) for item in items}
+    for name, category in categories.items():
+        if name not in owned and category in owned_categories:
+            scores[name] += CATEGORY_WEIGHT
+    # غذاهای حذف شده از منو پیشنهاد داده نمی‌شوند.
+    ranked = sorted((item for item in scores.items() if item[0] in categories), key=lambda item: (-item[1], item[0]))
+    return ranked[:limit]
+
+def _popular(counts: dict, categories: dict, limit: int = CANDIDATES_PER_USER) -> list:
+    ranked = sorted(((name, float(counts.get(name, 0))) for name in categories), key=lambda item: (-item[1], item[0]))
+    return ranked[:limit]
+
+def _store_candidates(conn, user_id: str, candidates: list):
+    conn.execute("DELETE FROM recommendations WHERE user_id = ?", (user_id,))
+    conn.executemany("INSERT INTO recommendations (user_id, rank, food_name, score) VALUES (?, ?, ?, ?)",
+                     [(user_id, rank, name, score) for rank, (name, score) in enumerate(candidates)])
+    # پیام خوش‌آمد قبلی با پیشنهادهای قدیمی ساخته شده بود.
+    conn.execute("DELETE FROM recommendation_greetings WHERE user_id = ?", (user_id,))
+
+def _watermark(conn) -> float:
+    row = conn.execute("SELECT value FROM recommendation_state WHERE key = 'last_delivered_at'").fetchone()
+    return row[0] if row else 0.0
+
+def build_recommendations(full: bool = False) -> dict:
+    """
+    کار دسته‌ای پیشنهادها. حالت افزایشی فقط سفارش‌هایی را که از آخرین اجرا تحویل داده شده‌اند (بر اساس
+    orders.updated، نه id؛ سفارش سبد خرید اول «در حال آماده‌سازی» ثبت و بعداً تحویل می‌شود) به جدول‌های
+    user_items و item_cooccurrence اضافه و پیشنهادهای کاربران همان سفارش‌ها را دوباره حساب می‌کند.
+    حالت full همه چیز را از جدول orders از نو می‌سازد (مثلاً بعد از لغو سفارش‌های تحویل شده یا ایمپورت
+    سفارش‌هایی با زمان قدیمی).
+    """
+    ensure_ready()
+    started = time.perf_counter()
+    with database.connection() as conn:
+        with conn:
+            # قفل نوشتن از همین ابتدا گرفته می‌شود تا هیچ سفارشی بین خواندن watermark و ذخیره‌ی آن تحویل نشود.
+            conn.execute("BEGIN IMMEDIATE")
+            delivered_at = conn.execute(f"SELECT COALESCE(MAX(updated), 0) FROM orders WHERE status = '{DELIVERED_STATUS}'").fetchone()[0]
+            if full:
+                conn.execute("DELETE FROM user_items")
+                conn.execute("DELETE FROM item_cooccurrence")
+                conn.execute("DELETE FROM recommendations")
+                conn.execute("DELETE FROM recommendation_greetings")
+                conn.execute("INSERT INTO user_items SELECT DISTINCT user_id, food_name FROM orders WHERE status = ?", (DELIVERED_STATUS,))
+                conn.execute("""
+                    INSERT INTO item_cooccurrence (a, b, count)
+                    SELECT x.food_name, y.food_name, COUNT(*) FROM user_items x
+                    JOIN user_items y ON x.user_id = y.user_id AND x.food_name <> y.food_name
+                    GROUP BY x.food_name, y.food_name
+                """)
+                users = [row[0] for row in conn.execute("SELECT DISTINCT user_id FROM user_items")]
+            else:
+                # >= به جای >: سفارش‌های هم‌زمان با watermark دوباره خوانده می‌شوند و INSERT OR IGNORE تکرار را نادیده می‌گیرد.
+                # وضعیت به صورت ثابت در کوئری است تا ایندکس جزئی idx_orders_delivered_updated استفاده شود.
+                new_pairs = conn.execute(
+                    f"SELECT DISTINCT user_id, food_name FROM orders WHERE status = '{DELIVERED_STATUS}' AND updated >= ?",
+                    (_watermark(conn),)
+                ).fetchall()
+                users = set()
+                for user_id, food_name in new_pairs:
+                    inserted = conn.execute("INSERT OR IGNORE INTO user_items (user_id, food_name) VALUES (?, ?)", (user_id, food_name)).rowcount
+                    if not inserted:
+                        continue
+                    users.add(user_id)
+                    others = [row[0] for row in conn.execute(
+                        "SELECT food_name FROM user_items WHERE user_id = ? AND food_name <> ?", (user_id, food_name))]
+                    conn.executemany("""
+                        INSERT INTO item_cooccurrence (a, b, count) VALUES (?, ?, 1)
+                        ON CONFLICT (a, b) DO UPDATE SET count = count + 1
+                    """, [pair for other in others for pair in ((food_name, other), (other, food_name))])
+                users = sorted(users)
+
+            counts, categories = _item_counts(conn), _categories(conn)
+            for user_id in users:
+                items = [row[0] for row in conn.execute("SELECT food_name FROM user_items WHERE user_id = ?", (user_id,))]
+                _store_candidates(conn, user_id, score_candidates(conn, items, counts, categories))
+            _store_candidates(conn, ANONYMOUS_USER, _popular(counts, categories))
+            conn.execute("""
+                INSERT INTO recommendation_state (key, value) VALUES ('last_delivered_at', ?)
+                ON CONFLICT (key) DO UPDATE SET value = excluded.value
+            """, (delivered_at,))
+    return {"users": users, "last_delivered_at": delivered_at, "seconds": time.perf_counter() - started}
+
+# ==================== پیام خوش‌آمد ====================
+def get_candidates(user_id: str) -> list:
+    rows = database.fetchall("SELECT food_name FROM recommendations WHERE user_id = ? ORDER BY rank", (user_id,), read_only=True)
+    return [row[0] for row in rows]
+
+def render_greeting(candidates: list, offers: list, personalized: bool = True) -> str:
+    """پیام خوش‌آمد قالبی و بدون LLM از پیشنهادهای از پیش محاسبه شده و پیشنهادهای ویژه امروز."""
+    lines = ["سلام! به ChatFood خوش آمدید 🌟"]
+    if candidates:
+        names = "، ".join(f"**{name}**" for name in candidates[:3])
+        lines.append(f"با توجه به سلیقه‌ی شما، امروز {names} را پیشنهاد می‌کنیم." if personalized
+                     else f"پرطرفدارترین غذاهای ما: {names}")
+    offer_names = {offer['name']: offer for offer in offers}
+    featured = next((offer_names[name] for name in candidates if name in offer_names), offers[0] if offers else None)
+    if featured:
+        detail = featured.get('discount') or featured.get('offer', '')
+        lines.append(f"پیشنهاد ویژه: **{featured['name']}** از {featured['restaurant']} ({detail})")
+    lines.append("دوست دارید امتحانش کنید؟")
+    return "\n".join(lines)
+
+def store_greeting(user_id: str, greeting: str, ttl: float = GREETING_TTL_SECONDS):
+    ensure_ready()
+    now = time.time()
+    database.execute("""
+        INSERT INTO recommendation_greetings (user_id, greeting, created, expires) VALUES (?, ?, ?, ?)
+        ON CONFLICT (user_id) DO UPDATE SET greeting = excluded.greeting, created = excluded.created, expires = excluded.expires
+    """, (user_id, greeting, now, now + ttl))
+
+def _cached_greeting(user_id: str) -> str | None:
+    row = database.fetchone("SELECT greeting FROM recommendation_greetings WHERE user_id = ? AND expires > ?", (user_id, time.time()), read_only=True)
+    return row[0] if row else None
+
+def get_greeting(user_id: str = None) -> str:
+    """
+    پیام خوش‌آمد cache شده‌ی کاربر؛ اگر وجود نداشته یا منقضی شده باشد، از روی پیشنهادهای از پیش محاسبه شده
+    و بدون LLM ساخته و با TTL ذخیره می‌شود. کاربران بدون سابقه یک پیام مشترک (پرطرفدارها) می‌گیرند.
+    """
+    ensure_ready()
+    user_id = user_id or ANONYMOUS_USER
+    greeting = _cached_greeting(user_id)
+    telemetry.record_cache("greeting", bool(greeting))
+    if greeting:
+        return greeting
+    candidates = get_candidates(user_id) if user_id != ANONYMOUS_USER else []
+    if not candidates:
+        user_id = ANONYMOUS_USER
+        greeting = _cached_greeting(user_id)
+        if greeting:
+            return greeting
+        candidates = get_candidates(ANONYMOUS_USER)
+    greeting = render_greeting(candidates, get_special_offers(), personalized=user_id != ANONYMOUS_USER)
+    store_greeting(user_id, greeting)
+    return greeting
+
+async def aget_greeting(user_id: str = None) -> str:
+    return await database.run_async(get_greeting, user_id)
+
+async def render_greetings_with_llm(user_ids: list, llm, ttl: float = GREETING_TTL_SECONDS) -> int:
+    """برای اجرای دسته‌ای: پیام شخصی‌سازی شده را با LLM می‌سازد و در همان cache ذخیره می‌کند."""
+    from langchain_core.prompts import ChatPromptTemplate
+    prompt = ChatPromptTemplate.from_template("شما یک دستیار فروش دوستانه هستید. با توجه به غذاهای پیشنهادی برای این کاربر ({candidates}) و پیشنهادهای ویژه امروز ({offers})، یک پیام خوش‌آمدگویی جذاب و شخصی‌سازی شده بساز.")
+    chain = prompt | llm
+    offers = get_special_offers()
+    # کار پس‌زمینه است؛ در زمان‌بند LLM همیشه بعد از نوبت‌های تعاملی کاربران اجرا می‌شود.
+    with llm_scheduler.session("recommendations", llm_scheduler.BACKGROUND):
+        for user_id in user_ids:
+            response = await chain.ainvoke({"candidates": get_candidates(user_id) or get_candidates(ANONYMOUS_USER), "offers": offers})
+            store_greeting(user_id, response.content, ttl)
+    return len(user_ids)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="محاسبه‌ی دسته‌ای/افزایشی پیشنهادهای هر کاربر از جدول orders")
+    parser.add_argument("--full", action="store_true", help="بازسازی کامل به جای پردازش سفارش‌های جدید")
+    parser.add_argument("--render-llm", action="store_true", help="ساخت پیام خوش‌آمد کاربران به‌روز شده با LLM")
+    args = parser.parse_args()
+    result = build_recommendations(full=args.full)
+    delivered_at = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(result["last_delivered_at"]))
+    print(f"✅ پیشنهادهای {len(result['users'])} کاربر تا تحویل‌های {delivered_at} در {result['seconds']:.2f}s به‌روز شد.")
+    if args.render_llm:
+        import asyncio
+        from main import get_llm
+        rendered = asyncio.run(render_greetings_with_llm(result['users'] + [ANONYMOUS_USER], get_llm()))
+        print(f"✅ پیام خوش‌آمد {rendered} کاربر با LLM ساخته شد.")
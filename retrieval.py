@@ -0,0 +1,96 @@
+import asyncio
+import os
+from typing import Any, List, Optional
+
+from langchain_core.callbacks import AsyncCallbackManagerForRetrieverRun, CallbackManagerForRetrieverRun
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
+
+TABLE_NAME = "food_rag"
+# ==================== تنظیمات ایندکس ANN ====================
+# زیر این تعداد ردیف، جستجوی کامل (flat) هم سریع و هم دقیق است و ساخت ایندکس ارزشی ندارد.
+INDEX_MIN_ROWS = int(os.getenv("CHATFOOD_RAG_INDEX_MIN_ROWS", "5000"))
+INDEX_METRIC = "cosine"
+
+# ==================== تنظیمات پیش‌فرض بازیابی ====================
+DEFAULT_K = 4
+DEFAULT_NPROBES = 20
+DEFAULT_REFINE_FACTOR = 5
+DEFAULT_SCORE_THRESHOLD = 0.3
+FILTER_FIELDS = ('category', 'restaurant', 'source')
+
+
+def _index_params(rows: int, dim: int) -> dict:
+    # قواعد رایج IVF-PQ: حدود sqrt(n) پارتیشن و زیربردارهایی با طول ۸ (یا کمتر اگر بعد بخش‌پذیر نباشد).
+    num_partitions = max(1, min(4096, int(rows ** 0.5)))
+    num_sub_vectors = next(d for d in (dim // 8, dim // 4, dim // 2, dim) if d and dim % d == 0)
+    return {"num_partitions": num_partitions, "num_sub_vectors": num_sub_vectors}
+
+def has_vector_index(table) -> bool:
+    return any("vector" in getattr(index, "columns", []) for index in table.list_indices())
+
+def build_vector_index(table, changed: bool = True, force: bool = False) -> str:
+    """
+    اگر جدول از INDEX_MIN_ROWS بزرگ‌تر باشد، ایندکس IVF-PQ (فاصله کسینوسی) می‌سازد و ذخیره می‌کند.
+    اگر ایندکس از قبل وجود داشته باشد، فقط ردیف‌های جدید با optimize به آن اضافه می‌شوند.
+    """
+    rows = table.count_rows()
+    if rows < INDEX_MIN_ROWS and not force:
+        return "skipped"
+    if has_vector_index(table) and not force:
+        if changed:
+            table.optimize()
+            return "optimized"
+        return "unchanged"
+    dim = table.schema.field("vector").type.list_size
+    table.create_index(metric=INDEX_METRIC, index_type="IVF_PQ", replace=True, **_index_params(rows, dim))
+    return "created"
+
+def _quote(value: str) -> str:
+    return "'" + str(value).replace("'", "''") + "'"
+
+def build_where(filters: Optional[dict]) -> Optional[str]:
+    """فیلترهای metadata را به شرط SQL لنس تبدیل می‌کند (فقط فیلدهای مجاز)."""
+    if not filters:
+        return None
+    clauses = [f"metadata.{field} = {_quote(value)}" for field, value in filters.items() if field in FILTER_FIELDS and value]
+    return " AND ".join(clauses) or None
+
+
+class FoodRetriever(BaseRetriever):
+    """
+    بازیاب جدول food_rag با کنترل k، nprobes و refine_factor برای ایندکس ANN، آستانه امتیاز
+    و فیلترهای metadata که قبل از جستجوی برداری (prefilter) اعمال می‌شوند.
+    """
+
+    table: Any
+    embeddings: Any
+    k: int = DEFAULT_K
+    nprobes: int = DEFAULT_NPROBES
+    refine_factor: Optional[int] = DEFAULT_REFINE_FACTOR
+    score_threshold: Optional[float] = DEFAULT_SCORE_THRESHOLD
+    filters: Optional[dict] = None
+
+    def search(self, vector: List[float]) -> List[Document]:
+        query = self.table.search(vector).distance_type(INDEX_METRIC).limit(self.k).nprobes(self.nprobes)
+        if self.refine_factor:
+            query = query.refine_factor(self.refine_factor)
+        where = build_where(self.filters)
+        if where:
+            query = query.where(where, prefilter=True)
+        documents = []
+        for row in query.select(["text", "metadata"]).to_list():
+            # فاصله کسینوسی بین ۰ و ۲ است؛ امتیاز شباهت = ۱ - فاصله
+            score = 1.0 - row["_distance"]
+            if self.score_threshold is not None and score < self.score_threshold:
+                continue
+            documents.append(Document(page_content=row["text"], metadata={**(row.get("metadata") or {}), "score": score}))
+        return documents
+
+    def _get_relevant_documents(self, query: str, *, run_manager: CallbackManagerForRetrieverRun) -> List[Document]:
+        return self.search(self.embeddings.embed_query(query))
+
+    async def _aget_relevant_documents(self, query: str, *, run_manager: AsyncCallbackManagerForRetrieverRun) -> List[Document]:
+        # امبدینگ سوال بدون اشغال thread در batch مشترک سرویس امبدینگ منتظر می‌ماند.
+        vector = await self.embeddings.aembed_query(query)
+        return await asyncio.to_thread(self.search, vector)
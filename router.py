@@ -0,0 +1,171 @@
+import asyncio
+import re
+import threading
+import time
+
+import numpy as np
+
+from search_index import normalize_text
+
+DESTINATIONS = ('CartAgent', 'FilterAgent', 'OrderManager', 'FoodSearch', 'InformationAgent')
+
+# ==================== لایه ۱: قوانین کلیدواژه و regex ====================
+# قوانین روی متن نرمال شده اجرا می‌شوند (ارقام فارسی به لاتین، ي/ك به ی/ک).
+# ترتیب مهم است: اولین قانونی که تطبیق پیدا کند مقصد را تعیین می‌کند.
+_NUMBER = r'\d[\d,٬.]*'
+RULES = [
+    ('OrderManager', re.compile(rf'(سفارش|شماره سفارش|order)\s*(شماره\s*)?#?{_NUMBER}')),
+    ('OrderManager', re.compile(r'(لغو|کنسل|پیگیری|وضعیت)\s*(کردن\s*)?(سفارش|order)|سفارش\w*\s*(را\s*|رو\s*)?(لغو|کنسل|پیگیری)|سفارشم\s*(کجاست|چی شد)')),
+    ('CartAgent', re.compile(r'سبد\s*(خرید)?(م|ام)?\b|\bcart\b')),
+    ('FilterAgent', re.compile(rf'{_NUMBER}\s*(هزار\s*)?(تومان|تومن|ریال|هزار)|(زیر|کمتر از|ارزان\s*تر از|ارزونتر از|حداکثر|تا سقف|زیر قیمت)\s*{_NUMBER}')),
+    ('InformationAgent', re.compile(r'\b(چیست|چیه|چی هست)\b|طرز تهیه|دستور پخت|چطور (درست|پخته)|چگونه (درست|تهیه)|تاریخچه|کالری|فرق .+ (با|و) |what is')),
+]
+
+# ==================== استخراج آرگومان برای فراخوانی مستقیم ابزار ====================
+# وقتی آرگومان‌ها از خود پیام قابل استخراج باشند، ابزار بدون فراخوانی LLM ایجنت اجرا می‌شود.
+# فقط ابزارهای فقط-خواندنی؛ لغو سفارش همیشه از مسیر LLM می‌گذرد تا یک جمله‌ی مبهم سفارشی را لغو نکند.
+_ORDER_ID = re.compile(r'(?:سفارش|order)\s*(?:شماره\s*)?#?\s*(\d+)|#\s*(\d+)')
+_CANCEL = re.compile(r'لغو|کنسل|cancel')
+
+def extract_tool_call(text: str) -> dict | None:
+    """اگر پیام یک درخواست قطعی با آرگومان‌های مشخص باشد، {"name", "args"} ابزار را برمی‌گرداند."""
+    normalized = normalize_text(text)
+    match = _ORDER_ID.search(normalized)
+    if match and not _CANCEL.search(normalized):
+        return {"name": "get_order_status_tool", "args": {"order_id": int(match.group(1) or match.group(2))}}
+    return None
+
+# ==================== لایه ۲: مثال‌های برچسب‌دار برای دسته‌بند امبدینگ ====================
+ROUTE_EXAMPLES = {
+    'CartAgent': [
+        'سبد خریدم رو نشون بده', 'چی توی سبدمه', 'می‌خوام سبد خریدم رو ببینم', 'محتویات سبد', 'تا الان چیا انتخاب کردم',
+    ],
+    'FilterAgent': [
+        'پیتزا زیر ۲۰۰ هزار تومان', 'یه غذای ایرانی ارزون می‌خوام', 'فست فود با قیمت کمتر از ۱۵۰ هزار',
+        'غذای ایتالیایی که گرون نباشه', 'ارزان‌ترین برگر رو پیدا کن',
+    ],
+    'OrderManager': [
+        'سفارشم کی میرسه', 'وضعیت سفارش ۱۰۱', 'می‌خوام سفارشم رو لغو کنم', 'سفارشم هنوز نرسیده', 'سفارش قبلیم چی شد',
+    ],
+    'FoodSearch': [
+        'پیتزا دارید', 'منوی فست فود رو نشون بده', 'کباب می‌خوام', 'چه غذاهای ایرانی دارید', 'سالاد سزار هست',
+    ],
+    'InformationAgent': [
+        'کباب کوبیده چیست', 'پاستا از چی درست میشه', 'سس آلفردو چه سسی است', 'استیک مدیوم یعنی چی',
+        'غذای سالم برای رژیم چیه',
+    ],
+}
+
+EMBEDDING_MIN_SIMILARITY = 0.55
+EMBEDDING_MIN_MARGIN = 0.08
+# فقط مسیر LLM تاریخچه را می‌بیند و آن هم محدود به چند پیام آخر
+LLM_HISTORY_MESSAGES = 6
+
+
+class TieredRouter:
+    """
+    مسیریاب سه لایه: قوانین کلیدواژه/regex، سپس دسته‌بند شباهت امبدینگ روی مثال‌های برچسب‌دار،
+    و فقط اگر اطمینان هیچ‌کدام کافی نبود، فراخوانی LLM.
+    """
+
+    def __init__(self, llm_route, get_embeddings=None, examples: dict = None):
+        self._llm_route = llm_route
+        self._get_embeddings = get_embeddings
+        self._examples = examples or ROUTE_EXAMPLES
+        self._example_vectors = None
+        self._example_labels = None
+        self._embeddings_failed = False
+        self._lock = threading.Lock()
+        self._stats = {tier: {"hits": 0, "latency": 0.0} for tier in ("rules", "embedding", "llm")}
+        self._stats["total"] = 0
+
+    # --- لایه ۱ ---
+    def route_by_rules(self, text: str) -> str | None:
+        normalized = normalize_text(text)
+        for destination, pattern in RULES:
+            if pattern.search(normalized):
+                return destination
+        return None
+
+    # --- لایه ۲ ---
+    def _load_examples(self):
+        if self._example_vectors is None:
+            with self._lock:
+                if self._example_vectors is None:
+                    embeddings = self._get_embeddings()
+                    labels, texts = [], []
+                    for destination, utterances in self._examples.items():
+                        for utterance in utterances:
+                            labels.append(destination)
+                            texts.append(normalize_text(utterance))
+                    vectors = np.asarray(embeddings.embed_documents(texts), dtype=np.float32)
+                    self._example_labels = labels
+                    self._example_vectors = vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+        return self._example_vectors, self._example_labels
+
+    def warm(self):
+        """بردارهای مثال‌ها را از قبل می‌سازد تا اولین پیام کاربر هزینه آن را نپردازد."""
+        if self._get_embeddings is not None and not self._embeddings_failed:
+            self._load_examples()
+
+    def route_by_embedding(self, text: str) -> tuple[str | None, float]:
+        """بیشترین شباهت کسینوسی هر مقصد را حساب می‌کند؛ اگر برنده با فاصله کافی جلو نباشد None برمی‌گرداند."""
+        if self._get_embeddings is None or self._embeddings_failed:
+            return None, 0.0
+        try:
+            vectors, labels = self._load_examples()
+            query = np.asarray(self._get_embeddings().embed_query(normalize_text(text)), dtype=np.float32)
+        except Exception as e:
+            print(f"!!! دسته‌بند امبدینگ مسیریاب غیرفعال شد: {e}")
+            self._embeddings_failed = True
+            return None, 0.0
+        similarities = vectors @ (query / np.linalg.norm(query))
+        best = {}
+        for label, similarity in zip(labels, similarities):
+            best[label] = max(best.get(label, -1.0), float(similarity))
+        ranked = sorted(best.items(), key=lambda item: item[1], reverse=True)
+        (top, top_score), second_score = ranked[0], ranked[1][1] if len(ranked) > 1 else -1.0
+        if top_score >= EMBEDDING_MIN_SIMILARITY and top_score - second_score >= EMBEDDING_MIN_MARGIN:
+            return top, top_score
+        return None, top_score
+
+    # --- مسیریابی ---
+    def _record(self, tier: str, started: float):
+        with self._lock:
+            self._stats[tier]["hits"] += 1
+            self._stats[tier]["latency"] += time.perf_counter() - started
+            self._stats["total"] += 1
+
+    async def route(self, messages: list) -> tuple[str, str]:
+        """مقصد و نام لایه‌ای که تصمیم گرفته را برمی‌گرداند."""
+        text = messages[-1].content
+        started = time.perf_counter()
+        destination = self.route_by_rules(text)
+        if destination:
+            self._record("rules", started)
+            return destination, "rules"
+
+        started = time.perf_counter()
+        # مدل امبدینگ همگام و CPU-محور است؛ روی thread جدا اجرا می‌شود تا event loop آزاد بماند.
+        destination, _ = await asyncio.to_thread(self.route_by_embedding, text)
+        if destination:
+            self._record("embedding", started)
+            return destination, "embedding"
+
+        destination = await self._llm_route(messages[-LLM_HISTORY_MESSAGES - 1:])
+        self._record("llm", started)
+        return destination, "llm"
+
+    def stats(self) -> dict:
+        """نرخ اصابت و میانگین تاخیر هر لایه و تعداد فراخوانی‌های LLM صرفه‌جویی شده."""
+        with self._lock:
+            total = self._stats["total"]
+            report = {"total": total, "llm_calls_saved": total - self._stats["llm"]["hits"]}
+            for tier in ("rules", "embedding", "llm"):
+                hits = self._stats[tier]["hits"]
+                report[tier] = {
+                    "hits": hits,
+                    "hit_rate": hits / total if total else 0.0,
+                    "avg_latency": self._stats[tier]["latency"] / hits if hits else 0.0,
+                }
+        return report
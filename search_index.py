@@ -0,0 +1,408 @@
+import base64
+import hashlib
+import hmac
+import json
+import os
+import re
+import secrets
+import sqlite3
+import threading
+
+import database
+
+# ==================== نرمال‌ساز فارسی ====================
+# نویسه‌های عربی و گونه‌های املایی رایج به شکل استاندارد فارسی نگاشت می‌شوند.
+# همین جدول هم در پایتون (برای کوئری کاربر) و هم در SQL (داخل تریگرها) استفاده می‌شود
+# تا متن ایندکس شده و متن جستجو شده همیشه یکسان نرمال شوند.
+_CHAR_MAP = {
+    'ي': 'ی', 'ى': 'ی', 'ئ': 'ی',
+    'ك': 'ک',
+    'ة': 'ه', 'ۀ': 'ه',
+    'أ': 'ا', 'إ': 'ا', 'ٱ': 'ا',
+    'ؤ': 'و',
+    '\u200c': ' ',  # نیم‌فاصله (ZWNJ)
+    '\u200d': '',
+    '\u0640': '',  # کشیده
+}
+_CHAR_MAP.update({d: str(i) for i, d in enumerate('۰۱۲۳۴۵۶۷۸۹')})
+_CHAR_MAP.update({d: str(i) for i, d in enumerate('٠١٢٣٤٥٦٧٨٩')})
+# اعراب و تشدید حذف می‌شوند
+_CHAR_MAP.update({chr(c): '' for c in range(0x064B, 0x0653)})
+
+_TRANSLATION = str.maketrans(_CHAR_MAP)
+_TOKEN_RE = re.compile(r'\w+')
+_SPACES_RE = re.compile(r'\s+')
+
+FUZZY_THRESHOLD = 0.4
+FUZZY_SUGGESTIONS = 3
+SUBSTRING_MIN_RESULTS = 5
+
+
+def normalize_text(text: str) -> str:
+    """متن فارسی را برای جستجو نرمال می‌کند (ی/ي، ک/ك، نیم‌فاصله، ارقام فارسی و عربی، اعراب)."""
+    if not text:
+        return ""
+    return _SPACES_RE.sub(' ', str(text).translate(_TRANSLATION).lower()).strip()
+
+# پارسر SQLite بیش از حدود ۳۰ فراخوانی تو در تو را نمی‌پذیرد، پس زنجیره replace در چند
+# زیرکوئری پشت سر هم شکسته می‌شود.
+_SQL_CHUNK = 14
+
+def _sql_normalized_select(base_sql: str, keep: list, normalize: list) -> str:
+    """
+    معادل SQL تابع normalize_text برای استفاده در تریگرها (بدون وابستگی به تابع پایتونی ثبت شده).
+    ستون‌های normalize از خروجی base_sql نرمال و ستون‌های keep بدون تغییر عبور داده می‌شوند.
+    """
+    items = list(_CHAR_MAP.items())
+    sql = base_sql
+    for i in range(0, len(items), _SQL_CHUNK):
+        columns = list(keep)
+        for column in normalize:
+            expr = column
+            for source, target in items[i:i + _SQL_CHUNK]:
+                expr = f"replace({expr}, char({ord(source)}), '{target}')"
+            columns.append(f"{expr} AS {column}")
+        sql = f"SELECT {', '.join(columns)} FROM ({sql})"
+    return f"SELECT {', '.join(list(keep) + [f'lower({c}) AS {c}' for c in normalize])} FROM ({sql})"
+
+def _quote(token: str) -> str:
+    return '"' + token.replace('"', '""') + '"'
+
+def _trigrams(token: str, padded: bool = False) -> set:
+    if padded:
+        token = f"  {token} "
+    return {token[i:i + 3] for i in range(len(token) - 2)}
+
+# ==================== ساختار ایندکس ====================
+def _index_rows_sql(base_sql: str) -> str:
+    select = _sql_normalized_select(base_sql, ["rid"], ["name", "category"])
+    return (
+        f"INSERT INTO foods_fts (rowid, name, category) SELECT rid, name, category FROM ({select});\n"
+        f"INSERT INTO foods_trigram (rowid, name, category) SELECT rid, name, category FROM ({select});"
+    )
+
+def _add_category_sql(category_expr: str) -> str:
+    select = _sql_normalized_select(f"SELECT {category_expr} AS category, {category_expr} AS normalized", ["category"], ["normalized"])
+    return (
+        f"INSERT INTO food_categories (category, normalized, items) SELECT category, normalized, 1 FROM ({select}) WHERE true\n"
+        "    ON CONFLICT (category) DO UPDATE SET items = items + 1;"
+    )
+
+_NEW_ROW = "SELECT new.id AS rid, new.name AS name, new.category AS category"
+
+_SCHEMA = f"""
+CREATE INDEX IF NOT EXISTS idx_foods_category_price ON foods (category, price);
+CREATE VIRTUAL TABLE IF NOT EXISTS foods_fts USING fts5(name, category, tokenize='unicode61 remove_diacritics 2', prefix='2 3');
+CREATE VIRTUAL TABLE IF NOT EXISTS foods_trigram USING fts5(name, category, tokenize='trigram');
+CREATE VIRTUAL TABLE IF NOT EXISTS foods_vocab USING fts5vocab(foods_fts, 'row');
+CREATE TABLE IF NOT EXISTS food_categories (
+    category TEXT PRIMARY KEY,
+    normalized TEXT NOT NULL,
+    items INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_food_categories_normalized ON food_categories (normalized);
+
+CREATE TRIGGER IF NOT EXISTS foods_search_ai AFTER INSERT ON foods BEGIN
+    {_index_rows_sql(_NEW_ROW)}
+    {_add_category_sql('new.category')}
+END;
+
+CREATE TRIGGER IF NOT EXISTS foods_search_ad AFTER DELETE ON foods BEGIN
+    DELETE FROM foods_fts WHERE rowid = old.id;
+    DELETE FROM foods_trigram WHERE rowid = old.id;
+    UPDATE food_categories SET items = items - 1 WHERE category = old.category;
+    DELETE FROM food_categories WHERE category = old.category AND items <= 0;
+END;
+
+CREATE TRIGGER IF NOT EXISTS foods_search_au AFTER UPDATE OF name, category ON foods BEGIN
+    DELETE FROM foods_fts WHERE rowid = old.id;
+    DELETE FROM foods_trigram WHERE rowid = old.id;
+    {_index_rows_sql(_NEW_ROW)}
+    UPDATE food_categories SET items = items - 1 WHERE category = old.category;
+    DELETE FROM food_categories WHERE category = old.category AND items <= 0;
+    {_add_category_sql('new.category')}
+END;
+"""
+
+def ensure_search_index(conn: sqlite3.Connection):
+    """
+    ایندکس جستجو (جداول FTS5، جدول دسته‌بندی‌ها، ایندکس ترکیبی و تریگرها) را در صورت نبود می‌سازد
+    و بار اول آن را از روی جدول foods پر می‌کند. بعد از آن تریگرها ایندکس را همگام نگه می‌دارند.
+    """
+    exists = conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'foods_fts'").fetchone()
+    conn.executescript(_SCHEMA)
+    if not exists:
+        rebuild_search_index(conn)
+
+def rebuild_search_index(conn: sqlite3.Connection):
+    """محتوای ایندکس را کامل از روی foods بازسازی می‌کند (مثلاً بعد از بارگذاری انبوه با تریگرهای غیرفعال)."""
+    with conn:
+        conn.execute("DELETE FROM foods_fts")
+        conn.execute("DELETE FROM foods_trigram")
+        conn.execute("DELETE FROM food_categories")
+        for statement in _index_rows_sql("SELECT id AS rid, name, category FROM foods").splitlines():
+            conn.execute(statement)
+        select = _sql_normalized_select("SELECT category, category AS normalized, COUNT(*) AS items FROM foods GROUP BY category", ["category", "items"], ["normalized"])
+        conn.execute(f"INSERT INTO food_categories (category, normalized, items) SELECT category, normalized, items FROM ({select})")
+
+_ready = False
+_ready_lock = threading.Lock()
+
+def ensure_ready():
+    global _ready
+    if _ready:
+        return
+    with _ready_lock:
+        if not _ready:
+            with database.connection() as conn:
+                ensure_search_index(conn)
+            _ready = True
+
+# ==================== جستجو ====================
+# نتایج در چند مرحله با اولویت ثابت جمع می‌شوند: تطبیق کامل دسته‌بندی، تطبیق کلمه‌ای، تطبیق زیررشته‌ای و جستجوی تقریبی.
+# هر مرحله ردیف‌های مراحل قبلی را کنار می‌گذارد، پس صفحه‌بندی keyset روی هر مرحله بدون تکرار و بدون OFFSET کار می‌کند.
+PAGE_SIZE = 10
+SORTS = ("relevance", "price")
+_CURSOR_VERSION = 2
+_STAGE_NAMES = ("category", "word", "substring", "fuzzy")
+# cursor از payload کلاینت برمی‌گردد، پس امضا می‌شود. بدون CHATFOOD_CURSOR_SECRET کلید تصادفی است و بعد از
+# راه‌اندازی دوباره cursorهای قبلی نامعتبر می‌شوند (workerهای fork شده کلید والد را به ارث می‌برند).
+_CURSOR_SECRET = os.getenv("CHATFOOD_CURSOR_SECRET", "").encode("utf-8") or secrets.token_bytes(32)
+
+def _price_clause(max_price, params: list, column: str = "f.price") -> str:
+    if max_price is None:
+        return ""
+    params.append(max_price)
+    return f" AND {column} <= ?"
+
+def _in_clause(column: str, values: list, params: list, negate: bool = False) -> str:
+    if not values:
+        return ""
+    params.extend(values)
+    return f" AND {column} {'NOT IN' if negate else 'IN'} ({', '.join('?' * len(values))})"
+
+def _fts_query(groups: list, name_only: bool) -> str:
+    """هر گروه، گزینه‌های جایگزین یک کلمه است (OR) و گروه‌ها با AND به هم وصل می‌شوند."""
+    expr = " AND ".join("(" + " OR ".join(group) + ")" for group in groups)
+    return f"name : ({expr})" if name_only else expr
+
+def _category_stage(categories: list, max_price) -> tuple:
+    """وقتی کل عبارت جستجو یک دسته‌بندی است، نتایج از روی ایندکس (category, price) خوانده می‌شوند (ارزان‌ترها اول)."""
+    params = []
+    sql = "FROM foods f WHERE 1" + _in_clause("f.category", categories, params) + _price_clause(max_price, params)
+    return sql, params, "f.price"
+
+def _word_stage(groups: list, max_price, name_only: bool, categories: list) -> tuple:
+    """تطبیق کلمه‌ای و پیشوندی روی جدول unicode61؛ سریع‌ترین مسیر و پاسخ‌گوی بیشتر جستجوها (مرتب بر اساس bm25)."""
+    params = [_fts_query(groups, name_only)]
+    sql = "FROM foods_fts t JOIN foods f ON f.id = t.rowid WHERE foods_fts MATCH ?"
+    sql += _price_clause(max_price, params) + _in_clause("f.category", categories, params, negate=True)
+    return sql, params, "t.rank"
+
+def _substring_stage(tokens: list, max_price, word_groups: list, categories: list) -> tuple | None:
+    """
+    تطبیق زیررشته‌ای (معادل ایندکس شده LIKE '%q%'، مثلاً «برگر» در «چیزبرگر») روی جدول trigram.
+    کلمات کوتاه‌تر از سه حرف در trigram قابل جستجو نیستند و همچنان پیشوندی روی unicode61 تطبیق داده می‌شوند.
+    """
+    long_tokens = [t for t in tokens if len(t) >= 3]
+    short_tokens = [t for t in tokens if len(t) < 3]
+    if not long_tokens:
+        return None
+    params = [_fts_query([[_quote(t)] for t in long_tokens], False)]
+    sql = "FROM foods_trigram t JOIN foods f ON f.id = t.rowid WHERE foods_trigram MATCH ?"
+    if short_tokens:
+        sql += " AND f.id IN (SELECT rowid FROM foods_fts WHERE foods_fts MATCH ?)"
+        params.append(_fts_query([[_quote(t) + "*"] for t in short_tokens], False))
+    # ردیف‌هایی که مرحله‌ی کلمه‌ای پیدا کرده تکرار نمی‌شوند.
+    sql += " AND f.id NOT IN (SELECT rowid FROM foods_fts WHERE foods_fts MATCH ?)"
+    params.append(_fts_query(word_groups, False))
+    sql += _price_clause(max_price, params) + _in_clause("f.category", categories, params, negate=True)
+    return sql, params, "t.rank"
+
+def _similarity(a: str, b: str) -> float:
+    grams_a, grams_b = _trigrams(a, padded=True), _trigrams(b, padded=True)
+    return len(grams_a & grams_b) / len(grams_a | grams_b)
+
+def _corrections(conn, token: str) -> list:
+    """
+    نزدیک‌ترین کلمات واژگان ایندکس به یک کلمه غلط تایپی، بر اساس شباهت trigram.
+    فقط کلمات هم‌حرف اول بررسی می‌شوند تا به جای کل واژگان، یک بازه کوچک از جدول fts5vocab خوانده شود.
+    """
+    if len(token) < 3 or token.isdigit():
+        return []
+    terms = conn.execute(
+        "SELECT term FROM foods_vocab WHERE term >= ? AND term < ?",
+        (token[0], chr(ord(token[0]) + 1)),
+    ).fetchall()
+    scored = sorted(((_similarity(token, term), term) for (term,) in terms), reverse=True)
+    return [term for score, term in scored[:FUZZY_SUGGESTIONS] if score >= FUZZY_THRESHOLD]
+
+def _fuzzy_groups(conn, tokens: list) -> list | None:
+    """بازگشت برای غلط تایپی: هر کلمه با نزدیک‌ترین کلمات واژگان جایگزین می‌شود (None اگر اصلاحی پیدا نشد)."""
+    groups, corrected = [], False
+    for token in tokens:
+        suggestions = [t for t in _corrections(conn, token) if t != token]
+        corrected = corrected or bool(suggestions)
+        groups.append([_quote(token)] + [_quote(t) for t in suggestions])
+    return groups if corrected else None
+
+def _count(conn, stage: tuple) -> int:
+    sql, params, _ = stage
+    return conn.execute(f"SELECT COUNT(*) {sql}", params).fetchone()[0]
+
+def _stage_rows(conn, stage: tuple, order: str, after: tuple | None, limit: int | None) -> list:
+    """ردیف‌های (id, name, restaurant_name, price, key) یک مرحله بعد از کلید after، مرتب بر اساس (key, id)."""
+    sql, params, rank = stage
+    key = "f.price" if order == "price" else rank
+    params = list(params)
+    if after is not None:
+        sql += f" AND ({key} > ? OR ({key} = ? AND f.id > ?))"
+        params.extend([after[0], after[0], after[1]])
+    sql += f" ORDER BY {key}, f.id"
+    if limit is not None:
+        sql += " LIMIT ?"
+        params.append(limit)
+    return conn.execute(f"SELECT f.id, f.name, f.restaurant_name, f.price, {key} {sql}", params).fetchall()
+
+def _plan(conn, normalized: str, tokens: list, max_price) -> dict:
+    """مراحل فعال جستجو و تعداد کل نتایج؛ فقط برای صفحه‌ی اول محاسبه و در cursor نگه داشته می‌شود."""
+    categories = [row[0] for row in conn.execute("SELECT category FROM food_categories WHERE normalized = ?", (normalized,))]
+    plan = {"categories": categories, "stages": [], "total": 0}
+    counts = {}
+    if categories:
+        counts["category"] = _count(conn, _category_stage(categories, max_price))
+    # وقتی کل عبارت یک دسته‌بندی است، تطبیق متنی فقط روی نام‌ها لازم است.
+    plan["name_only"] = bool(counts.get("category"))
+    counts["word"] = _count(conn, _stages(plan, tokens, max_price)["word"])
+    found = sum(counts.values())
+    # تطبیق زیررشته‌ای (مثل LIKE قبلی، «برگر» در «چیزبرگر») وقتی اجرا می‌شود که تطبیق کلمه‌ای چیزی پیدا نکرده
+    # یا جستجوی تک‌کلمه‌ای نتایج کمی داشته باشد؛ برای نام‌های کامل چندکلمه‌ای هزینه آن بی‌فایده است.
+    if not found or (len(tokens) == 1 and found < SUBSTRING_MIN_RESULTS):
+        stage = _stages(plan, tokens, max_price).get("substring")
+        if stage is not None:
+            counts["substring"] = _count(conn, stage)
+    if not sum(counts.values()):
+        plan["fuzzy"] = _fuzzy_groups(conn, tokens)
+        if plan["fuzzy"]:
+            counts["fuzzy"] = _count(conn, _stages(plan, tokens, max_price)["fuzzy"])
+    plan["stages"] = [name for name, count in counts.items() if count]
+    plan["total"] = sum(counts.values())
+    return plan
+
+def _stages(plan: dict, tokens: list, max_price) -> dict:
+    # فقط آخرین کلمه پیشوندی جستجو می‌شود (کاربر ممکن است هنوز آن را کامل ننوشته باشد)؛
+    # بسط پیشوندی روی همه کلمات، تطبیق را چند برابر کندتر می‌کند.
+    groups = [[_quote(t)] for t in tokens[:-1]] + [[_quote(tokens[-1]) + "*"]]
+    name_only, categories = plan["name_only"], plan["categories"] if plan["name_only"] else []
+    stages = {"word": _word_stage(groups, max_price, name_only, categories)}
+    if plan["categories"]:
+        stages["category"] = _category_stage(plan["categories"], max_price)
+    substring = _substring_stage(tokens, max_price, groups, categories)
+    if substring is not None:
+        stages["substring"] = substring
+    if plan.get("fuzzy"):
+        stages["fuzzy"] = _word_stage(plan["fuzzy"], max_price, False, [])
+    return stages
+
+def _fingerprint(normalized: str, max_price, sort: str) -> str:
+    return hashlib.sha256(json.dumps([normalized, max_price, sort], ensure_ascii=False).encode("utf-8")).hexdigest()[:16]
+
+def _signature(payload: bytes) -> str:
+    digest = hmac.new(_CURSOR_SECRET, payload, hashlib.sha256).digest()[:16]
+    return base64.urlsafe_b64encode(digest).decode("ascii").rstrip("=")
+
+def _is_str_list(value) -> bool:
+    return isinstance(value, list) and all(isinstance(item, str) for item in value)
+
+def _is_key(value) -> bool:
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+def _validate_cursor(state) -> dict:
+    """شکل state را بررسی می‌کند تا search_page فقط با plan و موقعیت معتبر اجرا شود."""
+    plan = state.get("plan") if isinstance(state, dict) else None
+    valid = (
+        isinstance(plan, dict) and state.get("v") == _CURSOR_VERSION and isinstance(state.get("f"), str)
+        and _is_str_list(plan.get("stages")) and set(plan["stages"]) <= set(_STAGE_NAMES)
+        and isinstance(plan.get("name_only"), bool)
+        and _is_str_list(plan.get("categories"))
+        and (plan.get("fuzzy") is None or (isinstance(plan["fuzzy"], list) and all(_is_str_list(g) and g for g in plan["fuzzy"])))
+        and isinstance(plan.get("total"), int) and not isinstance(plan["total"], bool)
+        and isinstance(state.get("stage"), int) and not isinstance(state["stage"], bool)
+        and 0 <= state["stage"] < len(plan["stages"])
+        and isinstance(state.get("after"), list) and len(state["after"]) == 2
+        and _is_key(state["after"][0]) and _is_key(state["after"][1])
+    )
+    if not valid:
+        raise ValueError("cursor نامعتبر است.")
+    return state
+
+def encode_cursor(state: dict) -> str:
+    payload = base64.urlsafe_b64encode(json.dumps(state, ensure_ascii=False).encode("utf-8"))
+    return f"{payload.decode('ascii')}.{_signature(payload)}"
+
+def decode_cursor(cursor: str) -> dict:
+    """cursor امضا شده را باز می‌کند؛ امضای نادرست یا state ناقص ValueError می‌دهد."""
+    if not isinstance(cursor, str) or cursor.count(".") != 1:
+        raise ValueError("cursor نامعتبر است.")
+    payload, signature = cursor.split(".")
+    try:
+        payload = payload.encode("ascii")
+        if not hmac.compare_digest(signature.encode("ascii"), _signature(payload).encode("ascii")):
+            raise ValueError("امضای cursor درست نیست.")
+        state = json.loads(base64.urlsafe_b64decode(payload))
+    except (ValueError, UnicodeError) as e:
+        raise ValueError(f"cursor نامعتبر است: {e}") from e
+    return _validate_cursor(state)
+
+def search_page(query: str, max_price: float = None, limit: int | None = PAGE_SIZE, cursor: str = None, sort: str = "relevance") -> dict:
+    """
+    یک صفحه از نتایج جستجوی غذا: {"rows": [(name, restaurant_name, price)], "total", "next_cursor"}.
+    sort="relevance": به ترتیب مراحل (دسته‌بندی، کلمه‌ای، زیررشته‌ای، تقریبی) و امتیاز bm25 هر مرحله؛
+    sort="price": ارزان‌ترین‌ها اول. صفحه‌ی بعد با next_cursor همان جستجو (همان query، max_price و sort) خوانده
+    می‌شود؛ صفحه‌بندی keyset است و هزینه‌ی هر صفحه به شماره‌ی صفحه بستگی ندارد. limit=None یعنی همه‌ی نتایج.
+    """
+    if sort not in SORTS:
+        raise ValueError(f"ترتیب نامعتبر: {sort} (گزینه‌ها: {', '.join(SORTS)})")
+    ensure_ready()
+    normalized = normalize_text(query)
+    tokens = _TOKEN_RE.findall(normalized)
+    if not tokens:
+        return {"rows": [], "total": 0, "next_cursor": None}
+    fingerprint = _fingerprint(normalized, max_price, sort)
+    state = decode_cursor(cursor) if cursor else None
+    if state is not None and state.get("f") != fingerprint:
+        raise ValueError("cursor متعلق به جستجوی دیگری است.")
+    fetch = None if limit is None else limit + 1
+    with database.connection(read_only=True) as conn:
+        plan = state["plan"] if state else _plan(conn, normalized, tokens, max_price)
+        stages = _stages(plan, tokens, max_price)
+        if any(name not in stages for name in plan["stages"]):
+            raise ValueError("cursor متعلق به جستجوی دیگری است.")
+        active = [(index, name) for index, name in enumerate(plan["stages"])]
+        rows = []
+        if sort == "price":
+            # همه‌ی مراحل با کلید (price, id) خوانده و ادغام می‌شوند؛ مراحل هم‌پوشانی ندارند.
+            after = tuple(state["after"]) if state else None
+            for index, name in active:
+                rows.extend((row[3], row[0], index, row) for row in _stage_rows(conn, stages[name], "price", after, fetch))
+            rows = [item[2:] for item in sorted(rows)[:fetch]]
+        else:
+            start, after = (state["stage"], tuple(state["after"])) if state else (0, None)
+            for index, name in active[start:]:
+                remaining = None if fetch is None else fetch - len(rows)
+                if remaining == 0:
+                    break
+                rows.extend((index, row) for row in _stage_rows(conn, stages[name], "relevance", after if index == start else None, remaining))
+    next_cursor = None
+    if limit is not None and len(rows) > limit:
+        rows = rows[:limit]
+        index, last = rows[-1]
+        next_cursor = encode_cursor({"v": _CURSOR_VERSION, "f": fingerprint, "plan": plan, "stage": index, "after": [last[4], last[0]]})
+    return {"rows": [row[1:4] for _, row in rows], "total": plan["total"], "next_cursor": next_cursor}
+
+def search(query: str, max_price: float = None, limit: int | None = None) -> list:
+    """
+    غذاها را بر اساس نام یا دسته‌بندی جستجو می‌کند و لیستی از (name, restaurant_name, price) برمی‌گرداند (به ترتیب
+    search_page با sort="relevance"). بدون limit همه‌ی نتایج؛ برای نمایش صفحه‌ای از search_page استفاده کنید.
+    """
+    return search_page(query, max_price, limit=limit)["rows"]
@@ -0,0 +1,170 @@
+import os
+import pickle
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+import numpy as np
+
+# فایل نشانگر به‌روزرسانی پایگاه دانش؛ setup_rag.py بعد از بازسازی جدول food_rag آن را لمس می‌کند
+# و هر cache که نسخه قدیمی‌تری دیده باشد خود را خالی می‌کند (حتی در پروسه‌های دیگر).
+KB_STAMP_PATH = os.path.join("db", "food_rag.stamp")
+
+SIMILARITY_THRESHOLD = 0.92
+MAX_ENTRIES = 512
+TTL_SECONDS = 6 * 3600
+# در اجرای چند worker، ورودی‌های ذخیره شده توسط workerهای دیگر حداکثر با این تاخیر (ثانیه) دیده می‌شوند.
+SHARED_SYNC_INTERVAL = 1.0
+
+
+def mark_knowledge_base_updated(stamp_path: str = KB_STAMP_PATH):
+    """نسخه پایگاه دانش را عوض می‌کند تا همه cacheهای معنایی پاسخ‌های قبلی را دور بریزند."""
+    os.makedirs(os.path.dirname(stamp_path) or ".", exist_ok=True)
+    with open(stamp_path, "w", encoding="utf-8") as f:
+        f.write(str(time.time_ns()))
+
+def _read_stamp(stamp_path: str) -> str | None:
+    try:
+        with open(stamp_path, encoding="utf-8") as f:
+            return f.read().strip()
+    except OSError:
+        return None
+
+
+class SemanticCache:
+    """
+    cache پاسخ نهایی و اسناد بازیابی شده بر اساس امبدینگ سوال.
+    سوالی که شباهت کسینوسی آن با یک سوال ذخیره شده از آستانه بیشتر باشد، همان پاسخ را بدون LLM یا شبکه می‌گیرد.
+    اگر backend مشترک (state_backend) داده شود، ورودی‌ها در آن هم نوشته می‌شوند و هر worker ورودی‌های
+    بقیه را به ماتریس محلی خودش اضافه می‌کند؛ جستجوی شباهت همیشه محلی است.
+    """
+
+    def __init__(self, threshold: float = SIMILARITY_THRESHOLD, max_entries: int = MAX_ENTRIES,
+                 ttl: float = TTL_SECONDS, stamp_path: str = KB_STAMP_PATH, backend=None):
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.stamp_path = stamp_path
+        self._entries = OrderedDict()  # key -> {"vector", "query", "answer", "documents", "created"}
+        self._matrix = None
+        self._keys = []
+        self.backend = backend
+        self._last_sync = 0.0
+        self._synced = set()  # کلیدهای ایندکس مشترک که قبلاً خوانده شده‌اند (حتی اگر بعداً از cache محلی بیرون رفته باشند)
+        self._stamp = _read_stamp(stamp_path)
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0, "evictions": 0, "expirations": 0, "invalidations": 0}
+
+    def _check_stamp(self):
+        stamp = _read_stamp(self.stamp_path)
+        if stamp != self._stamp:
+            self._stamp = stamp
+            if self._entries:
+                self._entries.clear()
+                self._matrix = None
+                self._stats["invalidations"] += 1
+
+    def _shared_prefix(self) -> str:
+        # نسخه‌ی پایگاه دانش بخشی از کلید است؛ ورودی‌های نسخه‌ی قبلی دیگر خوانده نمی‌شوند و با TTL پاک می‌شوند.
+        return f"semantic_cache:{self._stamp or ''}:"
+
+    def _shared_index(self) -> str:
+        # ایندکس کلید ورودی‌ها (امتیاز: زمان ساخت)؛ همگام‌سازی فقط همین ایندکس و ورودی‌های تازه را می‌خواند.
+        return f"semantic_cache_index:{self._stamp or ''}"
+
+    def _sync(self):
+        if self.backend is None or time.time() - self._last_sync < SHARED_SYNC_INTERVAL:
+            return
+        self._last_sync = time.time()
+        prefix, index = self._shared_prefix(), self._shared_index()
+        try:
+            self.backend.index_trim(index, self._last_sync - self.ttl)
+            members = set(self.backend.index_members(index))
+            self._synced &= members
+            new = [key for key in members - self._synced if key not in self._entries]
+            for key, saved in zip(new, self.backend.get_many([prefix + key for key in new])):
+                self._synced.add(key)
+                if saved is not None:
+                    self._entries[key] = pickle.loads(saved)
+                    self._matrix = None
+        except Exception as e:
+            print(f"!!! خطا در همگام‌سازی cache معنایی مشترک: {e}")
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def _drop(self, key):
+        del self._entries[key]
+        self._matrix = None
+
+    def _index(self):
+        # ماتریس بردارها فقط بعد از تغییر در ورودی‌ها دوباره ساخته می‌شود.
+        if self._matrix is None:
+            self._keys = list(self._entries)
+            self._matrix = np.stack([self._entries[k]["vector"] for k in self._keys]) if self._keys else None
+        return self._matrix, self._keys
+
+    @staticmethod
+    def _normalize(vector) -> np.ndarray:
+        vector = np.asarray(vector, dtype=np.float32)
+        return vector / (np.linalg.norm(vector) or 1.0)
+
+    def lookup(self, vector) -> dict | None:
+        """نزدیک‌ترین ورودی را اگر بالای آستانه و منقضی نشده باشد برمی‌گرداند (به همراه similarity)."""
+        query = self._normalize(vector)
+        with self._lock:
+            self._check_stamp()
+            self._sync()
+            now = time.time()
+            for key in [k for k, e in self._entries.items() if now - e["created"] > self.ttl]:
+                self._drop(key)
+                self._stats["expirations"] += 1
+            matrix, keys = self._index()
+            if matrix is None:
+                self._stats["misses"] += 1
+                return None
+            similarities = matrix @ query
+            best = int(np.argmax(similarities))
+            if similarities[best] < self.threshold:
+                self._stats["misses"] += 1
+                return None
+            key = keys[best]
+            self._entries.move_to_end(key)
+            self._stats["hits"] += 1
+            entry = self._entries[key]
+            return {"query": entry["query"], "answer": entry["answer"], "documents": list(entry["documents"]), "similarity": float(similarities[best])}
+
+    def store(self, vector, query: str, answer: str, documents: list):
+        with self._lock:
+            self._check_stamp()
+            key = uuid.uuid4().hex
+            entry = {
+                "vector": self._normalize(vector), "query": query, "answer": answer,
+                "documents": list(documents), "created": time.time(),
+            }
+            self._entries[key] = entry
+            self._matrix = None
+            if self.backend is not None:
+                try:
+                    self.backend.set(self._shared_prefix() + key, pickle.dumps(entry), ttl=self.ttl)
+                    self.backend.index_add(self._shared_index(), {key: entry["created"]}, ttl=self.ttl)
+                    self._synced.add(key)
+                except Exception as e:
+                    print(f"!!! خطا در نوشتن cache معنایی مشترک: {e}")
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self._stats["evictions"] += 1
+
+    def invalidate(self):
+        with self._lock:
+            self._entries.clear()
+            self._matrix = None
+            self._stats["invalidations"] += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            stats = dict(self._stats)
+            stats["size"] = len(self._entries)
+            lookups = stats["hits"] + stats["misses"]
+            stats["hit_rate"] = stats["hits"] / lookups if lookups else 0.0
+        return stats
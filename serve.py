@@ -0,0 +1,129 @@
+"""
+اجرای چند worker برنامه، هر worker روی پورت خودش (--port + شماره‌ی worker).
+
+پروسه‌ی اصلی مدل امبدینگ را یک بار بارگذاری می‌کند و سپس workerها را fork می‌کند؛ وزن‌های مدل به صورت
+copy-on-write بین همه‌ی workerها مشترک می‌مانند. هر worker اپ Chainlit خودش را روی سوکت خودش اجرا می‌کند.
+تاریخچه‌ی گفتگو، cache معنایی و سبد خرید باید روی backend مشترک باشند (state_backend و chatfood.db):
+
+    CHATFOOD_STATE_BACKEND=sqlite python serve.py --workers 4 --port 8000    # پورت‌های 8000 تا 8003
+
+با CHATFOOD_METRICS_PORT=9100 هر worker متریک‌های خودش را روی پورت 9100 + شماره‌ی worker منتشر می‌کند
+(9100، 9101، ...) و Prometheus باید همه را scrape کند.
+
+درخواست‌های polling و upgrade هر اتصال socket.io باید به همان worker برسند، پس workerها سوکت مشترک ندارند
+و load balancer آن‌ها را به عنوان upstreamهای جدا با sticky session می‌بیند، مثلا در nginx:
+
+    upstream chatfood {
+        ip_hash;
+        server 127.0.0.1:8000;
+        server 127.0.0.1:8001;
+        server 127.0.0.1:8002;
+        server 127.0.0.1:8003;
+    }
+
+backend مشترک باعث می‌شود بعد از اتصال دوباره به worker دیگر هم تاریخچه و سبد خرید همان باشد.
+"""
+import argparse
+import gc
+import os
+import signal
+import socket
+import sys
+import time
+
+os.environ.setdefault("TOKENIZERS_PARALLELISM", "false")
+
+WORKERS = int(os.getenv("CHATFOOD_WORKERS", "2"))
+MOUNT_PATH = os.getenv("CHATFOOD_MOUNT_PATH", "/chainlit")
+
+
+def preload():
+    """کارهایی که قبل از fork و فقط یک بار انجام می‌شوند؛ هیچ اتصال یا threadی نباید اینجا ساخته شود."""
+    import main
+    # فقط وزن‌ها؛ اجرای مدل (و thread pool مربوط به torch) در هر worker و بعد از fork انجام می‌شود.
+    main.get_embedding_model().load()
+    # اشیای بارگذاری شده از GC خارج می‌شوند تا شمارش مرجع‌ها صفحه‌های مشترک را کپی نکند.
+    gc.freeze()
+
+
+def create_app():
+    from fastapi import FastAPI
+    from chainlit.utils import mount_chainlit
+
+    app = FastAPI()
+    mount_chainlit(app=app, target=os.path.join(os.path.dirname(os.path.abspath(__file__)), "app.py"), path=MOUNT_PATH)
+    return app
+
+
+def run_worker(sock: socket.socket):
+    import uvicorn
+
+    server = uvicorn.Server(uvicorn.Config(create_app(), log_level="info"))
+    server.run(sockets=[sock])
+
+
+def listen(host: str, port: int) -> socket.socket:
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(2048)
+    sock.set_inheritable(True)
+    return sock
+
+
+def spawn(sock: socket.socket, index: int) -> int:
+    pid = os.fork()
+    if pid == 0:
+        try:
+            # telemetry.start_metrics_server در app.py پورت متریک‌ها را از شماره‌ی worker می‌سازد.
+            os.environ["CHATFOOD_WORKER_INDEX"] = str(index)
+            run_worker(sock)
+        finally:
+            os._exit(0)
+    return pid
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", type=int, default=WORKERS)
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8000)
+    args = parser.parse_args()
+
+    import state_backend
+    if args.workers > 1 and state_backend.STATE_BACKEND == "memory":
+        print("!!! با CHATFOOD_STATE_BACKEND=memory تاریخچه‌ی گفتگو و cache معنایی بین workerها مشترک نیست.")
+
+    # سوکت‌ها قبل از پیش‌بارگذاری ساخته می‌شوند تا پورت اشغال شده زود گزارش شود؛ worker دوباره ساخته شده همان سوکت را می‌گیرد.
+    sockets = [listen(args.host, args.port + index) for index in range(args.workers)]
+
+    started = time.perf_counter()
+    preload()
+    print(f"✅ پیش‌بارگذاری در {time.perf_counter() - started:.2f}s؛ اجرای {args.workers} worker روی "
+          f"{args.host}:{args.port}-{args.port + args.workers - 1}{MOUNT_PATH}")
+    workers = {spawn(sockets[index], index): index for index in range(args.workers)}
+
+    stopping = False
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+        for pid in workers:
+            os.kill(pid, signal.SIGTERM)
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    # workerی که از کار بیفتد دوباره ساخته می‌شود.
+    while workers:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+        index = workers.pop(pid, None)
+        if not stopping and index is not None:
+            print(f"!!! worker {pid} با وضعیت {status} متوقف شد؛ راه‌اندازی دوباره.")
+            workers[spawn(sockets[index], index)] = index
+    sys.exit(0)
+
+
+if __name__ == "__main__":
+    main()
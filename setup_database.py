@@ -1,63 +1,48 @@
 import sqlite3
 import os
 
+from migrations import migrate
+from search_index import ensure_search_index
+from recommendations import ensure_recommendation_tables
+from cart_store import ensure_cart_tables
+from importer import import_files
+
 # مسیر دیتابیس را مشخص می‌کنیم
 DB_DIR = "db"
 DB_PATH = os.path.join(DB_DIR, "chatfood.db")
+SAMPLE_FOODS = "sample_foods.csv"
 
 def create_database():
     """
-    ساختار پایگاه داده را ایجاد کرده و جدول غذاها (foods) را با داده‌های اولیه پر می‌کند.
-    این اسکریپت باید فقط یک بار در ابتدا اجرا شود.
+    ساختار پایگاه داده را ایجاد کرده و جدول غذاها (foods) را با داده‌های نمونه‌ی sample_foods.csv پر می‌کند.
+    اجرای دوباره‌ی آن بی‌خطر است.
     """
     # اطمینان حاصل می‌کنیم که پوشه db وجود دارد
     os.makedirs(DB_DIR, exist_ok=True)
     
     conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
 
-    # ۱. ساخت جدول غذاها (foods)
-    cursor.execute('''
-    CREATE TABLE IF NOT EXISTS foods (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        name TEXT NOT NULL UNIQUE,
-        category TEXT NOT NULL,
-        restaurant_name TEXT NOT NULL,
-        price REAL NOT NULL
-    )
-    ''')
+    # ۱. ساخت جدول‌ها و مهاجرت‌های ساختار (زمان سفارش‌ها، ایندکس‌های orders، تاریخچه‌ی تجمیع شده و رستوران‌ها)
+    migrate(conn)
+
+    # ۲. ساخت ایندکس جستجوی متنی (FTS5) و ایندکس ترکیبی (category, price)
+    ensure_search_index(conn)
+    print("✅ ایندکس جستجوی منو ایجاد/بررسی شد.")
+
+    # ۳. جدول‌های پیشنهادها؛ برای پر کردن آن‌ها `python recommendations.py` را اجرا کنید.
+    ensure_recommendation_tables(conn)
 
-    # ۲. ساخت جدول سفارش‌ها (orders)
-    cursor.execute('''
-    CREATE TABLE IF NOT EXISTS orders (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        user_id TEXT NOT NULL,
-        food_name TEXT NOT NULL,
-        status TEXT NOT NULL,
-        review TEXT
-    )
-    ''')
+    # ۴. جدول‌های سبد خرید و ثبت سفارش (مشترک بین همه‌ی workerهای برنامه)
+    ensure_cart_tables(conn)
 
-    # ۳. پر کردن جدول غذاها فقط در صورتی که خالی باشد
-    cursor.execute("SELECT COUNT(*) FROM foods")
-    if cursor.fetchone()[0] == 0:
-        sample_foods = [
-            ('پیتزا پپرونی', 'فست فود', 'پیتزا هات', 150000),
-            ('چیزبرگر', 'فست فود', 'برگرلند', 120000),
-            ('جوجه کباب', 'ایرانی', 'رستوران اصیل', 180000),
-            ('پاستا آلفردو', 'ایتالیایی', 'کافه روما', 200000),
-            # غذاهای جدید که با لیست پیشنهادهای ویژه هماهنگ هستند
-            ('کباب بختیاری', 'ایرانی', 'رستوران اصیل', 250000),
-            ('سالاد سزار', 'پیش غذا', 'کافه روما', 110000),
-            ('برگر ذغالی', 'فست فود', 'برگرلند', 160000)
-        ]
-        cursor.executemany("INSERT INTO foods (name, category, restaurant_name, price) VALUES (?, ?, ?, ?)", sample_foods)
-        print("✅ جدول 'foods' با ۷ غذای نمونه با موفقیت پر شد.")
+    # ۵. پر کردن جدول غذاها از فایل نمونه فقط در صورتی که خالی باشد؛ منوی واقعی با `python importer.py foods` وارد می‌شود.
+    empty = conn.execute("SELECT COUNT(*) FROM foods").fetchone()[0] == 0
+    conn.close()
+    if empty:
+        import_files("foods", [SAMPLE_FOODS], DB_PATH)
     else:
         print("ℹ️ جدول 'foods' از قبل دارای داده بود. تغییری ایجاد نشد.")
 
-    conn.commit()
-    conn.close()
     print(f"✅ پایگاه داده با موفقیت در مسیر '{DB_PATH}' ایجاد/بررسی شد.")
 
 if __name__ == '__main__':
@@ -1,36 +1,168 @@
 import os
+import time
+import json
+import hashlib
+import argparse
 import lancedb
-from langchain_community.document_loaders import TextLoader
 from langchain.text_splitter import RecursiveCharacterTextSplitter
-from langchain_community.vectorstores import LanceDB
-from langchain_huggingface import HuggingFaceEmbeddings  # نسخه‌ی جدید و توصیه‌شده
+from embedding_service import get_embedding_service
+from semantic_cache import mark_knowledge_base_updated
+from retrieval import build_vector_index, TABLE_NAME
 
-def setup_vector_database():
-    # ۱. بارگذاری اسناد
-    loader = TextLoader('food_knowledge.txt', encoding='utf-8')
-    documents = loader.load()
+DEFAULT_SOURCES = ['food_knowledge.txt']
+SOURCE_EXTENSIONS = ('.txt', '.md')
+# فیلدهای metadata هر قطعه؛ ساختار struct جدول LanceDB ثابت است، پس همه قطعه‌ها همه فیلدها را دارند.
+METADATA_FIELDS = ('source', 'category', 'restaurant')
+DEFAULT_BATCH_SIZE = 64
 
-    # ۲. تقسیم اسناد به قطعات کوچکتر (chunks)
-    text_splitter = RecursiveCharacterTextSplitter(chunk_size=500, chunk_overlap=50)
-    docs = text_splitter.split_documents(documents)
 
-    # ۳. انتخاب مدل امبدینگ (متن → وکتور)
-    model_name = "sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2"
-    embeddings = HuggingFaceEmbeddings(model_name=model_name)
+def iter_source_files(paths: list):
+    """فایل‌های متنی را از مسیرهای داده شده (فایل یا پوشه، به صورت بازگشتی) یکی یکی برمی‌گرداند."""
+    for path in paths:
+        if os.path.isdir(path):
+            for root, _, files in os.walk(path):
+                for name in sorted(files):
+                    if name.endswith(SOURCE_EXTENSIONS):
+                        yield os.path.join(root, name)
+        elif os.path.isfile(path):
+            yield path
+
+def parse_front_matter(text: str) -> tuple[dict, str]:
+    """
+    بلوک اختیاری ابتدای فایل را برای metadata می‌خواند، مثلاً:
+    ---
+    category: ایرانی
+    restaurant: رستوران اصیل
+    ---
+    """
+    if not text.startswith('---'):
+        return {}, text
+    header, sep, body = text[3:].partition('\n---')
+    if not sep:
+        return {}, text
+    metadata = {}
+    for line in header.strip().splitlines():
+        key, _, value = line.partition(':')
+        if key.strip() in METADATA_FIELDS:
+            metadata[key.strip()] = value.strip()
+    return metadata, body.lstrip('\n')
+
+def chunk_id(metadata: dict, text: str) -> str:
+    # metadata (شامل source) هم بخشی از شناسه است تا تغییر فقط front matter هم قطعه را به‌روز کند.
+    return hashlib.sha256(f"{json.dumps(metadata, sort_keys=True, ensure_ascii=False)}\n{text}".encode('utf-8')).hexdigest()
+
+def iter_chunks(paths: list, splitter):
+    """قطعه‌ها را فایل به فایل تولید می‌کند تا کل مجموعه هیچ‌وقت یکجا در حافظه نباشد."""
+    for path in iter_source_files(paths):
+        with open(path, encoding='utf-8') as f:
+            metadata, body = parse_front_matter(f.read())
+        source = os.path.relpath(path)
+        metadata = {field: metadata.get(field, '') for field in METADATA_FIELDS}
+        metadata['source'] = source
+        for text in splitter.split_text(body):
+            yield {"id": chunk_id(metadata, text), "text": text, "metadata": dict(metadata)}
+
+def _open_table(connection):
+    if TABLE_NAME not in connection.table_names():
+        return None
+    table = connection.open_table(TABLE_NAME)
+    metadata_type = table.schema.field('metadata').type if 'metadata' in table.schema.names else None
+    fields = [metadata_type.field(i).name for i in range(metadata_type.num_fields)] if metadata_type is not None and hasattr(metadata_type, 'num_fields') else []
+    if sorted(fields) != sorted(METADATA_FIELDS):
+        # جدول با ساختار قدیمی (LanceDB.from_documents) ساخته شده؛ یک بار کامل بازسازی می‌شود.
+        print(f"ℹ️ ساختار جدول '{TABLE_NAME}' قدیمی است و از نو ساخته می‌شود.")
+        connection.drop_table(TABLE_NAME)
+        return None
+    return table
+
+def _under(source: str, roots: list) -> bool:
+    return any(source == root or source.startswith(root.rstrip(os.sep) + os.sep) for root in roots)
+
+def setup_vector_database(sources: list = None, batch_size: int = DEFAULT_BATCH_SIZE, db_path: str = None, force_index: bool = False):
+    """
+    پایگاه دانش را به صورت افزایشی به‌روز می‌کند: فقط قطعه‌های جدید یا تغییر یافته امبد می‌شوند،
+    قطعه‌هایی که دیگر در منابع نیستند حذف می‌شوند و جدول هیچ‌وقت از صفر ساخته نمی‌شود.
+    """
+    sources = sources or DEFAULT_SOURCES
+    roots = [os.path.relpath(path) for path in sources]
 
-    # ۴. تعیین مسیر دیتابیس داخل پروژه
-    db_path = os.path.join(os.getcwd(), "db")  # پوشه "db" در پروژه
+    # ۱. اتصال به پایگاه داده وکتوری داخل پروژه و خواندن شناسه قطعه‌های موجود
+    db_path = db_path or os.path.join(os.getcwd(), "db")
     connection = lancedb.connect(db_path)
+    table = _open_table(connection)
+    existing = {}
+    if table is not None:
+        for row in table.search().select(["id", "metadata"]).limit(None).to_list():
+            existing[row["id"]] = row["metadata"]["source"]
+
+    # ۲. تقسیم اسناد به قطعه‌ها و امبد کردن دسته‌ای قطعه‌های جدید
+    text_splitter = RecursiveCharacterTextSplitter(chunk_size=500, chunk_overlap=50)
+    embeddings = None
+    seen, pending = set(), []
+    stats = {"embedded": 0, "skipped": 0, "deleted": 0}
+    embed_time = 0.0
+    started = time.perf_counter()
+
+    def flush():
+        nonlocal table, embeddings, embed_time
+        if not pending:
+            return
+        if embeddings is None:
+            # همان سرویس برنامه: مدل فقط وقتی بارگذاری می‌شود که قطعه‌ای در cache امبدینگ نباشد.
+            embeddings = get_embedding_service()
+        batch_started = time.perf_counter()
+        vectors = embeddings.embed_documents([chunk["text"] for chunk in pending])
+        embed_time += time.perf_counter() - batch_started
+        rows = [{"vector": vector, **chunk} for vector, chunk in zip(vectors, pending)]
+        if table is None:
+            table = connection.create_table(TABLE_NAME, data=rows)
+        else:
+            table.merge_insert("id").when_matched_update_all().when_not_matched_insert_all().execute(rows)
+        stats["embedded"] += len(rows)
+        pending.clear()
+
+    for chunk in iter_chunks(sources, text_splitter):
+        if chunk["id"] in seen:
+            continue
+        seen.add(chunk["id"])
+        if chunk["id"] in existing:
+            stats["skipped"] += 1
+            continue
+        pending.append(chunk)
+        if len(pending) >= batch_size:
+            flush()
+    flush()
+
+    # ۳. حذف قطعه‌هایی از همین منابع که دیگر وجود ندارند یا تغییر کرده‌اند
+    stale = [row_id for row_id, source in existing.items() if row_id not in seen and _under(source, roots)]
+    for i in range(0, len(stale), 500):
+        ids = ", ".join(f"'{row_id}'" for row_id in stale[i:i + 500])
+        table.delete(f"id IN ({ids})")
+    stats["deleted"] = len(stale)
+
+    # ۴. ساخت یا به‌روزرسانی ایندکس ANN وقتی جدول به اندازه کافی بزرگ شده باشد
+    changed = bool(stats["embedded"] or stats["deleted"])
+    if table is not None:
+        index_started = time.perf_counter()
+        index_status = build_vector_index(table, changed=changed, force=force_index)
+        if index_status in ("created", "optimized"):
+            print(f"✅ ایندکس برداری ({index_status}) در {time.perf_counter() - index_started:.2f}s")
+
+    # ۵. باطل کردن پاسخ‌های ذخیره شده در cache معنایی ایجنت اطلاعات
+    if changed:
+        mark_knowledge_base_updated()
 
-    # ۵. ساخت پایگاه داده وکتوری
-    LanceDB.from_documents(
-        docs,
-        embeddings,
-        connection=connection,
-        table_name="food_rag"
-    )
-    
-    print(f"✅ پایگاه داده وکتوری با موفقیت ایجاد شد در مسیر: {db_path}")
+    elapsed = time.perf_counter() - started
+    throughput = stats["embedded"] / embed_time if embed_time else 0.0
+    print(f"✅ پایگاه داده وکتوری به‌روز شد در مسیر: {db_path}")
+    print(f"   قطعه‌های امبد شده: {stats['embedded']} ({throughput:.1f} chunks/s)، "
+          f"بدون تغییر (رد شده): {stats['skipped']}، حذف شده: {stats['deleted']}، زمان کل: {elapsed:.2f}s")
+    return stats
 
 if __name__ == '__main__':
-    setup_vector_database()
+    parser = argparse.ArgumentParser(description="به‌روزرسانی افزایشی پایگاه دانش RAG (جدول food_rag در LanceDB)")
+    parser.add_argument("sources", nargs="*", default=DEFAULT_SOURCES, help="فایل‌ها یا پوشه‌های متنی (.txt/.md)")
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE, help="تعداد قطعه‌ها در هر دسته امبدینگ")
+    parser.add_argument("--force-index", action="store_true", help="ساخت دوباره ایندکس ANN حتی برای جدول‌های کوچک")
+    args = parser.parse_args()
+    setup_vector_database(args.sources, args.batch_size, force_index=args.force_index)
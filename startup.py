@@ -0,0 +1,77 @@
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+# ==================== گرم کردن موازی در پس‌زمینه ====================
+# کارهای سنگین راه‌اندازی (بارگذاری مدل امبدینگ، باز کردن LanceDB، کامپایل گراف‌ها، ایندکس جستجو)
+# به جای ایمپورت ماژول‌ها یا اولین پیام کاربر، بلافاصله بعد از بالا آمدن سرور و به صورت موازی اجرا می‌شوند.
+WARMUP_WORKERS = 4
+
+_tasks = {}  # name -> func
+_status = {}  # name -> {"state": pending|running|ok|failed, "seconds", "error"}
+_ready = threading.Event()
+_lock = threading.Lock()
+_started_at = None
+_finished_at = None
+
+
+def register_warmup(name: str, func):
+    """یک کار گرم کردن ثبت می‌کند؛ خطای آن فقط گزارش می‌شود و برنامه را متوقف نمی‌کند."""
+    with _lock:
+        _tasks[name] = func
+        _status[name] = {"state": "pending", "seconds": None, "error": None}
+
+def _run_task(name: str, func):
+    _status[name]["state"] = "running"
+    started = time.perf_counter()
+    try:
+        func()
+        _status[name]["state"] = "ok"
+    except Exception as e:
+        _status[name]["state"] = "failed"
+        _status[name]["error"] = str(e)
+        print(f"!!! گرم کردن '{name}' ناموفق بود: {e}")
+    _status[name]["seconds"] = time.perf_counter() - started
+
+def _run_all(tasks: dict):
+    global _finished_at
+    with ThreadPoolExecutor(max_workers=WARMUP_WORKERS, thread_name_prefix="chatfood-warmup") as executor:
+        for name, func in tasks.items():
+            executor.submit(_run_task, name, func)
+    _finished_at = time.perf_counter()
+    print(f"✅ گرم کردن در {_finished_at - _started_at:.2f}s تمام شد: " +
+          ", ".join(f"{name}={info['state']}" for name, info in _status.items()))
+    _ready.set()
+
+def start_warmup() -> bool:
+    """کارهای ثبت شده را یک بار در یک thread پس‌زمینه اجرا می‌کند؛ فراخوانی‌های بعدی اثری ندارند."""
+    global _started_at
+    with _lock:
+        if _started_at is not None:
+            return False
+        _started_at = time.perf_counter()
+        tasks = dict(_tasks)
+    threading.Thread(target=_run_all, args=(tasks,), name="chatfood-warmup", daemon=True).start()
+    return True
+
+def is_ready() -> bool:
+    return _ready.is_set()
+
+def wait_until_ready(timeout: float = None) -> bool:
+    return _ready.wait(timeout)
+
+async def await_ready(timeout: float = None) -> bool:
+    """نسخه async انتظار؛ event loop در این مدت مسدود نمی‌شود."""
+    if _ready.is_set():
+        return True
+    return await asyncio.to_thread(_ready.wait, timeout)
+
+def get_startup_status() -> dict:
+    """وضعیت و مدت زمان هر کار گرم کردن و کل فرایند."""
+    with _lock:
+        tasks = {name: dict(info) for name, info in _status.items()}
+    total = None
+    if _started_at is not None:
+        total = (_finished_at or time.perf_counter()) - _started_at
+    return {"started": _started_at is not None, "ready": _ready.is_set(), "seconds": total, "tasks": tasks}
@@ -0,0 +1,423 @@
+import asyncio
+import os
+import pickle
+import random
+import sqlite3
+import threading
+import time
+from collections.abc import Iterator, Sequence
+from typing import Any
+
+from langchain_core.runnables import RunnableConfig
+from langgraph.checkpoint.base import (
+    WRITES_IDX_MAP,
+    BaseCheckpointSaver,
+    ChannelVersions,
+    Checkpoint,
+    CheckpointMetadata,
+    CheckpointTuple,
+    get_checkpoint_id,
+    get_checkpoint_metadata,
+)
+
+# ==================== تنظیمات ====================
+# حالت پیش‌فرض (memory) فقط برای یک پروسه است. برای اجرای چند worker یکی از backendهای مشترک را انتخاب کنید:
+#   sqlite   یک فایل SQLite جدا در حالت WAL (workerهای روی یک ماشین)
+#   redis    هر سرور سازگار با پروتکل Redis (Redis/Valkey/KeyDB)؛ نیاز به پکیج redis دارد
+STATE_BACKEND = os.getenv("CHATFOOD_STATE_BACKEND", "memory")
+STATE_DB_PATH = os.getenv("CHATFOOD_STATE_DB_PATH", os.path.join("db", "state.db"))
+REDIS_URL = os.getenv("CHATFOOD_REDIS_URL", "redis://localhost:6379/0")
+# هر thread فقط چند checkpoint آخر را نگه می‌دارد؛ تاریخچه‌ی گفتگو داخل آخرین checkpoint است.
+CHECKPOINT_HISTORY = 4
+# جلسه‌هایی که on_chat_end آن‌ها اجرا نشود (مثلا از کار افتادن worker) بعد از این مدت پاک می‌شوند؛
+# checkpointهای زیرگراف‌ها بعد از پایان هر نوبت دیگر خوانده نمی‌شوند و عمر کوتاه‌تری دارند.
+CHECKPOINT_TTL = float(os.getenv("CHATFOOD_CHECKPOINT_TTL", str(24 * 3600)))
+SUBGRAPH_CHECKPOINT_TTL = 3600
+BUSY_TIMEOUT_MS = 5000
+# backendهای SQLite و memory کلیدهای منقضی را هر چند نوشتن یک بار پاک می‌کنند (Redis این کار را خودش انجام می‌دهد).
+PURGE_EVERY = 1000
+
+
+# ==================== backendهای کلید-مقدار ====================
+# علاوه بر get/set/delete هر backend «ایندکس» دارد: مجموعه‌ای از عضوها با امتیاز (زمان) زیر یک کلید، معادل
+# sorted set در Redis. checkpointهای هر thread و ورودی‌های cache معنایی مشترک از روی ایندکس پیدا می‌شوند،
+# نه با پیمایش همه‌ی کلیدها، پس هزینه‌ی هر مرحله به تعداد کل جلسه‌ها و ورودی‌ها بستگی ندارد.
+class MemoryBackend:
+    """backend درون پروسه؛ فقط برای اجرای تک worker و تست."""
+
+    shared = False
+
+    def __init__(self):
+        self._data = {}  # key -> (value, expires)
+        self._indexes = {}  # key -> ({member: score}, expires)
+        self._lock = threading.Lock()
+        self._writes = 0
+
+    def get(self, key: str) -> bytes | None:
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return None
+            if item[1] is not None and item[1] < time.time():
+                del self._data[key]
+                return None
+            return item[0]
+
+    def get_many(self, keys: list) -> list:
+        return [self.get(key) for key in keys]
+
+    def set(self, key: str, value: bytes, ttl: float = None):
+        with self._lock:
+            self._data[key] = (value, time.time() + ttl if ttl else None)
+            self._writes += 1
+            if self._writes % PURGE_EVERY == 0:
+                # کلیدهای جلسه‌هایی که دیگر خوانده نمی‌شوند بدون این پاک‌سازی هرگز آزاد نمی‌شدند.
+                now = time.time()
+                for store in (self._data, self._indexes):
+                    for expired in [k for k, (_, expires) in store.items() if expires is not None and expires < now]:
+                        del store[expired]
+
+    def delete(self, *keys: str):
+        with self._lock:
+            for key in keys:
+                self._data.pop(key, None)
+                self._indexes.pop(key, None)
+
+    def _index(self, key: str) -> dict | None:
+        item = self._indexes.get(key)
+        if item is not None and item[1] is not None and item[1] < time.time():
+            del self._indexes[key]
+            return None
+        return item[0] if item else None
+
+    def index_add(self, key: str, members: dict, ttl: float = None):
+        with self._lock:
+            index = self._index(key) or {}
+            index.update(members)
+            self._indexes[key] = (index, time.time() + ttl if ttl else None)
+
+    def index_members(self, key: str) -> list:
+        with self._lock:
+            return list(self._index(key) or ())
+
+    def index_remove(self, key: str, *members: str):
+        with self._lock:
+            index = self._index(key)
+            for member in members if index is not None else ():
+                index.pop(member, None)
+
+    def index_trim(self, key: str, min_score: float):
+        """عضوهای با امتیاز کمتر از min_score را حذف می‌کند."""
+        with self._lock:
+            index = self._index(key)
+            for member in [m for m, score in (index or {}).items() if score < min_score]:
+                del index[member]
+
+
+class SQLiteBackend:
+    """
+    جدول کلید-مقدار در یک فایل SQLite جدا از chatfood.db تا نوشتن checkpointها با نوشتن سفارش‌ها رقابت نکند.
+    هر thread اتصال خودش را دارد و بعد از fork اتصال‌ها دوباره ساخته می‌شوند.
+    """
+
+    shared = True
+
+    def __init__(self, db_path: str = None):
+        self.db_path = db_path or STATE_DB_PATH
+        self._local = threading.local()
+        self._pid = os.getpid()
+        self._writes = 0
+
+    def _conn(self) -> sqlite3.Connection:
+        if self._pid != os.getpid():
+            # اتصال SQLite نباید از پروسه‌ی والد به فرزند منتقل شود.
+            self._local, self._pid = threading.local(), os.getpid()
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            os.makedirs(os.path.dirname(self.db_path) or ".", exist_ok=True)
+            conn = sqlite3.connect(self.db_path, timeout=BUSY_TIMEOUT_MS / 1000, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(f"PRAGMA busy_timeout={BUSY_TIMEOUT_MS}")
+            conn.execute("CREATE TABLE IF NOT EXISTS kv (key TEXT PRIMARY KEY, value BLOB NOT NULL, expires REAL) WITHOUT ROWID")
+            conn.execute("""CREATE TABLE IF NOT EXISTS kv_index (
+                key TEXT NOT NULL, member TEXT NOT NULL, score REAL NOT NULL, expires REAL,
+                PRIMARY KEY (key, member)) WITHOUT ROWID""")
+            self._local.conn = conn
+        return conn
+
+    def get(self, key: str) -> bytes | None:
+        row = self._conn().execute("SELECT value FROM kv WHERE key = ? AND (expires IS NULL OR expires >= ?)", (key, time.time())).fetchone()
+        return row[0] if row else None
+
+    def get_many(self, keys: list) -> list:
+        return [self.get(key) for key in keys]
+
+    def set(self, key: str, value: bytes, ttl: float = None):
+        conn = self._conn()
+        conn.execute("INSERT OR REPLACE INTO kv (key, value, expires) VALUES (?, ?, ?)", (key, value, time.time() + ttl if ttl else None))
+        self._count_write(conn)
+
+    def _count_write(self, conn: sqlite3.Connection):
+        self._writes += 1
+        if self._writes % PURGE_EVERY == 0:
+            now = time.time()
+            conn.execute("DELETE FROM kv WHERE expires < ?", (now,))
+            conn.execute("DELETE FROM kv_index WHERE expires < ?", (now,))
+
+    def delete(self, *keys: str):
+        if keys:
+            conn = self._conn()
+            conn.executemany("DELETE FROM kv WHERE key = ?", [(key,) for key in keys])
+            conn.executemany("DELETE FROM kv_index WHERE key = ?", [(key,) for key in keys])
+
+    def index_add(self, key: str, members: dict, ttl: float = None):
+        # مثل EXPIRE در Redis، انقضای کل ایندکس با هر افزودن تمدید می‌شود.
+        conn = self._conn()
+        expires = time.time() + ttl if ttl else None
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.executemany("INSERT OR REPLACE INTO kv_index (key, member, score, expires) VALUES (?, ?, ?, ?)",
+                             [(key, member, score, expires) for member, score in members.items()])
+            conn.execute("UPDATE kv_index SET expires = ? WHERE key = ?", (expires, key))
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        self._count_write(conn)
+
+    def index_members(self, key: str) -> list:
+        rows = self._conn().execute("SELECT member FROM kv_index WHERE key = ? AND (expires IS NULL OR expires >= ?)",
+                                    (key, time.time())).fetchall()
+        return [row[0] for row in rows]
+
+    def index_remove(self, key: str, *members: str):
+        if members:
+            self._conn().executemany("DELETE FROM kv_index WHERE key = ? AND member = ?", [(key, member) for member in members])
+
+    def index_trim(self, key: str, min_score: float):
+        self._conn().execute("DELETE FROM kv_index WHERE key = ? AND score < ?", (key, min_score))
+
+
+class RedisBackend:
+    """backend روی هر سرور سازگار با Redis؛ برای workerهای روی چند ماشین. ایندکس‌ها sorted set هستند."""
+
+    shared = True
+
+    def __init__(self, url: str = None):
+        try:
+            import redis
+        except ImportError as e:
+            raise ImportError("برای CHATFOOD_STATE_BACKEND=redis پکیج redis را نصب کنید: pip install redis") from e
+        # redis-py بعد از fork اتصال‌های Pool را خودش دوباره می‌سازد.
+        self._client = redis.Redis.from_url(url or REDIS_URL)
+
+    def get(self, key: str) -> bytes | None:
+        return self._client.get(key)
+
+    def get_many(self, keys: list) -> list:
+        return self._client.mget(keys) if keys else []
+
+    def set(self, key: str, value: bytes, ttl: float = None):
+        self._client.set(key, value, px=int(ttl * 1000) if ttl else None)
+
+    def delete(self, *keys: str):
+        if keys:
+            self._client.delete(*keys)
+
+    def index_add(self, key: str, members: dict, ttl: float = None):
+        pipe = self._client.pipeline()
+        pipe.zadd(key, members)
+        if ttl:
+            pipe.pexpire(key, int(ttl * 1000))
+        pipe.execute()
+
+    def index_members(self, key: str) -> list:
+        return [member.decode() for member in self._client.zrange(key, 0, -1)]
+
+    def index_remove(self, key: str, *members: str):
+        if members:
+            self._client.zrem(key, *members)
+
+    def index_trim(self, key: str, min_score: float):
+        self._client.zremrangebyscore(key, "-inf", f"({min_score}")
+
+
+BACKENDS = {"memory": MemoryBackend, "sqlite": SQLiteBackend, "redis": RedisBackend}
+
+_backend = None
+_backend_lock = threading.Lock()
+
+def get_backend():
+    global _backend
+    if _backend is None:
+        with _backend_lock:
+            if _backend is None:
+                if STATE_BACKEND not in BACKENDS:
+                    raise ValueError(f"CHATFOOD_STATE_BACKEND نامعتبر است: {STATE_BACKEND} (گزینه‌ها: {', '.join(BACKENDS)})")
+                _backend = BACKENDS[STATE_BACKEND]()
+    return _backend
+
+def get_shared_backend():
+    """backend مشترک بین workerها، یا None در حالت تک پروسه‌ای."""
+    backend = get_backend()
+    return backend if backend.shared else None
+
+
+# ==================== checkpointer روی backend ====================
+class BackendSaver(BaseCheckpointSaver):
+    """
+    checkpointer لنگ‌گراف روی backend کلید-مقدار تا تاریخچه‌ی هر جلسه در هر workerی که پیام بعدی را
+    دریافت کند در دسترس باشد. کلیدها: checkpoint:<thread>:<ns>:<id> و writes:<thread>:<ns>:<id>؛ شناسه‌های
+    checkpoint هر (thread, ns) در ایندکس checkpoints:<thread>:<ns> و namespaceهای هر thread در
+    ایندکس namespaces:<thread> نگه داشته می‌شوند.
+    """
+
+    def __init__(self, backend, history: int = CHECKPOINT_HISTORY):
+        super().__init__()
+        self.backend = backend
+        self.history = history
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _ttl(checkpoint_ns: str) -> float:
+        return SUBGRAPH_CHECKPOINT_TTL if checkpoint_ns else CHECKPOINT_TTL
+
+    @staticmethod
+    def _key(kind: str, thread_id: str, checkpoint_ns: str, checkpoint_id: str = "") -> str:
+        return f"{kind}:{thread_id}:{checkpoint_ns}:{checkpoint_id}"
+
+    def _tuple(self, thread_id: str, checkpoint_ns: str, checkpoint_id: str) -> CheckpointTuple | None:
+        saved = self.backend.get(self._key("checkpoint", thread_id, checkpoint_ns, checkpoint_id))
+        if saved is None:
+            return None
+        checkpoint, metadata, parent_checkpoint_id = pickle.loads(saved)
+        writes = self.backend.get(self._key("writes", thread_id, checkpoint_ns, checkpoint_id))
+        writes = pickle.loads(writes).values() if writes else []
+        return CheckpointTuple(
+            config={"configurable": {"thread_id": thread_id, "checkpoint_ns": checkpoint_ns, "checkpoint_id": checkpoint_id}},
+            checkpoint=self.serde.loads_typed(checkpoint),
+            metadata=self.serde.loads_typed(metadata),
+            pending_writes=[(task_id, channel, self.serde.loads_typed(value)) for task_id, channel, value, _ in writes],
+            parent_config=(
+                {"configurable": {"thread_id": thread_id, "checkpoint_ns": checkpoint_ns, "checkpoint_id": parent_checkpoint_id}}
+                if parent_checkpoint_id else None
+            ),
+        )
+
+    def _checkpoint_ids(self, thread_id: str, checkpoint_ns: str) -> list:
+        # شناسه‌ی checkpointها (uuid6) بر اساس زمان مرتب می‌شوند.
+        return sorted(self.backend.index_members(self._key("checkpoints", thread_id, checkpoint_ns)), reverse=True)
+
+    def get_tuple(self, config: RunnableConfig) -> CheckpointTuple | None:
+        thread_id = config["configurable"]["thread_id"]
+        checkpoint_ns = config["configurable"].get("checkpoint_ns", "")
+        checkpoint_id = get_checkpoint_id(config)
+        if not checkpoint_id:
+            ids = self._checkpoint_ids(thread_id, checkpoint_ns)
+            if not ids:
+                return None
+            checkpoint_id = ids[0]
+        return self._tuple(thread_id, checkpoint_ns, checkpoint_id)
+
+    def list(self, config: RunnableConfig | None, *, filter: dict[str, Any] | None = None,
+             before: RunnableConfig | None = None, limit: int | None = None) -> Iterator[CheckpointTuple]:
+        if config is None:
+            # فهرست کردن همه‌ی threadها روی backend مشترک پشتیبانی نمی‌شود.
+            return
+        thread_id = config["configurable"]["thread_id"]
+        checkpoint_ns = config["configurable"].get("checkpoint_ns", "")
+        config_checkpoint_id = get_checkpoint_id(config)
+        before_checkpoint_id = get_checkpoint_id(before) if before else None
+        for checkpoint_id in self._checkpoint_ids(thread_id, checkpoint_ns):
+            if config_checkpoint_id and checkpoint_id != config_checkpoint_id:
+                continue
+            if before_checkpoint_id and checkpoint_id >= before_checkpoint_id:
+                continue
+            item = self._tuple(thread_id, checkpoint_ns, checkpoint_id)
+            if item is None or (filter and not all(item.metadata.get(k) == v for k, v in filter.items())):
+                continue
+            if limit is not None:
+                if limit <= 0:
+                    break
+                limit -= 1
+            yield item
+
+    def put(self, config: RunnableConfig, checkpoint: Checkpoint, metadata: CheckpointMetadata,
+            new_versions: ChannelVersions) -> RunnableConfig:
+        thread_id = config["configurable"]["thread_id"]
+        checkpoint_ns = config["configurable"]["checkpoint_ns"]
+        record = (
+            self.serde.dumps_typed(checkpoint),
+            self.serde.dumps_typed(get_checkpoint_metadata(config, metadata)),
+            config["configurable"].get("checkpoint_id"),  # parent
+        )
+        now = time.time()
+        self.backend.set(self._key("checkpoint", thread_id, checkpoint_ns, checkpoint["id"]), pickle.dumps(record), self._ttl(checkpoint_ns))
+        self.backend.index_add(self._key("checkpoints", thread_id, checkpoint_ns), {checkpoint["id"]: now}, self._ttl(checkpoint_ns))
+        if checkpoint_ns:
+            # namespace زیرگراف‌ها برای هر نوبت تازه است؛ آن‌هایی که checkpointشان منقضی شده از ایندکس بیرون می‌روند.
+            self.backend.index_add(f"namespaces:{thread_id}", {checkpoint_ns: now}, CHECKPOINT_TTL)
+            self.backend.index_trim(f"namespaces:{thread_id}", now - SUBGRAPH_CHECKPOINT_TTL)
+        stale = self._checkpoint_ids(thread_id, checkpoint_ns)[self.history:]
+        if stale:
+            self.backend.delete(*[self._key(kind, thread_id, checkpoint_ns, checkpoint_id)
+                                  for checkpoint_id in stale for kind in ("checkpoint", "writes")])
+            self.backend.index_remove(self._key("checkpoints", thread_id, checkpoint_ns), *stale)
+        return {"configurable": {"thread_id": thread_id, "checkpoint_ns": checkpoint_ns, "checkpoint_id": checkpoint["id"]}}
+
+    def put_writes(self, config: RunnableConfig, writes: Sequence[tuple[str, Any]], task_id: str, task_path: str = "") -> None:
+        thread_id = config["configurable"]["thread_id"]
+        checkpoint_ns = config["configurable"].get("checkpoint_ns", "")
+        key = self._key("writes", thread_id, checkpoint_ns, config["configurable"]["checkpoint_id"])
+        # یک جلسه در هر لحظه فقط در یک worker اجرا می‌شود؛ قفل فقط taskهای موازی همین پروسه را مرتب می‌کند.
+        with self._lock:
+            saved = self.backend.get(key)
+            stored = pickle.loads(saved) if saved else {}
+            for idx, (channel, value) in enumerate(writes):
+                inner_key = (task_id, WRITES_IDX_MAP.get(channel, idx))
+                if inner_key[1] >= 0 and inner_key in stored:
+                    continue
+                stored[inner_key] = (task_id, channel, self.serde.dumps_typed(value), task_path)
+            self.backend.set(key, pickle.dumps(stored), self._ttl(checkpoint_ns))
+
+    def delete_thread(self, thread_id: str) -> None:
+        keys = [f"namespaces:{thread_id}"]
+        for checkpoint_ns in ["", *self.backend.index_members(f"namespaces:{thread_id}")]:
+            index_key = self._key("checkpoints", thread_id, checkpoint_ns)
+            keys.append(index_key)
+            keys.extend(self._key(kind, thread_id, checkpoint_ns, checkpoint_id)
+                        for checkpoint_id in self.backend.index_members(index_key) for kind in ("checkpoint", "writes"))
+        self.backend.delete(*keys)
+
+    # نسخه‌های async روی thread جدا اجرا می‌شوند تا I/O backend حلقه‌ی رویداد را مسدود نکند.
+    async def aget_tuple(self, config: RunnableConfig) -> CheckpointTuple | None:
+        return await asyncio.to_thread(self.get_tuple, config)
+
+    async def alist(self, config: RunnableConfig | None, *, filter: dict[str, Any] | None = None,
+                    before: RunnableConfig | None = None, limit: int | None = None):
+        for item in await asyncio.to_thread(lambda: list(self.list(config, filter=filter, before=before, limit=limit))):
+            yield item
+
+    async def aput(self, config: RunnableConfig, checkpoint: Checkpoint, metadata: CheckpointMetadata,
+                   new_versions: ChannelVersions) -> RunnableConfig:
+        return await asyncio.to_thread(self.put, config, checkpoint, metadata, new_versions)
+
+    async def aput_writes(self, config: RunnableConfig, writes: Sequence[tuple[str, Any]], task_id: str, task_path: str = "") -> None:
+        await asyncio.to_thread(self.put_writes, config, writes, task_id, task_path)
+
+    async def adelete_thread(self, thread_id: str) -> None:
+        await asyncio.to_thread(self.delete_thread, thread_id)
+
+    def get_next_version(self, current: str | None, channel: None) -> str:
+        # همان قالب InMemorySaver: شماره‌ی افزایشی به همراه بخش تصادفی
+        current_v = 0 if current is None else current if isinstance(current, int) else int(current.split(".")[0])
+        return f"{current_v + 1:032}.{random.random():016}"
+
+
+def create_checkpointer():
+    """
+    checkpointer روی backend انتخاب شده؛ در حالت memory هم همان BackendSaver روی MemoryBackend است تا
+    تاریخچه‌ی هر thread مثل backendهای مشترک به CHECKPOINT_HISTORY checkpoint آخر محدود بماند.
+    """
+    return BackendSaver(get_backend())
@@ -0,0 +1,163 @@
+import threading
+import time
+from collections import deque
+
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.messages import AIMessage, AIMessageChunk
+
+import telemetry
+
+# ==================== استریم توکن‌ها از گراف‌ها ====================
+# فقط خروجی مدل ایجنت‌ها به کاربر استریم می‌شود؛ خروجی مسیریاب و خلاصه‌ساز حافظه (که در نود memory اجرا می‌شوند) نه.
+STREAM_NODES = ("agent", "cache", "recommend", "respond")
+# تعداد نوبت‌های اخیر که برای صدک‌های TTFT نگه داشته می‌شوند
+STATS_WINDOW = 1000
+
+_lock = threading.Lock()
+_samples = {"ttft": deque(maxlen=STATS_WINDOW), "first_foods": deque(maxlen=STATS_WINDOW), "total": deque(maxlen=STATS_WINDOW)}
+_counts = {"turns": 0, "tokens": 0, "turns_without_tokens": 0}
+_routes = {}  # agent -> {"turns", "latency", "llm_calls", "max_latency"}
+
+
+class LLMCallCounter(BaseCallbackHandler):
+    """تعداد فراخوانی‌های مدل (مسیریاب، ایجنت‌ها، خلاصه‌ساز) در یک نوبت را می‌شمارد."""
+
+    run_inline = True
+
+    def __init__(self):
+        self.calls = 0
+
+    def on_chat_model_start(self, serialized, messages, **kwargs):
+        self.calls += 1
+
+    def on_llm_start(self, serialized, prompts, **kwargs):
+        self.calls += 1
+
+
+def is_food_list(tool_output) -> bool:
+    return isinstance(tool_output, list) and len(tool_output) > 0 and isinstance(tool_output[0], dict) and "name" in tool_output[0]
+
+def _agent_name(namespace: tuple, node: str) -> str:
+    # namespace زیرگراف به شکل ("food_search:<task id>",) است؛ در گراف‌های بدون زیرگراف نام نود کافی است.
+    return namespace[0].split(":")[0] if namespace else node
+
+def _token_text(message) -> str:
+    if not isinstance(message, (AIMessageChunk, AIMessage)) or getattr(message, "tool_call_chunks", None) or message.tool_calls:
+        return ""
+    return message.content if isinstance(message.content, str) else ""
+
+async def stream_events(app, inputs: dict, config: dict = None):
+    """
+    گراف را با stream_mode messages/updates (به همراه زیرگراف‌ها) اجرا می‌کند و رویدادهای ساده برای UI تولید می‌کند:
+      ("node", agent)            شروع کار یک ایجنت
+      ("token", (agent, text))   یک تکه از پاسخ مدل ایجنت
+      ("foods", page)            صفحه‌ی اول نتیجه‌ی ابزار جستجوی غذا، به محض آماده شدن:
+                                 {"items", "total", "next_cursor", "query", "max_price"}
+      ("done", {"agent", "content", "tool_output", "food_page"})   پایان نوبت
+    زمان تا اولین توکن (TTFT)، اولین نتیجه‌ی غذا و تاخیر و تعداد فراخوانی‌های LLM هر مسیر ثبت می‌شود.
+    """
+    counter = LLMCallCounter()
+    tracer = telemetry.TracingCallbackHandler(telemetry.start_trace())
+    config = {**(config or {}), "callbacks": [counter, tracer]}
+    started = time.perf_counter()
+    ttft = first_foods = None
+    tokens = 0
+    agent, content, tool_output, food_page = "", "", None, None
+    seen_agents = set()
+    try:
+        async for namespace, mode, data in app.astream(inputs, config, stream_mode=["messages", "updates"], subgraphs=True):
+            if mode == "messages":
+                message, metadata = data
+                node = metadata.get("langgraph_node", "")
+                current = _agent_name(namespace, node)
+                if current not in seen_agents and namespace:
+                    seen_agents.add(current)
+                    yield "node", current
+                text = _token_text(message) if node in STREAM_NODES else ""
+                if text:
+                    if ttft is None:
+                        ttft = time.perf_counter() - started
+                    tokens += 1
+                    yield "token", (current, text)
+                continue
+            for node, update in data.items():
+                if not isinstance(update, dict):
+                    continue
+                if namespace:
+                    # به‌روزرسانی نودهای داخل زیرگراف: نتیجه‌ی ابزار جستجو بدون انتظار برای پاسخ دوم مدل ارسال می‌شود.
+                    if is_food_list(update.get("tool_output")):
+                        if first_foods is None:
+                            first_foods = time.perf_counter() - started
+                        yield "foods", {"items": update["tool_output"], **(update.get("food_page") or {})}
+                    continue
+                if node not in seen_agents and node != "memory":
+                    seen_agents.add(node)
+                    yield "node", node
+                agent = node
+                for message in reversed(update.get("messages") or []):
+                    if message.type == "ai" and not message.tool_calls and message.content:
+                        content = message.content
+                        break
+                if update.get("tool_output"):
+                    tool_output = update["tool_output"]
+                    food_page = update.get("food_page") if is_food_list(tool_output) else None
+    except Exception as e:
+        telemetry.record_turn(agent, time.perf_counter() - started, status="error", error=f"{type(e).__name__}: {e}",
+                              thread_id=config.get("configurable", {}).get("thread_id"))
+        raise
+    total = time.perf_counter() - started
+    _record(agent, ttft, first_foods, total, tokens, counter.calls)
+    telemetry.record_turn(agent, total, thread_id=config.get("configurable", {}).get("thread_id"), ttft_ms=None if ttft is None else round(ttft * 1000, 3),
+                          llm_calls=counter.calls, tokens_in=tracer.tokens_in, tokens_out=tracer.tokens_out, cost_usd=round(tracer.cost, 8))
+    print(f"--- استریم ({agent}): اولین توکن {_seconds(ttft)}، اولین نتیجه‌ی غذا {_seconds(first_foods)}، "
+          f"کل {_seconds(total)}، فراخوانی LLM: {counter.calls} ---")
+    yield "done", {"agent": agent, "content": content, "tool_output": tool_output, "food_page": food_page}
+
+def _seconds(value) -> str:
+    return "-" if value is None else f"{value:.3f}s"
+
+def _record(agent: str, ttft, first_foods, total: float, tokens: int, llm_calls: int):
+    with _lock:
+        route = _routes.setdefault(agent or "unknown", {"turns": 0, "latency": 0.0, "max_latency": 0.0, "llm_calls": 0})
+        route["turns"] += 1
+        route["latency"] += total
+        route["max_latency"] = max(route["max_latency"], total)
+        route["llm_calls"] += llm_calls
+        _counts["turns"] += 1
+        _counts["tokens"] += tokens
+        if ttft is None:
+            _counts["turns_without_tokens"] += 1
+        else:
+            _samples["ttft"].append(ttft)
+        if first_foods is not None:
+            _samples["first_foods"].append(first_foods)
+        _samples["total"].append(total)
+
+def _percentiles(values) -> dict:
+    values = sorted(values)
+    if not values:
+        return {"p50": None, "p95": None, "max": None}
+    pick = lambda q: values[min(len(values) - 1, int(q * len(values)))]
+    return {"p50": pick(0.5), "p95": pick(0.95), "max": values[-1]}
+
+def get_streaming_stats() -> dict:
+    """صدک‌های زمان تا اولین توکن، اولین نتیجه‌ی غذا و کل نوبت (ثانیه) در STATS_WINDOW نوبت اخیر."""
+    with _lock:
+        report = dict(_counts)
+        for name, values in _samples.items():
+            report[name] = _percentiles(values)
+    return report
+
+def get_route_stats() -> dict:
+    """برای هر مسیر (ایجنت): تعداد نوبت‌ها، میانگین و بیشینه‌ی تاخیر و میانگین فراخوانی‌های LLM در هر نوبت."""
+    with _lock:
+        return {
+            agent: {
+                "turns": route["turns"],
+                "avg_latency": route["latency"] / route["turns"],
+                "max_latency": route["max_latency"],
+                "llm_calls": route["llm_calls"],
+                "avg_llm_calls": route["llm_calls"] / route["turns"],
+            }
+            for agent, route in _routes.items()
+        }
@@ -0,0 +1,443 @@
+"""
+ردگیری و متریک‌های برنامه: زمان هر نود گراف، فراخوانی LLM (توکن‌های ورودی/خروجی و هزینه)، ابزار، بازیابی،
+کوئری پایگاه داده و جستجوی وب، به همراه hit/miss cacheها و خطاها.
+
+خروجی‌ها:
+  - متریک‌ها با فرمت متنی Prometheus روی http://<host>:CHATFOOD_METRICS_PORT/metrics (اگر پورت تنظیم شده باشد)
+  - هر span یک خط JSON در CHATFOOD_TRACE_PATH (پیش‌فرض logs/traces.jsonl؛ مقدار خالی یعنی خاموش)
+
+خلاصه‌ی صدک‌های تاخیر هر مسیر از روی فایل ردگیری:
+
+    python telemetry.py logs/traces.jsonl
+    python telemetry.py logs/traces.jsonl --spans --since 3600
+"""
+import argparse
+import asyncio
+import atexit
+import contextvars
+import json
+import os
+import queue
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from langchain_core.callbacks import BaseCallbackHandler
+
+# ==================== تنظیمات ====================
+TRACE_PATH = os.getenv("CHATFOOD_TRACE_PATH", os.path.join("logs", "traces.jsonl"))
+METRICS_PORT = int(os.getenv("CHATFOOD_METRICS_PORT", "0"))
+TRACE_FLUSH_INTERVAL = 0.5
+TRACE_BATCH_SIZE = 500
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+# قیمت هر یک میلیون توکن (دلار): (ورودی، خروجی)
+MODEL_PRICES = {"gpt-4o-mini": (0.15, 0.60), "gpt-4o": (2.50, 10.00)}
+
+_trace_id = contextvars.ContextVar("chatfood_trace_id", default=None)
+
+
+# ==================== متریک‌ها ====================
+_lock = threading.Lock()
+_counters = {}  # (name, labels) -> value
+_histograms = {}  # (name, labels) -> {"buckets": [...], "count", "sum"}
+_gauges = {}  # (name, labels) -> value
+_HELP = {
+    "chatfood_span_duration_seconds": ("histogram", "زمان هر span به تفکیک نوع و نام"),
+    "chatfood_span_errors_total": ("counter", "تعداد spanهای ناموفق"),
+    "chatfood_turn_duration_seconds": ("histogram", "زمان کل هر نوبت گفتگو به تفکیک مسیر"),
+    "chatfood_llm_tokens_total": ("counter", "توکن‌های ورودی و خروجی LLM"),
+    "chatfood_llm_cost_usd_total": ("counter", "هزینه‌ی تخمینی LLM به دلار"),
+    "chatfood_cache_requests_total": ("counter", "درخواست‌های cache به تفکیک hit/miss/skip"),
+    "chatfood_router_decisions_total": ("counter", "تصمیم‌های مسیریاب به تفکیک لایه و مقصد"),
+    "chatfood_llm_requests_total": ("counter", "درخواست‌های LLM در زمان‌بند به تفکیک اولویت و نتیجه"),
+    "chatfood_llm_retries_total": ("counter", "تلاش‌های دوباره‌ی درخواست LLM به تفکیک کد وضعیت"),
+    "chatfood_llm_queue_wait_seconds": ("histogram", "زمان انتظار درخواست LLM در صف زمان‌بند"),
+    "chatfood_llm_queue_depth": ("gauge", "درخواست‌های LLM منتظر در صف به تفکیک اولویت"),
+    "chatfood_llm_inflight": ("gauge", "درخواست‌های LLM در حال اجرا به تفکیک اولویت"),
+    "chatfood_llm_concurrency_limit": ("gauge", "سقف همزمانی فعلی زمان‌بند LLM (بعد از 429 موقتا کم می‌شود)"),
+}
+
+def _labels(labels: dict) -> tuple:
+    return tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+def inc(metric: str, value: float = 1.0, **labels):
+    key = (metric, _labels(labels))
+    with _lock:
+        _counters[key] = _counters.get(key, 0.0) + value
+
+def observe(metric: str, seconds: float, **labels):
+    key = (metric, _labels(labels))
+    with _lock:
+        histogram = _histograms.get(key)
+        if histogram is None:
+            histogram = _histograms[key] = {"buckets": [0] * len(DURATION_BUCKETS), "count": 0, "sum": 0.0}
+        for i, bound in enumerate(DURATION_BUCKETS):
+            if seconds <= bound:
+                histogram["buckets"][i] += 1
+                break
+        histogram["count"] += 1
+        histogram["sum"] += seconds
+
+def set_gauge(metric: str, value: float, **labels):
+    with _lock:
+        _gauges[(metric, _labels(labels))] = value
+
+def record_cache(cache: str, hit: bool):
+    inc("chatfood_cache_requests_total", cache=cache, result="hit" if hit else "miss")
+
+def _format_labels(labels: tuple, extra: tuple = ()) -> str:
+    pairs = labels + extra
+    if not pairs:
+        return ""
+    escaped = (value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, value in pairs)
+    return "{" + ",".join(f'{key}="{value}"' for (key, _), value in zip(pairs, escaped)) + "}"
+
+def render_metrics() -> str:
+    """همه‌ی متریک‌ها با فرمت متنی Prometheus (سطل‌های هیستوگرام تجمعی‌اند)."""
+    with _lock:
+        counters = dict(_counters)
+        gauges = dict(_gauges)
+        histograms = {key: {**value, "buckets": list(value["buckets"])} for key, value in _histograms.items()}
+    lines, described = [], set()
+    def describe(name: str):
+        if name not in described:
+            described.add(name)
+            kind, text = _HELP.get(name, ("untyped", name))
+            lines.extend([f"# HELP {name} {text}", f"# TYPE {name} {kind}"])
+    for (name, labels), value in sorted(counters.items()):
+        describe(name)
+        lines.append(f"{name}{_format_labels(labels)} {value:g}")
+    for (name, labels), value in sorted(gauges.items()):
+        describe(name)
+        lines.append(f"{name}{_format_labels(labels)} {value:g}")
+    for (name, labels), histogram in sorted(histograms.items()):
+        describe(name)
+        cumulative = 0
+        for bound, count in zip(DURATION_BUCKETS, histogram["buckets"]):
+            cumulative += count
+            lines.append(f"{name}_bucket{_format_labels(labels, (('le', str(bound)),))} {cumulative}")
+        lines.append(f"{name}_bucket{_format_labels(labels, (('le', '+Inf'),))} {histogram['count']}")
+        lines.append(f"{name}_sum{_format_labels(labels)} {histogram['sum']:.6f}")
+        lines.append(f"{name}_count{_format_labels(labels)} {histogram['count']}")
+    return "\n".join(lines) + "\n"
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = render_metrics().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+_metrics_server = None
+
+def start_metrics_server(port: int = None, host: str = "0.0.0.0") -> bool:
+    """endpoint متریک‌ها را در یک thread پس‌زمینه بالا می‌آورد؛ بدون پورت یا در فراخوانی‌های بعدی اثری ندارد."""
+    global _metrics_server
+    if port is None and METRICS_PORT:
+        # در اجرای چند worker (serve.py) هر worker روی METRICS_PORT + شماره‌ی خودش منتشر می‌کند؛ شماره بعد از fork تنظیم می‌شود.
+        port = METRICS_PORT + int(os.getenv("CHATFOOD_WORKER_INDEX", "0"))
+    if not port or _metrics_server is not None:
+        return False
+    try:
+        _metrics_server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    except OSError as e:
+        print(f"!!! endpoint متریک‌ها روی پورت {port} بالا نیامد: {e}")
+        return False
+    threading.Thread(target=_metrics_server.serve_forever, name="chatfood-metrics", daemon=True).start()
+    print(f"✅ متریک‌ها روی http://{host}:{port}/metrics")
+    return True
+
+
+# ==================== فایل ردگیری ====================
+# spanها در صف جمع و در یک thread پس‌زمینه دسته‌ای به فایل اضافه می‌شوند تا event loop منتظر دیسک نماند.
+_trace_queue = queue.SimpleQueue()
+_writer = None
+_writer_lock = threading.Lock()
+
+def _write_batches():
+    while True:
+        records = [_trace_queue.get()]
+        deadline = time.monotonic() + TRACE_FLUSH_INTERVAL
+        while len(records) < TRACE_BATCH_SIZE and time.monotonic() < deadline:
+            try:
+                records.append(_trace_queue.get(timeout=max(0.0, deadline - time.monotonic())))
+            except queue.Empty:
+                break
+        _append(records)
+
+def _append(records: list):
+    try:
+        os.makedirs(os.path.dirname(TRACE_PATH) or ".", exist_ok=True)
+        with open(TRACE_PATH, "a", encoding="utf-8") as f:
+            f.write("".join(json.dumps(record, ensure_ascii=False) + "\n" for record in records))
+    except OSError as e:
+        print(f"!!! نوشتن فایل ردگیری ناموفق بود: {e}")
+
+def flush():
+    """spanهای باقی‌مانده در صف را همین الان می‌نویسد (در پایان پروسه و بنچمارک‌ها)."""
+    records = []
+    while True:
+        try:
+            records.append(_trace_queue.get_nowait())
+        except queue.Empty:
+            break
+    if records and TRACE_PATH:
+        _append(records)
+
+atexit.register(flush)
+
+def _emit(record: dict):
+    global _writer
+    if not TRACE_PATH:
+        return
+    if _writer is None:
+        with _writer_lock:
+            if _writer is None:
+                _writer = threading.Thread(target=_write_batches, name="chatfood-traces", daemon=True)
+                _writer.start()
+    _trace_queue.put(record)
+
+def _reset_after_fork():
+    global _writer, _metrics_server, _trace_queue
+    _writer, _metrics_server, _trace_queue = None, None, queue.SimpleQueue()
+
+os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+# ==================== spanها ====================
+def start_trace() -> str:
+    """یک شناسه‌ی ردگیری برای نوبت فعلی می‌سازد؛ spanهای همین task و taskهای فرزندش به آن متصل می‌شوند."""
+    trace_id = uuid.uuid4().hex
+    _trace_id.set(trace_id)
+    return trace_id
+
+def record_span(kind: str, name: str, seconds: float, status: str = "ok", error: str = None,
+                span_id: str = None, parent_id: str = None, trace_id: str = None, **attributes):
+    observe("chatfood_span_duration_seconds", seconds, kind=kind, name=name)
+    if status == "error":
+        inc("chatfood_span_errors_total", kind=kind, name=name)
+    record = {"ts": round(time.time() - seconds, 6), "trace_id": trace_id or _trace_id.get(), "span_id": span_id or uuid.uuid4().hex[:16],
+              "parent_id": parent_id, "kind": kind, "name": name, "duration_ms": round(seconds * 1000, 3), "status": status}
+    if error:
+        record["error"] = error[:500]
+    record.update({key: value for key, value in attributes.items() if value is not None})
+    _emit(record)
+
+@contextmanager
+def span(kind: str, name: str, **attributes):
+    """زمان بلوک را به عنوان یک span ثبت می‌کند؛ خطا (یا لغو) ثبت و دوباره پرتاب می‌شود."""
+    started = time.perf_counter()
+    try:
+        yield attributes
+    except asyncio.CancelledError:
+        record_span(kind, name, time.perf_counter() - started, status="cancelled", **attributes)
+        raise
+    except BaseException as e:
+        record_span(kind, name, time.perf_counter() - started, status="error", error=f"{type(e).__name__}: {e}", **attributes)
+        raise
+    record_span(kind, name, time.perf_counter() - started, **attributes)
+
+def record_turn(route: str, seconds: float, status: str = "ok", **attributes):
+    observe("chatfood_turn_duration_seconds", seconds, route=route or "unknown")
+    record_span("turn", route or "unknown", seconds, status=status, route=route or "unknown", **attributes)
+
+
+# ==================== callback لنگ‌چین ====================
+def _node_name(metadata: dict) -> str:
+    # نام نود داخل زیرگراف با نام ایجنت پیشوند می‌گیرد: information_agent/agent
+    namespace = metadata.get("langgraph_checkpoint_ns") or metadata.get("checkpoint_ns") or ""
+    return "/".join(part.split(":")[0] for part in namespace.split("|") if part)
+
+def _usage(response) -> tuple:
+    """(توکن ورودی، توکن خروجی، تخمینی است یا نه) از پاسخ مدل."""
+    for generations in response.generations:
+        for generation in generations:
+            usage = getattr(getattr(generation, "message", None), "usage_metadata", None)
+            if usage:
+                return usage.get("input_tokens", 0), usage.get("output_tokens", 0), False
+    usage = (response.llm_output or {}).get("token_usage") or {}
+    if usage:
+        return usage.get("prompt_tokens", 0), usage.get("completion_tokens", 0), False
+    return None, None, True
+
+def llm_cost(model: str, tokens_in: int, tokens_out: int) -> float:
+    prices = next((price for name, price in sorted(MODEL_PRICES.items(), key=lambda item: -len(item[0])) if model and model.startswith(name)), None)
+    return (tokens_in * prices[0] + tokens_out * prices[1]) / 1_000_000 if prices else 0.0
+
+
+class TracingCallbackHandler(BaseCallbackHandler):
+    """
+    برای هر نوبت ساخته می‌شود و نودهای گراف (و زیرگراف‌ها)، فراخوانی‌های مدل، ابزارها و retrieverها را به
+    span تبدیل می‌کند. والد هر span نزدیک‌ترین اجرای ثبت شده‌ی بالاتر است (زنجیره‌های داخلی حذف می‌شوند).
+    """
+
+    run_inline = True
+
+    def __init__(self, trace_id: str = None):
+        self.trace_id = trace_id or _trace_id.get()
+        self._runs = {}  # run_id -> (kind, name, started, attributes)
+        self._parents = {}  # run_id -> نزدیک‌ترین span ثبت شده (خودش یا یک جد)
+        self.tokens_in = 0
+        self.tokens_out = 0
+        self.cost = 0.0
+        self.llm_calls = 0
+
+    def _start(self, kind, name, run_id, parent_run_id, **attributes):
+        self._runs[run_id] = (kind, name, time.perf_counter(), attributes)
+        self._parents[run_id] = run_id
+
+    def _skip(self, run_id, parent_run_id):
+        self._parents[run_id] = self._parents.get(parent_run_id)
+
+    def _end(self, run_id, parent_run_id, error: BaseException = None, **extra):
+        self._parents.pop(run_id, None)
+        run = self._runs.pop(run_id, None)
+        if run is None:
+            return
+        kind, name, started, attributes = run
+        parent = self._parents.get(parent_run_id)
+        record_span(kind, name, time.perf_counter() - started, status="error" if error else "ok",
+                    error=f"{type(error).__name__}: {error}" if error else None, span_id=str(run_id),
+                    parent_id=str(parent) if parent else None, trace_id=self.trace_id, **attributes, **extra)
+
+    # --- نودهای گراف ---
+    def on_chain_start(self, serialized, inputs, *, run_id, parent_run_id=None, metadata=None, **kwargs):
+        metadata = metadata or {}
+        node = metadata.get("langgraph_node")
+        if node and kwargs.get("name") == node:
+            self._start("node", _node_name(metadata) or node, run_id, parent_run_id)
+        else:
+            self._skip(run_id, parent_run_id)
+
+    def on_chain_end(self, outputs, *, run_id, parent_run_id=None, **kwargs):
+        self._end(run_id, parent_run_id)
+
+    def on_chain_error(self, error, *, run_id, parent_run_id=None, **kwargs):
+        # GraphInterrupt و بقیه‌ی GraphBubbleUpها برای کنترل جریان هستند، نه خطا.
+        control_flow = any(cls.__name__ == "GraphBubbleUp" for cls in type(error).__mro__)
+        self._end(run_id, parent_run_id, error=None if control_flow else error)
+
+    # --- مدل ---
+    def on_chat_model_start(self, serialized, messages, *, run_id, parent_run_id=None, metadata=None, **kwargs):
+        model = (metadata or {}).get("ls_model_name") or (kwargs.get("invocation_params") or {}).get("model") or "unknown"
+        prompt = sum(len(str(message.content)) for batch in messages for message in batch)
+        self._start("llm", model, run_id, parent_run_id, node=(metadata or {}).get("langgraph_node"), _prompt_chars=prompt)
+
+    def on_llm_start(self, serialized, prompts, *, run_id, parent_run_id=None, metadata=None, **kwargs):
+        model = (metadata or {}).get("ls_model_name") or "unknown"
+        self._start("llm", model, run_id, parent_run_id, node=(metadata or {}).get("langgraph_node"), _prompt_chars=sum(map(len, prompts)))
+
+    def on_llm_end(self, response, *, run_id, parent_run_id=None, **kwargs):
+        run = self._runs.get(run_id)
+        if run is None:
+            return
+        model, attributes = run[1], run[3]
+        tokens_in, tokens_out, estimated = _usage(response)
+        if estimated:
+            # مدل‌هایی که مصرف توکن را گزارش نمی‌کنند (یا استریم بدون stream_usage): تخمین از طول متن
+            from memory import CHARS_PER_TOKEN
+            text = "".join(getattr(g, "text", "") or "" for gs in response.generations for g in gs)
+            tokens_in, tokens_out = attributes["_prompt_chars"] // CHARS_PER_TOKEN + 1, len(text) // CHARS_PER_TOKEN + 1
+        del attributes["_prompt_chars"]
+        cost = llm_cost(model, tokens_in, tokens_out)
+        inc("chatfood_llm_tokens_total", tokens_in, model=model, direction="in")
+        inc("chatfood_llm_tokens_total", tokens_out, model=model, direction="out")
+        inc("chatfood_llm_cost_usd_total", cost, model=model)
+        self.tokens_in += tokens_in
+        self.tokens_out += tokens_out
+        self.cost += cost
+        self.llm_calls += 1
+        self._end(run_id, parent_run_id, tokens_in=tokens_in, tokens_out=tokens_out, cost_usd=round(cost, 8),
+                  tokens_estimated=estimated or None)
+
+    def on_llm_error(self, error, *, run_id, parent_run_id=None, **kwargs):
+        run = self._runs.get(run_id)
+        if run is not None:
+            run[3].pop("_prompt_chars", None)
+        self._end(run_id, parent_run_id, error=error)
+
+    # --- ابزارها و retrieverها ---
+    def on_tool_start(self, serialized, input_str, *, run_id, parent_run_id=None, **kwargs):
+        self._start("tool", kwargs.get("name") or (serialized or {}).get("name", "tool"), run_id, parent_run_id)
+
+    def on_tool_end(self, output, *, run_id, parent_run_id=None, **kwargs):
+        self._end(run_id, parent_run_id)
+
+    def on_tool_error(self, error, *, run_id, parent_run_id=None, **kwargs):
+        self._end(run_id, parent_run_id, error=error)
+
+    def on_retriever_start(self, serialized, query, *, run_id, parent_run_id=None, **kwargs):
+        self._start("retriever", kwargs.get("name") or (serialized or {}).get("name", "retriever"), run_id, parent_run_id)
+
+    def on_retriever_end(self, documents, *, run_id, parent_run_id=None, **kwargs):
+        self._end(run_id, parent_run_id, documents=len(documents))
+
+    def on_retriever_error(self, error, *, run_id, parent_run_id=None, **kwargs):
+        self._end(run_id, parent_run_id, error=error)
+
+
+# ==================== خلاصه‌ی فایل ردگیری (CLI) ====================
+def _percentile(values: list, q: float) -> float:
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+def summarize(path: str, since: float = None, by_span: bool = False) -> list:
+    """
+    ردیف‌های (کلید، تعداد، خطا، p50، p95، p99 بر حسب میلی‌ثانیه، توکن‌ها، هزینه) برای هر مسیر (spanهای turn
+    که مجموع توکن‌ها و هزینه‌ی LLM همان نوبت را دارند) یا برای هر نوع و نام span.
+    """
+    groups = {}
+    cutoff = time.time() - since if since else None
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            if (cutoff and record.get("ts", 0) < cutoff) or by_span == (record["kind"] == "turn"):
+                continue
+            key = f"{record['kind']}:{record['name']}" if by_span else record["name"]
+            group = groups.setdefault(key, {"durations": [], "errors": 0, "tokens_in": 0, "tokens_out": 0, "cost": 0.0})
+            group["durations"].append(record["duration_ms"])
+            group["errors"] += record["status"] == "error"
+            group["tokens_in"] += record.get("tokens_in", 0)
+            group["tokens_out"] += record.get("tokens_out", 0)
+            group["cost"] += record.get("cost_usd", 0.0)
+    rows = []
+    for key, group in sorted(groups.items()):
+        durations = sorted(group["durations"])
+        rows.append({"key": key, "count": len(durations), "errors": group["errors"],
+                     "p50_ms": _percentile(durations, 0.50), "p95_ms": _percentile(durations, 0.95), "p99_ms": _percentile(durations, 0.99),
+                     "tokens_in": group["tokens_in"], "tokens_out": group["tokens_out"], "cost_usd": group["cost"]})
+    return rows
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("path", nargs="?", default=TRACE_PATH)
+    parser.add_argument("--spans", action="store_true", help="خلاصه برای هر نوع و نام span به جای هر مسیر")
+    parser.add_argument("--since", type=float, default=None, help="فقط spanهای این چند ثانیه‌ی اخیر")
+    args = parser.parse_args()
+
+    rows = summarize(args.path, args.since, args.spans)
+    if not rows:
+        print("هیچ spanی در فایل ردگیری پیدا نشد.")
+        return
+    width = max(len(row["key"]) for row in rows)
+    print(f"{'route' if not args.spans else 'span':<{width}}  {'count':>7} {'errors':>6} {'p50_ms':>9} {'p95_ms':>9} {'p99_ms':>9} "
+          f"{'tok_in':>9} {'tok_out':>8} {'cost_usd':>9}")
+    for row in rows:
+        print(f"{row['key']:<{width}}  {row['count']:>7} {row['errors']:>6} {row['p50_ms']:>9.1f} {row['p95_ms']:>9.1f} {row['p99_ms']:>9.1f} "
+              f"{row['tokens_in']:>9} {row['tokens_out']:>8} {row['cost_usd']:>9.5f}")
+
+
+if __name__ == "__main__":
+    main()
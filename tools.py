@@ -1,16 +1,18 @@
 import sqlite3
-import os
 from typing import List
 
-DB_PATH = os.path.join('db', 'chatfood.db')
+import cart_store
+import database
+import migrations
+import search_index
+
+PREPARING_STATUS = 'در حال آماده‌سازی'
+CANCELLED_STATUS = 'لغو شده'
 
 def get_order_status(order_id: int) -> str:
     try:
-        conn = sqlite3.connect(DB_PATH)
-        cursor = conn.cursor()
-        cursor.execute("SELECT status FROM orders WHERE id = ?", (order_id,))
-        result = cursor.fetchone()
-        conn.close()
+        migrations.ensure_ready()
+        result = database.fetchone("SELECT status FROM orders WHERE id = ?", (order_id,), read_only=True)
         if result:
             return f"وضعیت سفارش {order_id}، '{result[0]}' است."
         return f"سفارشی با شناسه {order_id} پیدا نشد."
@@ -20,50 +22,58 @@ def get_order_status(order_id: int) -> str:
 
 def cancel_order(order_id: int) -> str:
     try:
-        conn = sqlite3.connect(DB_PATH)
-        cursor = conn.cursor()
-        cursor.execute("SELECT status FROM orders WHERE id = ?", (order_id,))
-        result = cursor.fetchone()
+        migrations.ensure_ready()
+        # بررسی وضعیت و لغو در یک UPDATE شرطی و اتمی؛ از دو درخواست لغو همزمان فقط یکی موفق می‌شود.
+        if database.execute("UPDATE orders SET status = ? WHERE id = ? AND status = ?", (CANCELLED_STATUS, order_id, PREPARING_STATUS)):
+            return f"سفارش {order_id} با موفقیت لغو شد."
+        result = database.fetchone("SELECT status FROM orders WHERE id = ?", (order_id,))
         if not result:
-            conn.close()
             return f"سفارشی با شناسه {order_id} پیدا نشد."
-        if result[0] == 'در حال آماده‌سازی':
-            cursor.execute("UPDATE orders SET status = 'لغو شده' WHERE id = ?", (order_id,))
-            conn.commit()
-            conn.close()
-            return f"سفارش {order_id} با موفقیت لغو شد."
-        else:
-            conn.close()
-            return f"امکان لغو سفارش {order_id} وجود ندارد زیرا وضعیت آن '{result[0]}' است."
+        return f"امکان لغو سفارش {order_id} وجود ندارد زیرا وضعیت آن '{result[0]}' است."
     except sqlite3.Error as e:
         print(f"!!! خطای پایگاه داده در cancel_order: {e}")
         return "متاسفم، در حال حاضر مشکلی در اتصال به پایگاه داده سفارش‌ها وجود دارد."
 
-def search_food(query: str) -> list:
+# ==================== جستجوی منو ====================
+# نتایج صفحه‌ای و رتبه‌بندی شده‌اند (search_index.search_page)؛ صفحه‌های بعد با next_cursor خوانده می‌شوند.
+SEARCH_PAGE_SIZE = search_index.PAGE_SIZE
+
+def search_food_page(query: str, max_price: float = None, cursor: str = None, sort: str = "relevance",
+                     limit: int = SEARCH_PAGE_SIZE) -> dict:
+    """یک صفحه از نتایج: {"items": [{"name", "restaurant", "price"}], "total", "next_cursor"} و در صورت خطا "error"."""
     try:
-        conn = sqlite3.connect(DB_PATH)
-        cursor = conn.cursor()
-        search_term = f"%{query}%"
-        cursor.execute("SELECT name, restaurant_name, price FROM foods WHERE name LIKE ? OR category LIKE ?", (search_term, search_term))
-        results = cursor.fetchall()
-        conn.close()
-        if not results:
-            return []
-        return [{"name": name, "restaurant": restaurant, "price": price} for name, restaurant, price in results]
+        page = search_index.search_page(query, max_price, limit=limit, cursor=cursor, sort=sort)
     except sqlite3.Error as e:
-        print(f"!!! خطای پایگاه داده در search_food: {e}")
-        return [{"error": "متاسفم، مشکلی در اتصال به پایگاه داده منوی غذاها وجود دارد."}]
+        print(f"!!! خطای پایگاه داده در search_food_page: {e}")
+        return {"items": [], "total": 0, "next_cursor": None, "error": "متاسفم، مشکلی در اتصال به پایگاه داده منوی غذاها وجود دارد."}
+    except ValueError as e:
+        print(f"!!! صفحه‌ی نامعتبر در search_food_page: {e}")
+        return {"items": [], "total": 0, "next_cursor": None, "error": "این فهرست دیگر معتبر نیست؛ لطفا دوباره جستجو کنید."}
+    items = [{"name": name, "restaurant": restaurant, "price": price} for name, restaurant, price in page["rows"]]
+    return {"items": items, "total": page["total"], "next_cursor": page["next_cursor"]}
+
+def search_food(query: str, limit: int = SEARCH_PAGE_SIZE) -> list:
+    """مرتبط‌ترین limit غذا برای query."""
+    page = search_food_page(query, limit=limit)
+    return [{"error": page["error"]}] if page.get("error") else page["items"]
 
 def get_order_history(user_id: str) -> list:
+    """غذاهای تحویل داده شده‌ی کاربر (هر غذا یک بار، پرتکرارترها اول) از جدول تجمیع شده‌ی user_order_history."""
+    return [item["name"] for item in get_favourite_foods(user_id, limit=None)]
+
+def get_favourite_foods(user_id: str, limit: int | None = 5) -> list:
+    """[{"name", "delivered", "last_ordered"}] غذاهای محبوب کاربر بر اساس تعداد سفارش‌های تحویل داده شده."""
     try:
-        conn = sqlite3.connect(DB_PATH)
-        cursor = conn.cursor()
-        cursor.execute("SELECT food_name FROM orders WHERE user_id = ? AND status = 'تحویل داده شده'", (user_id,))
-        results = cursor.fetchall()
-        conn.close()
-        return [row[0] for row in results]
+        migrations.ensure_ready()
+        sql = "SELECT food_name, delivered, last_ordered FROM user_order_history WHERE user_id = ? AND delivered > 0 ORDER BY delivered DESC, last_ordered DESC"
+        params = [user_id]
+        if limit is not None:
+            sql += " LIMIT ?"
+            params.append(limit)
+        rows = database.fetchall(sql, params, read_only=True)
+        return [{"name": name, "delivered": delivered, "last_ordered": last_ordered} for name, delivered, last_ordered in rows]
     except sqlite3.Error as e:
-        print(f"!!! خطای پایگاه داده در get_order_history: {e}")
+        print(f"!!! خطای پایگاه داده در get_favourite_foods: {e}")
         return []
 
 def get_special_offers() -> list:
@@ -73,27 +83,108 @@ def get_special_offers() -> list:
         {'name': 'برگر ذغالی', 'restaurant': 'برگرلند', 'discount': '۲۰٪ تخفیف'}
     ]
 
-def search_and_filter_food(query: str, max_price: float = None) -> List[dict]:
+def search_and_filter_food(query: str, max_price: float = None, limit: int = SEARCH_PAGE_SIZE) -> List[dict]:
+    page = search_food_page(query, max_price, limit=limit)
+    return [{"error": page["error"]}] if page.get("error") else page["items"]
+
+# ==================== سبد خرید ====================
+# سبد در پایگاه داده نگه داشته می‌شود تا با اتصال دوباره از بین نرود و همه‌ی workerها همان سبد را ببینند.
+# افزودن و حذف از طریق بافر write-behind ماژول cart_store دسته‌ای نوشته می‌شوند.
+
+def add_to_cart(cart_id: str, food_name: str, quantity: int = 1, user_id: str = None) -> int:
+    """
+    غذا را به سبد اضافه می‌کند و تعداد کل اقلام سبد را برمی‌گرداند. نام غذا از payload کلاینت می‌آید، پس
+    قبل از بافر شدن با منو بررسی می‌شود؛ غذای ناموجود ValueError می‌دهد.
+    """
+    buffer = cart_store.get_buffer()
+    try:
+        if quantity > 0 and not (isinstance(food_name, str) and database.fetchone(
+                "SELECT 1 FROM foods WHERE name = ?", (food_name,), read_only=True)):
+            raise ValueError(f"غذای '{food_name}' در منو نیست.")
+        buffer.add(cart_id, food_name, quantity, user_id)
+        return cart_store.cart_count(cart_id)
+    except sqlite3.Error as e:
+        print(f"!!! خطای پایگاه داده در add_to_cart: {e}")
+        return buffer.pending_quantity(cart_id)
+
+def remove_from_cart(cart_id: str, food_name: str, quantity: int = 1) -> int:
+    return add_to_cart(cart_id, food_name, -quantity)
+
+def get_cart(cart_id: str) -> dict:
+    try:
+        return cart_store.load_cart(cart_id)
+    except sqlite3.Error as e:
+        print(f"!!! خطای پایگاه داده در get_cart: {e}")
+        return {"cart_id": cart_id, "items": [], "total": 0, "count": 0, "error": "متاسفم، در حال حاضر مشکلی در اتصال به سبد خرید وجود دارد."}
+
+def format_cart(cart: dict) -> str:
+    if cart.get("error"):
+        return cart["error"]
+    if not cart["items"]:
+        return "سبد خرید شما خالی است."
+    lines = [f"- {item['name']} ({item['restaurant']}) × {item['quantity']}: {item['subtotal']:,.0f} تومان" for item in cart["items"]]
+    return "سبد خرید شما:\n" + "\n".join(lines) + f"\nمجموع: {cart['total']:,.0f} تومان"
+
+def checkout(cart_id: str, user_id: str = None) -> str:
     try:
-        conn = sqlite3.connect(DB_PATH)
-        cursor = conn.cursor()
-        search_term = f"%{query}%"
-        sql_query = "SELECT name, restaurant_name, price FROM foods WHERE (name LIKE ? OR category LIKE ?)"
-        params = [search_term, search_term]
-        if max_price is not None:
-            sql_query += " AND price <= ?"
-            params.append(max_price)
-        cursor.execute(sql_query, params)
-        results = cursor.fetchall()
-        conn.close()
-        if not results:
-            return []
-        return [{"name": name, "restaurant": restaurant, "price": price} for name, restaurant, price in results]
+        result = cart_store.checkout_cart(cart_id, user_id)
     except sqlite3.Error as e:
-        print(f"!!! خطای پایگاه داده در search_and_filter_food: {e}")
-        return [{"error": "متاسفم، مشکلی در اتصال به پایگاه داده منوی غذاها وجود دارد."}]
+        print(f"!!! خطای پایگاه داده در checkout: {e}")
+        return "متاسفم، ثبت سفارش در حال حاضر ممکن نیست. لطفا دوباره تلاش کنید."
+    if result is None:
+        return "سبد خرید شما خالی است."
+    orders = "، ".join(str(order_id) for order_id in result["order_ids"])
+    return f"سفارش شما به مبلغ {result['total']:,.0f} تومان ثبت شد. شماره سفارش‌ها: {orders}"
 
-def view_cart() -> str:
+def view_cart(cart_id: str) -> str:
     """این تابع زمانی فراخوانی می‌شود که کاربر می‌خواهد محتویات سبد خرید خود را ببیند."""
-    # این تابع فقط یک سیگنال به UI می‌فرستد. منطق اصلی در app.py است.
-    return "ACTION:VIEW_CART"
\ No newline at end of file
+    return format_cart(get_cart(cart_id))
+
+def get_cart_stats() -> dict:
+    """آمار بافر نوشتن سبد (تعداد عملیات، flushها، نسبت ادغام کلیک‌ها)."""
+    return cart_store.get_buffer().stats()
+
+# ==================== نسخه‌های async ====================
+# این نسخه‌ها همان توابع بالا را روی executor اختصاصی پایگاه داده اجرا می‌کنند
+# تا فراخوانی ابزارها از داخل event loop مربوط به Chainlit آن را مسدود نکند.
+
+async def aget_order_status(order_id: int) -> str:
+    return await database.run_async(get_order_status, order_id)
+
+async def acancel_order(order_id: int) -> str:
+    return await database.run_async(cancel_order, order_id)
+
+async def asearch_food(query: str, limit: int = SEARCH_PAGE_SIZE) -> list:
+    return await database.run_async(search_food, query, limit)
+
+async def asearch_food_page(query: str, max_price: float = None, cursor: str = None, sort: str = "relevance",
+                            limit: int = SEARCH_PAGE_SIZE) -> dict:
+    return await database.run_async(search_food_page, query, max_price, cursor, sort, limit)
+
+async def aget_order_history(user_id: str) -> list:
+    return await database.run_async(get_order_history, user_id)
+
+async def aget_favourite_foods(user_id: str, limit: int | None = 5) -> list:
+    return await database.run_async(get_favourite_foods, user_id, limit)
+
+async def asearch_and_filter_food(query: str, max_price: float = None, limit: int = SEARCH_PAGE_SIZE) -> List[dict]:
+    return await database.run_async(search_and_filter_food, query, max_price, limit)
+
+async def aadd_to_cart(cart_id: str, food_name: str, quantity: int = 1, user_id: str = None) -> int:
+    return await database.run_async(add_to_cart, cart_id, food_name, quantity, user_id)
+
+async def aremove_from_cart(cart_id: str, food_name: str, quantity: int = 1) -> int:
+    return await database.run_async(remove_from_cart, cart_id, food_name, quantity)
+
+async def aget_cart(cart_id: str) -> dict:
+    return await database.run_async(get_cart, cart_id)
+
+async def acheckout(cart_id: str, user_id: str = None) -> str:
+    return await database.run_async(checkout, cart_id, user_id)
+
+async def aview_cart(cart_id: str) -> str:
+    return await database.run_async(view_cart, cart_id)
+
+def get_db_pool_stats() -> dict:
+    """آمار Pool اتصال‌های پایگاه داده (checkout، زمان انتظار و تلاش‌های مجدد) را برمی‌گرداند."""
+    return database.get_pool_stats()
\ No newline at end of file
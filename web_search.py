@@ -0,0 +1,257 @@
+import asyncio
+import json
+import os
+import sqlite3
+import threading
+import time
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+
+import telemetry
+from search_index import normalize_text
+
+# ==================== تنظیمات ====================
+# duckduckgo: جستجوی واقعی اینترنت؛ fixture: پاسخ‌های ثابت از فایل JSON برای اجرای آفلاین، تست و بنچمارک.
+WEB_SEARCH_BACKEND = os.getenv("CHATFOOD_WEB_SEARCH_BACKEND", "duckduckgo")
+FIXTURES_PATH = os.getenv("CHATFOOD_WEB_SEARCH_FIXTURES", "web_search_fixtures.json")
+CACHE_PATH = os.getenv("CHATFOOD_WEB_SEARCH_CACHE_PATH", os.path.join("db", "web_search_cache.db"))
+CACHE_TTL = float(os.getenv("CHATFOOD_WEB_SEARCH_TTL", str(24 * 3600)))
+CACHE_MAX_ENTRIES = 5000
+# حداکثر جستجوی همزمان به سرویس بیرونی (در هر پروسه)؛ بقیه در صف می‌مانند و مهلتشان از همان لحظه شمرده می‌شود.
+MAX_CONCURRENCY = int(os.getenv("CHATFOOD_WEB_SEARCH_CONCURRENCY", "4"))
+SEARCH_TIMEOUT = float(os.getenv("CHATFOOD_WEB_SEARCH_TIMEOUT", "4"))
+MAX_RESULTS = 5
+BUSY_TIMEOUT_MS = 5000
+
+
+def normalize_query(query: str) -> str:
+    """کلید cache: سوال‌هایی که فقط در نویسه‌های فارسی/عربی، فاصله‌ها، حروف بزرگ و علائم پایانی فرق دارند یکی هستند."""
+    return normalize_text(query).strip(" ?؟!.،,")
+
+
+# ==================== backendهای جستجو ====================
+# هر backend یک name و یک متد همگام search(query, max_results) -> [{"title", "snippet", "link"}] دارد؛
+# متد search در thread pool همین ماژول اجرا می‌شود و هرگز event loop را مسدود نمی‌کند.
+class DuckDuckGoBackend:
+    name = "duckduckgo"
+
+    def __init__(self):
+        from langchain_community.utilities import DuckDuckGoSearchAPIWrapper
+        self._wrapper = DuckDuckGoSearchAPIWrapper()
+
+    def search(self, query: str, max_results: int) -> list:
+        return [{"title": r.get("title", ""), "snippet": r.get("snippet", ""), "link": r.get("link", "")}
+                for r in self._wrapper.results(query, max_results)]
+
+
+class FixtureBackend:
+    """
+    نتایج از یک فایل JSON به شکل {"سوال": [{"title", "snippet", "link"}, ...]} خوانده می‌شوند.
+    اگر سوال دقیقا در فایل نباشد، سوالی که بیشترین کلمه‌ی مشترک را دارد برگردانده می‌شود.
+    """
+    name = "fixture"
+
+    def __init__(self, path: str = None):
+        self.path = path or FIXTURES_PATH
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                fixtures = json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"!!! فایل نتایج ثابت جستجوی وب ({self.path}) خوانده نشد: {e}")
+            fixtures = {}
+        self._fixtures = {normalize_query(query): results for query, results in fixtures.items()}
+
+    def search(self, query: str, max_results: int) -> list:
+        key = normalize_query(query)
+        if key not in self._fixtures:
+            words = set(key.split())
+            overlap = {candidate: len(words & set(candidate.split())) for candidate in self._fixtures}
+            key = max(overlap, key=overlap.get, default=None)
+            if key is None or overlap[key] == 0:
+                return []
+        return self._fixtures[key][:max_results]
+
+
+BACKENDS = {"duckduckgo": DuckDuckGoBackend, "fixture": FixtureBackend}
+
+_backend = None
+_backend_lock = threading.Lock()
+
+def get_backend():
+    global _backend
+    if _backend is None:
+        with _backend_lock:
+            if _backend is None:
+                if WEB_SEARCH_BACKEND not in BACKENDS:
+                    raise ValueError(f"CHATFOOD_WEB_SEARCH_BACKEND نامعتبر است: {WEB_SEARCH_BACKEND} (گزینه‌ها: {', '.join(BACKENDS)})")
+                _backend = BACKENDS[WEB_SEARCH_BACKEND]()
+    return _backend
+
+def set_backend(backend):
+    """backend را جایگزین می‌کند (هر شیئی با name و search)؛ برای تست‌ها، بنچمارک‌ها و سرویس‌های جستجوی دیگر."""
+    global _backend
+    with _backend_lock:
+        _backend = backend
+
+
+# ==================== cache روی دیسک ====================
+class SearchCache:
+    """
+    نتایج هر سوال نرمال شده در SQLite با TTL و حذف LRU. ورودی منقضی شده تا زمان حذف نگه داشته می‌شود تا
+    اگر سرویس جستجو در دسترس نباشد یا دیر جواب دهد، به جای هیچ، نتیجه‌ی قدیمی برگردانده شود.
+    """
+
+    def __init__(self, path: str = None, ttl: float = None, max_entries: int = CACHE_MAX_ENTRIES):
+        self.path = path or CACHE_PATH
+        self.ttl = CACHE_TTL if ttl is None else ttl
+        self.max_entries = max_entries
+        self._local = threading.local()
+        self._pid = os.getpid()
+
+    def _conn(self) -> sqlite3.Connection:
+        if self._pid != os.getpid():
+            self._local, self._pid = threading.local(), os.getpid()
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=BUSY_TIMEOUT_MS / 1000, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("""CREATE TABLE IF NOT EXISTS web_search (
+                key TEXT PRIMARY KEY, results TEXT NOT NULL, created REAL NOT NULL, accessed REAL NOT NULL)""")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_web_search_accessed ON web_search(accessed)")
+            self._local.conn = conn
+        return conn
+
+    def get(self, key: str) -> tuple:
+        """(نتایج، تازه است یا نه)؛ یا (None, False) اگر چیزی ذخیره نشده باشد."""
+        conn = self._conn()
+        row = conn.execute("SELECT results, created FROM web_search WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None, False
+        conn.execute("UPDATE web_search SET accessed = ? WHERE key = ?", (time.time(), key))
+        return json.loads(row[0]), time.time() - row[1] < self.ttl
+
+    def put(self, key: str, results: list):
+        now = time.time()
+        conn = self._conn()
+        conn.execute(
+            "INSERT INTO web_search (key, results, created, accessed) VALUES (?, ?, ?, ?) "
+            "ON CONFLICT(key) DO UPDATE SET results = excluded.results, created = excluded.created, accessed = excluded.accessed",
+            (key, json.dumps(results, ensure_ascii=False), now, now),
+        )
+        conn.execute("""DELETE FROM web_search WHERE key IN (
+            SELECT key FROM web_search ORDER BY accessed DESC LIMIT -1 OFFSET ?)""", (self.max_entries,))
+
+    def clear(self):
+        self._conn().execute("DELETE FROM web_search")
+
+
+# ==================== جستجو ====================
+_cache = None
+_executor = None
+_semaphores = weakref.WeakKeyDictionary()  # event loop -> asyncio.Semaphore
+_inflight = {}  # (event loop, key) -> asyncio.Task
+_lock = threading.Lock()
+_stats = {"hits": 0, "misses": 0, "coalesced": 0, "stale": 0, "timeouts": 0, "errors": 0}
+
+
+def get_cache() -> SearchCache:
+    global _cache
+    if _cache is None:
+        with _lock:
+            if _cache is None:
+                _cache = SearchCache()
+    return _cache
+
+def _get_executor() -> ThreadPoolExecutor:
+    global _executor
+    if _executor is None:
+        with _lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(max_workers=MAX_CONCURRENCY, thread_name_prefix="web-search")
+    return _executor
+
+def _get_semaphore(loop) -> asyncio.Semaphore:
+    with _lock:
+        if loop not in _semaphores:
+            _semaphores[loop] = asyncio.Semaphore(MAX_CONCURRENCY)
+        return _semaphores[loop]
+
+def _count(name: str):
+    with _lock:
+        _stats[name] += 1
+
+def _reset_after_fork():
+    global _executor
+    _executor = None
+    _semaphores.clear()
+    _inflight.clear()
+
+os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+async def _fetch(backend, key: str, query: str, max_results: int, stale: list):
+    loop = asyncio.get_running_loop()
+    try:
+        with telemetry.span("web", backend.name):
+            async with asyncio.timeout(SEARCH_TIMEOUT):
+                async with _get_semaphore(loop):
+                    results = await loop.run_in_executor(_get_executor(), backend.search, query, max_results)
+    except TimeoutError:
+        _count("timeouts")
+        print(f"!!! جستجوی وب برای '{query}' در مهلت {SEARCH_TIMEOUT}s پاسخ نداد.")
+        return _fallback(stale)
+    except Exception as e:
+        _count("errors")
+        print(f"!!! خطا در جستجوی وب: {e}")
+        return _fallback(stale)
+    await asyncio.to_thread(get_cache().put, key, results)
+    return results
+
+def _fallback(stale: list) -> list:
+    if stale:
+        _count("stale")
+        return stale
+    return []
+
+async def search(query: str, max_results: int = MAX_RESULTS) -> list:
+    """
+    جستجوی وب با cache و مهلت: نتیجه‌ی تازه‌ی cache فورا برگردانده می‌شود، جستجوهای همزمان یک سوال فقط یک
+    درخواست به سرویس می‌فرستند و در صورت خطا یا تمام شدن مهلت نتیجه‌ی قدیمی cache (یا لیست خالی) برمی‌گردد.
+    اگر فراخواننده لغو شود (مثلا در fan_out)، جستجو در پس‌زمینه تمام و نتیجه‌اش ذخیره می‌شود.
+    """
+    backend = get_backend()
+    key = f"{backend.name}:{max_results}:{normalize_query(query)}"
+    cached, fresh = await asyncio.to_thread(get_cache().get, key)
+    telemetry.record_cache("web_search", fresh)
+    if fresh:
+        _count("hits")
+        return cached
+
+    loop = asyncio.get_running_loop()
+    with _lock:
+        task = _inflight.get((loop, key))
+        if task is None:
+            task = loop.create_task(_fetch(backend, key, query, max_results, cached))
+            _inflight[(loop, key)] = task
+            task.add_done_callback(lambda _: _inflight.pop((loop, key), None))
+            _stats["misses"] += 1
+        else:
+            _stats["coalesced"] += 1
+    return await asyncio.shield(task)
+
+
+def format_results(results: list) -> str:
+    if not results:
+        return "نتیجه‌ای در جستجوی وب پیدا نشد."
+    return "\n\n".join(f"{r['title']}: {r['snippet']}" + (f" ({r['link']})" if r.get("link") else "") for r in results)
+
+
+def get_stats() -> dict:
+    with _lock:
+        stats = dict(_stats)
+    lookups = stats["hits"] + stats["misses"] + stats["coalesced"]
+    stats["hit_rate"] = stats["hits"] / lookups if lookups else 0.0
+    stats["backend"] = getattr(_backend, "name", WEB_SEARCH_BACKEND)
+    return stats